@@ -5,21 +5,47 @@ Streamlitを使用したWebインターフェース
 
 import streamlit as st
 import os
-from PIL import Image
+import html
+from thumbnail_cache import get_thumbnail, pick_thumbnail_size
+from static_images import IMAGE_SERVING_MODE, image_url, original_url, start_image_server
+import tracing
+from tracing import span, traced
+from metrics import METRICS_PORT, SEARCH_REQUESTS, start_metrics_server
+from structured_log import get_logger
 # import time # 強制ログテスト用に追加
 
+log = get_logger("app")
+
 # クラウド環境対応のキャッシュ設定
 @st.cache_resource
 def load_clip_model():
-    """CLIPモデルのロードをキャッシュ"""
-    from clip_feature_extractor import extract_text_features
-    return extract_text_features
+    """CLIPモデルのロードをキャッシュ（EMBEDDING_SERVER_SOCKET 指定時は共有モデルサーバーを使用）"""
+    from embedding_server import get_text_encoder
+    return get_text_encoder()
+
+@st.cache_resource
+def ensure_image_server():
+    """ローカル静的ファイルサーバーを1度だけ起動（server モード）"""
+    return start_image_server()
+
+@st.cache_resource
+def ensure_metrics_server():
+    """メトリクスの公開サーバーを1度だけ起動（METRICS_PORT=0 で無効）"""
+    if not METRICS_PORT:
+        return None
+    try:
+        return start_metrics_server()
+    except OSError as e:
+        # 同じポートを別のプロセスが使用中の場合は公開しない（アプリは継続）
+        log.warning("metrics.server_unavailable", port=METRICS_PORT, error=str(e))
+        return None
 
 # データベース関数のインポート
 try:
     from database_utils import (
         search_similar_images, 
-        get_all_images_by_category, 
+        search_similar_to_image,
+        get_images_page,
         get_database_stats,
         check_database_exists
     )
@@ -28,6 +54,12 @@ except ImportError as e:
     st.error(f"データベースモジュールの読み込みエラー: {e}")
     st.stop()
 
+# ギャラリーの1ページあたりの画像数（環境変数 GALLERY_PAGE_SIZE で既定値を変更可能）
+GALLERY_PAGE_SIZE_OPTIONS = [20, 40, 80, 160]
+GALLERY_PAGE_SIZE = int(os.environ.get("GALLERY_PAGE_SIZE", 40))
+if GALLERY_PAGE_SIZE not in GALLERY_PAGE_SIZE_OPTIONS:
+    GALLERY_PAGE_SIZE_OPTIONS = sorted(GALLERY_PAGE_SIZE_OPTIONS + [GALLERY_PAGE_SIZE])
+
 # ページ設定
 st.set_page_config(
     page_title="CLIP画像検索デモ",
@@ -64,6 +96,18 @@ st.markdown("""
     font-size: 0.8rem;
     margin-right: 0.5rem;
 }
+.result-image {
+    margin: 0 0 1rem 0;
+}
+.result-image img {
+    max-width: 100%;
+    border-radius: 4px;
+}
+.result-image figcaption {
+    font-size: 0.8rem;
+    color: #666;
+    text-align: center;
+}
 .debug-box {
     background-color: #f8f9fa;
     border: 1px solid #dee2e6;
@@ -92,6 +136,7 @@ def check_setup():
         """)
         st.stop()
 
+@traced()
 def display_image_safely(image_path, caption="", width=None):
     """画像を安全に表示"""
     try:
@@ -103,10 +148,34 @@ def display_image_safely(image_path, caption="", width=None):
                 st.error(f"画像ファイルが見つかりません: {image_path}")
                 return
         
-        image = Image.open(image_path)
-        if width and width < 300:
-            image.thumbnail((width * 2, width * 2), Image.Resampling.LANCZOS)
-        st.image(image, caption=caption, width=width)
+        size = pick_thumbnail_size(width)
+        
+        if IMAGE_SERVING_MODE == "inline":
+            # 表示幅に合ったサムネイルをディスクキャッシュから取得（なければ生成）
+            with span("thumbnail"):
+                thumb_path = get_thumbnail(image_path, size)
+            st.image(thumb_path, caption=caption, width=width)
+            return
+        
+        if IMAGE_SERVING_MODE == "server":
+            ensure_image_server()
+        
+        # 画像データは送らず、静的配信URLを参照する <img> のみ送信
+        # （元画像が事前に公開されていればクリックで元画像を開く。表示時に公開するのはサムネイルのみ）
+        with span("thumbnail"):
+            thumbnail_url = image_url(image_path, size)
+            link_url = original_url(image_path)
+        style = f"width: {width}px" if width else "width: 100%"
+        caption_html = ""
+        if caption:
+            caption_html = "<figcaption>" + html.escape(caption).replace("\n", "<br>") + "</figcaption>"
+        image_html = f'<img src="{thumbnail_url}" style="{style}" loading="lazy">'
+        if link_url:
+            image_html = f'<a href="{link_url}" target="_blank">{image_html}</a>'
+        st.markdown(
+            f'<figure class="result-image">{image_html}{caption_html}</figure>',
+            unsafe_allow_html=True
+        )
         
     except Exception as e:
         st.error(f"画像表示エラー: {str(e)}")
@@ -159,7 +228,8 @@ def search_page():
     # ▼ 1. 検索実行と状態保存のロジック
     # ----------------------------------------------------
     if search_button and search_query:
-        with st.spinner("検索中..."):
+        with st.spinner("検索中..."), span("search"):
+            SEARCH_REQUESTS.inc(kind="text", source="app")
             try:
                 extract_text_features = load_clip_model()
                 query_vector = extract_text_features(search_query)
@@ -168,175 +238,243 @@ def search_page():
                 if results:
                     session_id = search_logger.log_search_query(search_query, results)
                     
-                    # 検索結果をセッションステートに保存
+                    # 検索結果をセッションステートに保存（同じ実行内で下の結果表示に渡す）
                     st.session_state['current_search_session'] = session_id
                     st.session_state['search_results'] = results
                     st.session_state['search_query'] = search_query
                     
                     st.success(f"✅ 上位10件の結果を表示")
-                    # 検索直後に再実行して、下の結果表示ロジックに処理を移す
-                    st.rerun() 
                 else:
                     st.warning("⚠️ 検索結果が見つかりませんでした")
                     # 以前の結果が残っている可能性があるのでクリアする
-                    for key in ['current_search_session', 'search_results', 'search_query']:
-                        if key in st.session_state:
-                            del st.session_state[key]
+                    clear_search_state()
 
             except Exception as e:
                 st.error(f"❌ 検索エラー: {str(e)}")
 
     # --------------------------------------------------------------------
     # ▼ 2. 結果表示とフィードバックボタン処理のロジック
-    #    session_stateに結果がある場合にのみ、このブロック全体が実行される
+    #    session_stateに結果がある場合にのみ表示する
     # --------------------------------------------------------------------
     if 'search_results' in st.session_state and st.session_state['search_results']:
-        results = st.session_state['search_results']
-        session_id = st.session_state['current_search_session']
+        search_results_fragment()
 
-        st.subheader(f"「{st.session_state['search_query']}」の検索結果")
+def run_similar_search(image_id, filename):
+    """
+    「似た画像」ボタンのコールバック
+    
+    保存済みの画像ベクトルでそのまま検索するため、モデルの推論は行わない。
+    その画像自身と同じ落とし物の別撮影の画像は結果から除外する。
+    """
+    search_query = f"🔎 {filename} に似た画像"
+    SEARCH_REQUESTS.inc(kind="similar", source="app")
+    try:
+        with span("similar_search"):
+            results = search_similar_to_image(image_id, 10)
+    except Exception as e:
+        st.toast(f"❌ 類似画像検索エラー: {str(e)}")
+        return
+    
+    if not results:
+        st.toast("⚠️ 類似画像が見つかりませんでした")
+        return
+    
+    clear_search_state()
+    with span("similar_search_log"):
+        st.session_state['current_search_session'] = search_logger.log_search_query(search_query, results)
+    st.session_state['search_results'] = results
+    st.session_state['search_query'] = search_query
+    # ギャラリーから押された場合は検索ページに切り替える
+    st.session_state['page'] = "🔍 画像検索"
 
-        # 各検索結果をループで表示
-        for i, (similarity, image_id, filename, category, description, file_path) in enumerate(results):
-            with st.container():
-                st.markdown('<div class="result-container">', unsafe_allow_html=True)
-                
-                col1, col2, col3 = st.columns([1, 2, 1])
-                
-                with col1:
-                    display_image_safely(file_path, width=200)
-                
-                with col2:
-                    st.markdown(f"**順位:** {i+1}")
-                    st.markdown(f'<span class="category-badge">{category}</span>', unsafe_allow_html=True)
-                    st.markdown(f'<span class="similarity-score">類似度: {similarity:.3f}</span>', unsafe_allow_html=True)
-                    st.markdown(f"**ファイル名:** {filename}")
-                    st.markdown(f"**説明:** {description}")
+def similar_button(image_id, filename, key):
+    """「似た画像」ボタン"""
+    st.button("🔎 似た画像", key=key, on_click=run_similar_search, args=(image_id, filename),
+              help="この画像に似た画像を検索（同じ落とし物の別撮影は除外）")
 
-                with col3:
-                    # 「正解」ボタン
-                    button_key = f"correct_{i}_{session_id}"
-                    if st.button(f"✅ 正解", key=button_key, type="secondary"):
-                        placeholder = st.empty()
-                        placeholder.info(f"第{i+1}位を正解として記録中...")
-                        
-                        try:
-                            result = search_logger.log_user_feedback(session_id, i + 1)
-                            if result:
-                                placeholder.success(f"✅ 第{i+1}位を正解として記録しました！")
-                                for key in ['current_search_session', 'search_results', 'search_query']:
-                                    if key in st.session_state: del st.session_state[key]
-                                # time.sleep(1) # コメントアウト
-                                st.rerun()
-                            else:
-                                placeholder.error("❌ Google Sheetsへの記録に失敗しました。")
-                        except Exception as e:
-                            placeholder.error(f"❌ 記録処理でエラーが発生しました: {str(e)}")
-                
-                st.markdown('</div>', unsafe_allow_html=True)
+def clear_search_state():
+    """検索結果とフィードバック状態をセッションステートから削除"""
+    for key in ['current_search_session', 'search_results', 'search_query', 'feedback_result']:
+        if key in st.session_state:
+            del st.session_state[key]
+
+@st.fragment
+@traced("render_results")
+def search_results_fragment():
+    """
+    検索結果一覧（部分再実行の単位）
+    
+    フィードバックボタンはさらに個別のフラグメントになっているため、
+    ボタンを押しても結果一覧の画像は再送信されない
+    """
+    results = st.session_state['search_results']
+    session_id = st.session_state['current_search_session']
+
+    st.subheader(f"「{st.session_state['search_query']}」の検索結果")
+
+    # 各検索結果をループで表示
+    for i, (similarity, image_id, filename, category, description, file_path) in enumerate(results):
+        with st.container():
+            st.markdown('<div class="result-container">', unsafe_allow_html=True)
+            
+            col1, col2, col3 = st.columns([1, 2, 1])
+            
+            with col1:
+                display_image_safely(file_path, width=200)
+            
+            with col2:
+                st.markdown(f"**順位:** {i+1}")
+                st.markdown(f'<span class="category-badge">{category}</span>', unsafe_allow_html=True)
+                st.markdown(f'<span class="similarity-score">類似度: {similarity:.3f}</span>', unsafe_allow_html=True)
+                st.markdown(f"**ファイル名:** {filename}")
+                st.markdown(f"**説明:** {description}")
+
+            with col3:
+                # 「正解」ボタン
+                feedback_fragment(session_id, i + 1, "✅ 正解", f"第{i+1}位を正解",
+                                  key=f"correct_{i}_{session_id}")
+                similar_button(image_id, filename, key=f"similar_{i}_{session_id}")
+            
+            st.markdown('</div>', unsafe_allow_html=True)
+    
+    # --------------------------------------------------
+    # ▼ 「正解なし」「フリー検索」ボタン
+    # --------------------------------------------------
+    st.markdown("---")
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    with col2:
+        # ランクをNoneとしてフィードバックを記録
+        feedback_fragment(session_id, None, "❌ 正解なし", "「正解なし」",
+                          key=f"no_answer_{session_id}", use_container_width=True)
+    with col3:
+        feedback_fragment(session_id, None, "🆓 フリー検索", "「フリー検索」",
+                          key=f"free_search_{session_id}", use_container_width=True)
+
+@st.fragment
+def feedback_fragment(session_id, correct_rank, button_label, feedback_label, key, use_container_width=False):
+    """
+    フィードバックボタン（部分再実行の単位）
+    
+    クリック時はこのフラグメントのみが再実行され、記録結果もこの中に表示される。
+    記録済みのセッションではボタンを無効化する。
+    """
+    feedback_result = st.session_state.get('feedback_result')
+    if feedback_result and feedback_result[0] == session_id:
+        st.button(button_label, key=key, disabled=True, use_container_width=use_container_width)
+        if feedback_result[1] == key:
+            st.success(f"✅ {feedback_label}として記録しました！")
+        return
+    
+    if st.button(button_label, key=key, type="secondary", use_container_width=use_container_width):
+        placeholder = st.empty()
+        placeholder.info(f"{feedback_label}として記録中...")
         
-        # --------------------------------------------------
-        # ▼ 「正解なし」ボタンも同じブロック内で処理
-        # --------------------------------------------------
-        st.markdown("---")
-        col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
-        with col2:
-            no_answer_key = f"no_answer_{session_id}"
-            if st.button("❌ 正解なし", key=no_answer_key, type="secondary", use_container_width=True):
-                placeholder = st.empty()
-                placeholder.info("「正解なし」として記録中...")
-                
-                try:
-                    # ランクをNoneとしてフィードバックを記録
-                    result = search_logger.log_user_feedback(session_id, None) 
-                    
-                    if result:
-                        placeholder.success("✅ 「正解なし」として記録しました。")
-                        
-                        # 成功したらセッションをクリアして初期状態に戻す
-                        for key in ['current_search_session', 'search_results', 'search_query']:
-                            if key in st.session_state:
-                                del st.session_state[key]
-                        
-                        # time.sleep(1) # コメントアウト
-                        st.rerun()
-                    else:
-                        placeholder.error("❌ Google Sheetsへの記録に失敗しました。")
-                
-                except Exception as e:
-                    placeholder.error(f"❌ 記録処理でエラーが発生しました: {str(e)}")
-        with col3:
-            if st.button("🆓 フリー検索", key="free_search", type="secondary", use_container_width=True):
-                placeholder = st.empty()
-                placeholder.info("「フリー検索」として記録中...")
-                
-                try:
-                    # ランクをNoneとしてフィードバックを記録
-                    result = search_logger.log_user_feedback(session_id, None) 
-                    
-                    if result:
-                        placeholder.success("✅ 「フリー検索」として記録しました。")
-                        
-                        # 成功したらセッションをクリアして初期状態に戻す
-                        for key in ['current_search_session', 'search_results', 'search_query']:
-                            if key in st.session_state:
-                                del st.session_state[key]
-                        
-                        # time.sleep(1) # コメントアウト
-                        st.rerun()
-                    else:
-                        placeholder.error("❌ Google Sheetsへの記録に失敗しました。")
-                
-                except Exception as e:
-                    placeholder.error(f"❌ 記録処理でエラーが発生しました: {str(e)}")
+        try:
+            result = search_logger.log_user_feedback(session_id, correct_rank)
+            if result:
+                st.session_state['feedback_result'] = (session_id, key)
+                placeholder.success(f"✅ {feedback_label}として記録しました！")
+            else:
+                placeholder.error("❌ Google Sheetsへの記録に失敗しました。")
+        except Exception as e:
+            placeholder.error(f"❌ 記録処理でエラーが発生しました: {str(e)}")
 
 def gallery_page():
-    """全画像表示ページ"""
+    """全画像表示ページ（ページ単位で取得・表示）"""
     st.markdown('<h1 class="main-header">🖼️ 画像ギャラリー</h1>', unsafe_allow_html=True)
     
-    # カテゴリ別画像取得
-    category_data = get_all_images_by_category()
+    # カテゴリ別件数のみ取得（画像一覧はページ単位で取得）
+    category_counts = get_database_stats()['category_counts']
     
-    if not category_data:
+    if not category_counts:
         st.warning("⚠️ 画像データが見つかりません")
         return
     
     # カテゴリ選択
     selected_category = st.selectbox(
         "カテゴリを選択",
-        options=["全て"] + list(category_data.keys()),
+        options=["全て"] + list(category_counts.keys()),
         index=0
     )
     
-    # 1行あたりの画像数
-    images_per_row = st.slider("1行あたりの画像数", 2, 6, 4)
+    col1, col2 = st.columns(2)
+    with col1:
+        # 1行あたりの画像数
+        images_per_row = st.slider("1行あたりの画像数", 2, 6, 4)
+    with col2:
+        # 1ページあたりの画像数
+        page_size = st.selectbox(
+            "1ページあたりの画像数",
+            options=GALLERY_PAGE_SIZE_OPTIONS,
+            index=GALLERY_PAGE_SIZE_OPTIONS.index(GALLERY_PAGE_SIZE)
+        )
     
-    # 画像表示
-    if selected_category == "全て":
-        for category, images in category_data.items():
-            st.subheader(f"📁 {category} ({len(images)}件)")
-            
-            for i in range(0, len(images), images_per_row):
-                cols = st.columns(images_per_row)
-                for j in range(images_per_row):
-                    if i + j < len(images):
-                        image_id, filename, description, file_path = images[i + j]
-                        with cols[j]:
-                            display_image_safely(file_path, caption=f"{filename}\n{description}")
-            
-            st.divider()
-    else:
-        if selected_category in category_data:
-            images = category_data[selected_category]
-            st.subheader(f"📁 {selected_category} ({len(images)}件)")
-            
-            for i in range(0, len(images), images_per_row):
-                cols = st.columns(images_per_row)
-                for j in range(images_per_row):
-                    if i + j < len(images):
-                        image_id, filename, description, file_path = images[i + j]
-                        with cols[j]:
-                            display_image_safely(file_path, caption=f"{filename}\n{description}")
+    category = None if selected_category == "全て" else selected_category
+    total = sum(category_counts.values()) if category is None else category_counts.get(category, 0)
+    total_pages = max(1, (total + page_size - 1) // page_size)
+    
+    # カテゴリやページサイズを変えたら1ページ目に戻す
+    page = st.number_input(
+        f"ページ（全{total_pages}ページ / {total}件）",
+        min_value=1,
+        max_value=total_pages,
+        value=1,
+        step=1,
+        key=f"gallery_page_{selected_category}_{page_size}"
+    )
+    
+    images = get_images_page(category, limit=page_size, offset=(page - 1) * page_size)
+    
+    # 画像表示（カテゴリが切り替わる位置で見出しを表示）
+    with span("render_gallery"):
+        render_gallery_images(images, category_counts, images_per_row)
+
+def render_gallery_images(images, category_counts, images_per_row):
+    """ギャラリーの1ページ分の画像を表示"""
+    start = 0
+    while start < len(images):
+        current_category = images[start][2]
+        end = start
+        while end < len(images) and images[end][2] == current_category:
+            end += 1
+        
+        st.subheader(f"📁 {current_category} ({category_counts.get(current_category, 0)}件)")
+        group = images[start:end]
+        for i in range(0, len(group), images_per_row):
+            cols = st.columns(images_per_row)
+            for j in range(images_per_row):
+                if i + j < len(group):
+                    image_id, filename, _, description, file_path = group[i + j]
+                    with cols[j]:
+                        display_image_safely(file_path, caption=f"{filename}\n{description}")
+                        similar_button(image_id, filename, key=f"gallery_similar_{image_id}")
+        
+        st.divider()
+        start = end
+
+def tracing_panel():
+    """サイドバーにスパンごとの所要時間（p50/p95/p99）を表示"""
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("### ⏱️ レイテンシ（ms）")
+    stats = tracing.get_stats()
+    if not stats:
+        st.sidebar.caption("計測データはまだありません")
+        return
+    
+    rows = [
+        {"スパン": path, "件数": s["count"], "p50": s["p50_ms"], "p95": s["p95_ms"], "p99": s["p99_ms"]}
+        for path, s in sorted(stats.items())
+    ]
+    st.sidebar.dataframe(rows, hide_index=True, use_container_width=True)
+    
+    col1, col2 = st.sidebar.columns(2)
+    with col1:
+        st.download_button("JSON出力", tracing.export_json(), file_name="latency_traces.json",
+                           mime="application/json", use_container_width=True)
+    with col2:
+        if st.button("リセット", key="tracing_reset", use_container_width=True):
+            tracing.reset()
+            st.rerun()
 
 def main():
     """メイン処理"""
@@ -348,7 +486,8 @@ def main():
     page = st.sidebar.radio(
         "ページを選択",
         ["🔍 画像検索", "🖼️ ギャラリー"],
-        index=0
+        index=0,
+        key="page"
     )
     
     # 統計情報をサイドバーに表示
@@ -404,11 +543,13 @@ def main():
     #     else:
     #         st.sidebar.text("デバッグ情報はありません")
     
-    # Google Sheets 接続状態の表示
-    if search_logger.worksheet:
-        st.sidebar.success("✅ Google Sheets 接続済み")
+    # ログの書き込み先（Google Sheets / ローカル）の接続状態の表示
+    if search_logger.status == "connecting":
+        st.sidebar.info(f"⏳ {search_logger.sink.label} 接続中...")
+    elif search_logger.is_connected():
+        st.sidebar.success(f"✅ {search_logger.sink.label} 接続済み")
     else:
-        st.sidebar.error("❌ Google Sheets 未接続")
+        st.sidebar.error(f"❌ {search_logger.sink.label} 未接続")
     
     # Streamlit secrets の確認
     if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
@@ -557,6 +698,14 @@ def main():
         '</div>',
         unsafe_allow_html=True
     )
+    
+    # レイテンシ計測（環境変数 TRACING=1 のときのみ表示）
+    if tracing.is_enabled():
+        tracing_panel()
+    
+    # ログの書き込み先への接続は、初回の描画を送り終えてからバックグラウンドで開始する
+    search_logger.start()
+    ensure_metrics_server()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
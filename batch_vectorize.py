@@ -8,9 +8,14 @@ import os
 import csv
 import sqlite3
 import sqlite_vec
+import argparse
 import numpy as np
+from datetime import datetime
 from tqdm import tqdm
-from database_setup import DB_PATH, setup_database
+from database_setup import (
+    DB_PATH, DB_KEEP_VERSIONS, setup_database, connect_writer, finalize_database, new_version_path,
+    get_published_db_path, validate_database, publish_database, prune_versions, read_index_info, write_index_info
+)
 import sys
 
 # データディレクトリのパス
@@ -51,18 +56,16 @@ def load_label_data():
     print(f"読み込み完了: {len(image_data)}件の画像データ")
     return image_data
 
-def extract_and_save_features(image_data):
+def extract_and_save_features(image_data, db_path=DB_PATH):
     """画像の特徴量を抽出してデータベースに保存"""
     
-    # 一度だけCLIPモデルを初期化
-    from clip_feature_extractor import CLIPFeatureExtractor
-    extractor = CLIPFeatureExtractor()
+    # 一度だけエンコーダーを初期化（ENCODER_BACKEND、既定はCLIPモデル）
+    from encoders import get_encoder
+    extractor = get_encoder()
+    print(f"エンコーダー: {extractor.name}")
     
-    # データベース接続
-    conn = sqlite3.connect(DB_PATH)
-    conn.enable_load_extension(True)
-    sqlite_vec.load(conn)
-    conn.enable_load_extension(False)
+    # データベース接続（WAL モードの書き込み用接続）
+    conn = connect_writer(db_path)
     cursor = conn.cursor()
     
     successful_count = 0
@@ -115,15 +118,20 @@ def extract_and_save_features(image_data):
     conn.commit()
     conn.close()
     
+    # 検索時に同じエンコーダーを使っているか確認できるよう記録
+    write_index_info(db_path, encoder=extractor.name, dim=extractor.dim,
+                     created_at=datetime.now().isoformat(), images=successful_count)
+    finalize_database(db_path)
+    
     print(f"\n処理完了:")
     print(f"  成功: {successful_count}件")
     print(f"  エラー: {error_count}件")
     
     return successful_count, error_count
 
-def verify_data():
+def verify_data(db_path=DB_PATH):
     """データベースの内容を確認"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
@@ -156,8 +164,41 @@ def verify_data():
     
     conn.close()
 
+# 公開中のデータベースに比べて件数がこの割合を下回る場合は、データの欠落とみなして公開しない
+MIN_PUBLISH_RATIO = 0.5
+
+def check_publishable(db_path, published_path):
+    """
+    公開中のデータベースと比べて、置き換えてよいか確認
+    
+    Returns:
+        List[str]: 公開を止める理由（--force で無視できる）
+    """
+    if not os.path.exists(published_path) or os.path.abspath(db_path) == os.path.abspath(published_path):
+        return []
+    reasons = []
+    new_info = read_index_info(db_path)
+    published_info = read_index_info(published_path)
+    if published_info.get('encoder') and published_info['encoder'] != new_info.get('encoder'):
+        # 検索側のエンコーダー（ENCODER_BACKEND）も合わせて切り替える必要がある
+        reasons.append(f"エンコーダーが {published_info['encoder']} から {new_info.get('encoder')} に変わります")
+    conn = sqlite3.connect(published_path)
+    published_count = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+    conn.close()
+    new_count = int(new_info.get('images', 0))
+    if new_count < published_count * MIN_PUBLISH_RATIO:
+        reasons.append(f"画像の件数が {published_count}件 から {new_count}件 に減ります")
+    return reasons
+
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description="CLIP画像ベクトル化バッチ処理")
+    parser.add_argument("--in-place", action="store_true",
+                        help=f"新しい版を作らず {DB_PATH} を直接作り直す（デプロイ用のファイルを更新する場合）")
+    parser.add_argument("--force", action="store_true", help="エンコーダーの変更や件数の大幅な減少があっても公開する")
+    parser.add_argument("--keep-versions", type=int, default=DB_KEEP_VERSIONS, help="残す版の数")
+    args = parser.parse_args()
+    
     print("=== CLIP画像ベクトル化バッチ処理 ===")
     
     # データディレクトリの存在確認
@@ -169,9 +210,10 @@ def main():
         print(f"エラー: ラベルディレクトリが見つかりません: {DATA_LABEL_DIR}")
         sys.exit(1)
     
-    # データベースセットアップ
+    # データベースセットアップ（公開中のファイルには触れず、新しい版のファイルに作成する）
     print("1. データベースセットアップ...")
-    setup_database()
+    db_path = DB_PATH if args.in_place else new_version_path()
+    setup_database(db_path)
     
     # ラベルデータ読み込み
     print("\n2. ラベルデータ読み込み...")
@@ -183,11 +225,42 @@ def main():
     
     # 特徴量抽出とデータベース保存
     print("\n3. 特徴量抽出とデータベース保存...")
-    successful_count, error_count = extract_and_save_features(image_data)
+    successful_count, error_count = extract_and_save_features(image_data, db_path)
     
     # データベース内容確認
     print("\n4. データベース内容確認...")
-    verify_data()
+    verify_data(db_path)
+    
+    # サムネイル事前生成と元画像の公開（アプリ表示時のデコードとコピーを省略するため。公開前に済ませておく）
+    print("\n5. サムネイル事前生成と元画像の公開...")
+    from thumbnail_cache import pregenerate_thumbnails
+    thumb_stats = pregenerate_thumbnails(data['file_path'] for data in image_data.values())
+    print(f"  生成: {thumb_stats['generated']}件 / キャッシュ済み: {thumb_stats['cached']}件 / エラー: {thumb_stats['errors']}件")
+    # 元画像も公開しておく（表示時は公開済みの一覧からリンク先を引くだけにする）
+    from static_images import publish_originals
+    original_stats = publish_originals(data['file_path'] for data in image_data.values())
+    print(f"  元画像の公開: {original_stats['published']}件 / エラー: {original_stats['errors']}件")
+    
+    # 検証して公開（ポインターファイルの置き換え。起動中のアプリは次のクエリから新しい版を使う）
+    print("\n6. 検証と公開...")
+    problems = validate_database(db_path, expected_count=successful_count)
+    if problems:
+        for problem in problems:
+            print(f"  エラー: {problem}")
+        print(f"検証に失敗したため公開しません: {db_path}")
+        sys.exit(1)
+    if args.in_place:
+        print(f"  {DB_PATH} を直接作り直しました")
+    else:
+        reasons = check_publishable(db_path, get_published_db_path())
+        if reasons and not args.force:
+            for reason in reasons:
+                print(f"  警告: {reason}")
+            print(f"公開を中止しました（--force で公開）: {db_path}")
+            sys.exit(1)
+        publish_database(db_path)
+        for path in prune_versions(args.keep_versions):
+            print(f"  古い版を削除しました: {path}")
     
     print("\n=== 処理完了 ===")
 
@@ -0,0 +1,174 @@
+"""
+検索側のデータベース接続の同時実行ベンチマーク
+
+合成データ（synthetic_catalog.py）のデータベースに対し、複数のスレッドから検索（8割）とギャラリーの
+ページ取得（2割）を送り続け、接続の設定ごとのスループットとレイテンシを比較する。
+
+接続の設定:
+    legacy    : 変更前（読み書き可能な接続、mmap なし。取り込み側はロールバックジャーナル）
+    ro        : 読み取り専用（mode=ro）+ mmap。取り込み側は WAL
+    immutable : 書き換えない版のファイル（immutable=1）+ mmap（取り込み中のファイルには使えないため reading のみ）
+
+負荷:
+    reading   : 検索のみ
+    ingesting : 同じファイルに取り込み（--writer-rate 件/秒、50件ごとにコミット）を行いながら検索
+
+使用方法:
+    python bench_db_concurrency.py
+    python bench_db_concurrency.py --items 100000 --concurrency 1 4 8 --duration 10
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+from typing import Callable
+import numpy as np
+import database_utils
+from batch_vectorize import CATEGORIES
+from database_setup import connect_database, connect_writer
+from loadtest import ProcessSampler, git_revision, run_stage
+from synthetic_catalog import generate_catalog, generate_rows
+
+OUTPUT_DIR = os.path.join("logs", "db_concurrency")
+
+CONFIGS = ("legacy", "ro", "immutable")
+WORKLOADS = ("reading", "ingesting")
+
+# ro / immutable で使う mmap のサイズ（database_utils の既定値。DB_MMAP_SIZE で変更）
+MMAP_SIZE = database_utils.DB_MMAP_SIZE
+
+# 検索とページ取得の割合
+OPERATIONS = ["search"] * 8 + ["page"] * 2
+WRITER_BATCH_SIZE = 50
+
+def configure(config: str, db_path: str):
+    """database_utils の接続設定を切り替える"""
+    database_utils.DB_PATH = db_path
+    database_utils.DB_POINTER_PATH = None
+    database_utils.DB_READ_ONLY = config != "legacy"
+    database_utils.DB_MMAP_SIZE = 0 if config == "legacy" else MMAP_SIZE
+    # immutable は書き換えない版のファイルとして扱う（DB_VERSIONS_DIR 内のファイルと同じ）
+    database_utils.DB_VERSIONS_DIR = os.path.dirname(db_path) if config == "immutable" else "db_versions"
+
+def make_reader(n_items: int, top_k: int, seed: int) -> Callable[[str], None]:
+    """検索・ページ取得を1回行う関数"""
+    vectors = np.random.default_rng(seed).standard_normal((256, 512)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rng = random.Random(seed)
+
+    def call(operation: str):
+        if operation == "search":
+            database_utils.search_similar_images(vectors[rng.randrange(len(vectors))], top_k)
+        else:
+            category = rng.choice(CATEGORIES)
+            database_utils.get_images_page(category, 40, rng.randrange(max(1, n_items // len(CATEGORIES) - 40)))
+    return call
+
+def run_writer(db_path: str, wal: bool, rows_per_second: float, start_id: int,
+               stop: threading.Event, result: dict):
+    """stop されるまで rows_per_second 件/秒で画像を追加（WRITER_BATCH_SIZE 件ごとにコミット）"""
+    conn = connect_writer(db_path) if wal else connect_database(db_path)
+    written, commit_seconds = 0, []
+    batches = generate_rows(10 ** 9, seed=start_id, chunk_size=WRITER_BATCH_SIZE)
+    next_time = time.perf_counter()
+    while not stop.is_set():
+        rows, vectors = next(batches)
+        rows = [(start_id + written + i + 1,) + row[1:] for i, row in enumerate(rows)]
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(
+                "INSERT INTO images (id, filename, category, description, file_path) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO image_vectors (id, embedding) VALUES (?, ?)",
+                ((row[0], vector.tobytes()) for row, vector in zip(rows, vectors)))
+        commit_seconds.append(time.perf_counter() - start)
+        written += len(rows)
+        next_time += len(rows) / rows_per_second
+        stop.wait(max(0.0, next_time - time.perf_counter()))
+    conn.close()
+    result["rows"] = written
+    result["commit_max_ms"] = round(max(commit_seconds, default=0.0) * 1000, 3)
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="検索側のデータベース接続の同時実行ベンチマーク")
+    parser.add_argument("--items", type=int, default=20000, help="合成データの件数")
+    parser.add_argument("--configs", nargs="+", choices=CONFIGS, default=list(CONFIGS), help="接続の設定")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS), help="負荷")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="検索のスレッド数")
+    parser.add_argument("--duration", type=float, default=5, help="1計測あたりの時間（秒）")
+    parser.add_argument("--writer-rate", type=float, default=200, help="取り込みの件数/秒（ingesting）")
+    parser.add_argument("--top-k", type=int, default=10, help="取得件数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--output", help="結果の保存先（既定は logs/db_concurrency/<日時>_<コミット>.json）")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_db_concurrency_")
+    base_path = os.path.join(work_dir, "base.db")
+    print(f"合成データを作成中: {args.items:,} 件")
+    generate_catalog(base_path, args.items, seed=args.seed)
+
+    sampler = ProcessSampler()
+    operations = [random.Random(args.seed + i).choice(OPERATIONS) for i in range(1000)]
+    revision = git_revision()
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_revision": revision,
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "stages": [],
+    }
+
+    try:
+        for workload in args.workloads:
+            print(f"\n=== {workload} ===")
+            for config in args.configs:
+                if workload == "ingesting" and config == "immutable":
+                    continue
+                for concurrency in args.concurrency:
+                    # 取り込みでファイルが変わるため、計測ごとに作り直したファイルを使う
+                    db_path = os.path.join(work_dir, f"{workload}_{config}_{concurrency}.db")
+                    shutil.copyfile(base_path, db_path)
+                    configure(config, db_path)
+                    stop, writer_result = threading.Event(), {}
+                    writer = None
+                    if workload == "ingesting":
+                        writer = threading.Thread(
+                            target=run_writer,
+                            args=(db_path, config != "legacy", args.writer_rate, args.items, stop, writer_result))
+                        writer.start()
+                    stage = run_stage(make_reader(args.items, args.top_k, args.seed), operations, concurrency,
+                                      args.duration, args.duration, sampler)
+                    stop.set()
+                    if writer:
+                        writer.join()
+                    stage.pop("timeline")
+                    stage.update({"workload": workload, "config": config, "writer": writer_result})
+                    report["stages"].append(stage)
+                    os.remove(db_path)
+
+                    error_text = f"  エラー {sum(stage['errors'].values())}件" if stage["errors"] else ""
+                    writer_text = (f"  取り込み {writer_result['rows']}件（コミット最大 {writer_result['commit_max_ms']:.0f} ms）"
+                                   if writer_result else "")
+                    print(f"  {config:<9} 同時{concurrency:>3}: {stage['throughput']:8.1f} 件/秒  "
+                          f"p50 {stage['p50_ms']:7.2f} ms  p99 {stage['p99_ms']:8.2f} ms  "
+                          f"最大 {stage['max_ms']:8.2f} ms{error_text}{writer_text}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+if __name__ == "__main__":
+    main()
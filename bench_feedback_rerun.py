@@ -0,0 +1,96 @@
+"""
+フィードバックボタンのクリック1回あたりのサーバー処理時間を計測するベンチマーク
+
+Streamlitのヘッドレステスト（AppTest）の公開APIで検索ページを実行し、以下を比較する:
+  - 変更前: フラグメント導入前の app.py を git から取得して実行
+    （クリックで結果を消去して st.rerun() し、スクリプト全体をもう一度実行する）
+  - 変更後: 現在の app.py
+
+AppTest にはフラグメント単位で再実行する公開APIがなく、変更後もクリックごとにスクリプト全体を
+実行するため、変更後の値はフラグメント再実行の上限になる（ブラウザではボタンのフラグメントのみが再実行される）。
+
+CLIPモデルとGoogle Sheetsは使用しない（検索結果はDBからランダムなベクトルで取得し、
+フィードバックの書き込みはスタブに置き換える）。
+
+使用方法:
+    python bench_feedback_rerun.py [--repeat 20] [--baseline-rev 8c0ef1c~1]
+"""
+
+import os
+import time
+import argparse
+import subprocess
+import statistics
+from typing import Optional
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+
+# フラグメント導入コミットの直前（変更前の app.py）
+BASELINE_REV = "8c0ef1c~1"
+
+def load_baseline_source(rev: str) -> str:
+    """git から変更前の app.py のソースを取得"""
+    return subprocess.run(
+        ["git", "show", f"{rev}:app.py"], cwd=REPO_DIR,
+        check=True, capture_output=True, text=True,
+    ).stdout
+
+def prepare_app(source: Optional[str] = None) -> AppTest:
+    """
+    検索結果が表示された状態の AppTest を作成
+
+    Args:
+        source: アプリのソース（None の場合は現在の app.py）
+    """
+    from sheets_logger import search_logger
+    from database_utils import search_similar_images
+
+    # Google Sheets への書き込みはスタブに置き換える
+    search_logger.log_user_feedback = lambda session_id, correct_rank: True
+
+    rng = np.random.default_rng(0)
+    results = search_similar_images(rng.standard_normal(512).astype(np.float32), 10)
+    session_id = search_logger.log_search_query("ベンチマーク", results)
+
+    if source is None:
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+    else:
+        at = AppTest.from_string(source, default_timeout=60)
+    at.session_state["current_search_session"] = session_id
+    at.session_state["search_results"] = results
+    at.session_state["search_query"] = "ベンチマーク"
+    at.run()
+    return at
+
+def time_click(source: Optional[str] = None) -> float:
+    """「✅ 正解」ボタンのクリック1回あたりの処理時間（秒）を計測"""
+    at = prepare_app(source)
+    button = at.button(key=f"correct_0_{at.session_state['current_search_session']}")
+    start = time.perf_counter()
+    button.click().run()
+    elapsed = time.perf_counter() - start
+
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="フィードバッククリックの処理時間ベンチマーク")
+    parser.add_argument("--repeat", type=int, default=20, help="計測回数")
+    parser.add_argument("--baseline-rev", default=BASELINE_REV, help="変更前の app.py を取得するリビジョン")
+    args = parser.parse_args()
+
+    baseline_source = load_baseline_source(args.baseline_rev)
+
+    print("=== フィードバッククリックの処理時間 ===")
+    for label, source in [(f"変更前 ({args.baseline_rev})", baseline_source), ("変更後 (現在の app.py)", None)]:
+        timings = [time_click(source) for _ in range(args.repeat)]
+        print(f"  {label}: 中央値 {statistics.median(timings) * 1000:.1f} ms "
+              f"/ 最大 {max(timings) * 1000:.1f} ms ({args.repeat}回)")
+
+if __name__ == "__main__":
+    main()
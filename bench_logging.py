@@ -0,0 +1,63 @@
+"""
+構造化ログのオーバーヘッドを計測するベンチマーク
+
+以下をそれぞれ計測し、1呼び出しあたりの時間（マイクロ秒）を表示する:
+  - ログ呼び出し単体（無効 / 1%サンプリング / 有効）
+  - SheetsLogger.log_search_query + log_user_feedback（ログ無効 / 有効）
+
+Google Sheets への書き込みはスタブに置き換え、ログ出力先は /dev/null とする。
+
+使用方法:
+    python bench_logging.py [--iterations 20000]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+
+# ジャーナルは一時ディレクトリに書き出す
+os.environ.setdefault("EVENT_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "events.jsonl"))
+
+import structured_log
+from structured_log import get_logger
+
+def per_call_us(func, iterations: int) -> float:
+    """func を iterations 回実行したときの1回あたりの時間（マイクロ秒）"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="構造化ログのオーバーヘッド計測")
+    parser.add_argument("--iterations", type=int, default=20000, help="計測回数")
+    args = parser.parse_args()
+    n = args.iterations
+
+    structured_log.configure(level="INFO", sink=os.devnull)
+    log = get_logger("bench")
+
+    print("=== ログ呼び出し単体 (µs/回) ===")
+    print(f"  無効 (DEBUG < INFO)   : {per_call_us(lambda i: log.debug('bench.event', i=i, query='黒い傘'), n):.3f}")
+    print(f"  1% サンプリング       : {per_call_us(lambda i: log.info('bench.event', sample=0.01, i=i, query='黒い傘'), n):.3f}")
+    print(f"  有効                  : {per_call_us(lambda i: log.info('bench.event', i=i, query='黒い傘'), n):.3f}")
+
+    from sheets_logger import search_logger
+    search_logger.sink.write_rows = lambda rows: True
+    results = [(0.9 - k * 0.01, k, f"img_{k}.jpg", "カサ", "黒い傘", f"data/img/カサ/img_{k}.jpg") for k in range(10)]
+
+    def search_and_feedback(i):
+        session_id = search_logger.log_search_query("黒い傘", results)
+        search_logger.log_user_feedback(session_id, 1)
+
+    print("\n=== 検索 + フィードバック記録 (µs/回、ジャーナル書き込みを含む) ===")
+    for level in ["OFF", "DEBUG"]:
+        structured_log.configure(level=level)
+        search_and_feedback(0)
+        print(f"  LOG_LEVEL={level:<5}: {per_call_us(search_and_feedback, n // 10):.1f}")
+    search_logger.writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+件数に対する検索・ギャラリー処理のスケーリングベンチマーク
+
+synthetic_catalog.py で件数ごと（既定 1万・10万件）の合成データベースを作成し、
+各件数で以下を計測する。
+
+    作成: 作成時間、データベースのサイズ
+    検索（検索方法ごと）:
+        sqlite-vec          : database_utils.search_similar_images（全件の距離計算）
+        sqlite-vec+category : カテゴリで絞り込んだ検索
+        similar             : database_utils.search_similar_to_image（保存済みベクトルで検索）
+        matrix              : 全ベクトルをメモリに読み込んだ内積検索（evaluate_retrieval.MatrixIndex、読み込み時間とメモリも記録）
+    ギャラリー: 先頭ページ・カテゴリの先頭ページ・最終ページの取得、件数・カテゴリ別件数の集計
+    メモリ: 計測後の常駐メモリと最大常駐メモリ
+
+結果は logs/scaling/<日時>_<コミット>.json に保存する。
+データベースは一時ディレクトリ（--work-dir）に作成し、--keep を指定しない限り計測後に削除する。
+
+使用方法:
+    python bench_scaling.py
+    python bench_scaling.py --sizes 10000 100000 1000000 --queries 20
+    python bench_scaling.py --sizes 10000000 --backends sqlite-vec similar --work-dir /data/scaling --keep
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, List
+import numpy as np
+import database_utils
+from batch_vectorize import CATEGORIES
+from loadtest import ProcessSampler, git_revision, summarize_latencies
+from synthetic_catalog import EMBEDDING_DIM, generate_catalog
+
+OUTPUT_DIR = os.path.join("logs", "scaling")
+
+BACKENDS = ("sqlite-vec", "sqlite-vec+category", "similar", "matrix")
+GALLERY_PAGE_SIZE = 40
+
+# matrix は全ベクトルをメモリに載せるため、これより多い件数では計測しない（既定 200万件 ≒ 4GB）
+DEFAULT_MATRIX_MAX_ITEMS = 2_000_000
+
+def random_queries(n_queries: int, seed: int) -> np.ndarray:
+    """正規化済みの乱数のクエリベクトル"""
+    vectors = np.random.default_rng(seed).standard_normal((n_queries, EMBEDDING_DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def time_calls(call: Callable[[int], object], n_calls: int) -> dict:
+    """
+    call(i) を n_calls 回実行して計測（1回目はキャッシュが冷えた状態として別に記録）
+
+    Returns:
+        dict: first_ms と2回目以降のレイテンシの集計
+    """
+    latencies = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - start)
+    result = {"first_ms": round(latencies[0] * 1000, 3)}
+    result.update(summarize_latencies(latencies[1:] or latencies))
+    return result
+
+def bench_backends(backends: List[str], n_items: int, n_queries: int, top_k: int, seed: int,
+                   matrix_max_items: int, sampler: ProcessSampler) -> Dict[str, dict]:
+    """検索方法ごとのレイテンシを計測"""
+    queries = random_queries(n_queries, seed)
+    rng = random.Random(seed)
+    image_ids = [rng.randint(1, n_items) for _ in range(n_queries)]
+    categories = [rng.choice(CATEGORIES) for _ in range(n_queries)]
+
+    results = {}
+    for backend in backends:
+        if backend == "sqlite-vec":
+            results[backend] = time_calls(lambda i: database_utils.search_similar_images(queries[i], top_k), n_queries)
+        elif backend == "sqlite-vec+category":
+            results[backend] = time_calls(
+                lambda i: database_utils.search_similar_images(queries[i], top_k, category=categories[i]), n_queries)
+        elif backend == "similar":
+            results[backend] = time_calls(
+                lambda i: database_utils.search_similar_to_image(image_ids[i], top_k), n_queries)
+        elif backend == "matrix":
+            if n_items > matrix_max_items:
+                results[backend] = {"skipped": f"{matrix_max_items:,} 件を超えるため省略"}
+                continue
+            from evaluate_retrieval import MatrixIndex
+            rss_before = sampler.rss_bytes()
+            start = time.perf_counter()
+            index = MatrixIndex()
+            load_seconds = time.perf_counter() - start
+            result = {
+                "load_seconds": round(load_seconds, 3),
+                "index_mb": round((sampler.rss_bytes() - rss_before) / 1024 ** 2, 1),
+            }
+            result.update(time_calls(lambda i: index.search(queries[i], top_k), n_queries))
+            results[backend] = result
+            del index
+    return results
+
+def bench_gallery(n_items: int, n_calls: int) -> Dict[str, dict]:
+    """ギャラリー表示で使うクエリのレイテンシを計測"""
+    last_offset = max(0, n_items - GALLERY_PAGE_SIZE)
+    category = CATEGORIES[0]
+    category_count = database_utils.get_image_count(category)
+    return {
+        "page_first": time_calls(lambda i: database_utils.get_images_page(None, GALLERY_PAGE_SIZE, 0), n_calls),
+        "page_category": time_calls(
+            lambda i: database_utils.get_images_page(category, GALLERY_PAGE_SIZE, 0), n_calls),
+        "page_last": time_calls(
+            lambda i: database_utils.get_images_page(None, GALLERY_PAGE_SIZE, last_offset), n_calls),
+        "page_category_last": time_calls(
+            lambda i: database_utils.get_images_page(
+                category, GALLERY_PAGE_SIZE, max(0, category_count - GALLERY_PAGE_SIZE)), n_calls),
+        "count": time_calls(lambda i: database_utils.get_image_count(), n_calls),
+        "stats": time_calls(lambda i: database_utils.get_database_stats(), n_calls),
+    }
+
+def bench_scale(db_path: str, n_items: int, args, sampler: ProcessSampler) -> dict:
+    """1つの件数について作成・検索・ギャラリーを計測"""
+    print(f"\n=== {n_items:,} 件 ===")
+    build = generate_catalog(db_path, n_items, seed=args.seed)
+    print(f"  作成: {build['build_seconds']:.1f} 秒  {build['db_bytes'] / 1024 ** 2:,.1f} MB")
+
+    # database_utils の接続先を合成データベースに切り替える（公開中のポインターファイルは参照しない）
+    database_utils.DB_PATH = db_path
+    database_utils.DB_POINTER_PATH = None
+    result = {
+        "items": n_items,
+        "build_seconds": round(build["build_seconds"], 3),
+        "db_mb": round(build["db_bytes"] / 1024 ** 2, 1),
+        "search": bench_backends(args.backends, n_items, args.queries, args.top_k, args.seed,
+                                 args.matrix_max_items, sampler),
+        "gallery": bench_gallery(n_items, args.queries),
+        "rss_mb": round(sampler.rss_bytes() / 1024 ** 2, 1),
+        # Linux の ru_maxrss はキロバイト（プロセス開始からの最大値）
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+    for backend, stats in result["search"].items():
+        if "skipped" in stats:
+            print(f"  検索 {backend:<20} {stats['skipped']}")
+            continue
+        load_text = f"  読み込み {stats['load_seconds']:.2f} 秒 / {stats['index_mb']:.0f} MB" if "load_seconds" in stats else ""
+        print(f"  検索 {backend:<20} 初回 {stats['first_ms']:9.2f} ms  p50 {stats['p50_ms']:9.2f} ms  "
+              f"p95 {stats['p95_ms']:9.2f} ms{load_text}")
+    for name, stats in result["gallery"].items():
+        print(f"  ギャラリー {name:<18} 初回 {stats['first_ms']:9.2f} ms  p50 {stats['p50_ms']:9.2f} ms")
+    print(f"  メモリ: {result['rss_mb']:,.0f} MB（最大 {result['peak_rss_mb']:,.0f} MB）")
+    return result
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="件数に対するスケーリングベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="計測する件数")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="計測する検索方法")
+    parser.add_argument("--queries", type=int, default=20, help="1つの計測あたりの実行回数")
+    parser.add_argument("--top-k", type=int, default=10, help="取得件数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--matrix-max-items", type=int, default=DEFAULT_MATRIX_MAX_ITEMS,
+                        help="matrix を計測する最大件数")
+    parser.add_argument("--work-dir", help="データベースの作成先（既定は一時ディレクトリ）")
+    parser.add_argument("--keep", action="store_true", help="作成したデータベースを残す")
+    parser.add_argument("--output", help="結果の保存先（既定は logs/scaling/<日時>_<コミット>.json）")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_scaling_")
+    os.makedirs(work_dir, exist_ok=True)
+    sampler = ProcessSampler()
+    revision = git_revision()
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_revision": revision,
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "work_dir")},
+        "scales": [],
+    }
+
+    try:
+        for n_items in sorted(args.sizes):
+            db_path = os.path.join(work_dir, f"synthetic_{n_items}.db")
+            report["scales"].append(bench_scale(db_path, n_items, args, sampler))
+            if not args.keep:
+                os.remove(db_path)
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+検索APIのスループットベンチマーク
+
+検索APIをプロセス内で起動（または --url で起動済みのサーバーを指定）し、
+同時接続数を変えて /search・/similar・/search/batch のスループットとレイテンシを計測する。
+各クライアントはkeep-aliveで接続を使い回す。
+
+--encoder hashing を指定すると、CLIPモデルの代わりにモデル不要の軽量なエンコーダー（encoders.py）を使い、
+HTTP処理とデータベース検索のみを計測する（モデルを読み込めない環境向け）。
+
+使用方法:
+    python bench_search_api.py --encoder hashing
+    python bench_search_api.py --concurrency 1 4 16 --requests 400
+    python bench_search_api.py --url http://127.0.0.1:8504
+"""
+
+import json
+import time
+import argparse
+import threading
+import statistics
+import http.client
+from typing import Callable, List, Tuple
+from urllib.parse import quote, urlsplit
+from encoders import ENCODER_BACKEND, ENCODER_FACTORIES, get_encoder
+from search_api import SearchService, create_server
+
+QUERIES = ["赤い傘", "黒い財布", "白いタオル", "スマホ", "折りたたみ傘", "青いリュック", "キーケース", "水筒"]
+BATCH_SIZE = 16
+
+def make_request(conn: http.client.HTTPConnection, method: str, path: str, body=None) -> dict:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = {"Content-Type": "application/json"} if data else {}
+    conn.request(method, path, body=data, headers=headers)
+    response = conn.getresponse()
+    payload = json.loads(response.read())
+    if response.status != 200:
+        raise RuntimeError(f"{method} {path}: {response.status} {payload}")
+    return payload
+
+def run_load(host: str, port: int, make_call: Callable[[int], Tuple[str, str, object]],
+             concurrency: int, total_requests: int) -> Tuple[float, List[float]]:
+    """
+    concurrency 個のクライアントで合計 total_requests 件のリクエストを送信
+
+    Returns:
+        Tuple: (経過時間[秒], リクエストごとのレイテンシ[秒])
+    """
+    latencies = []
+    latencies_lock = threading.Lock()
+    errors = []
+    per_client = max(1, total_requests // concurrency)
+    barrier = threading.Barrier(concurrency + 1)
+
+    def client(client_index: int):
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        local = []
+        barrier.wait()
+        try:
+            for i in range(per_client):
+                method, path, body = make_call(client_index * per_client + i)
+                start = time.perf_counter()
+                make_request(conn, method, path, body)
+                local.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return elapsed, latencies
+
+def report(label: str, concurrency: int, elapsed: float, latencies: List[float], queries_per_request: int = 1):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    qps = len(latencies) * queries_per_request / elapsed
+    print(f"  {label:<14} 同時{concurrency:>3}: {qps:8.1f} クエリ/秒  "
+          f"p50 {statistics.median(latencies) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms")
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="検索APIのスループットベンチマーク")
+    parser.add_argument("--url", help="起動済みの検索APIのURL（省略時はプロセス内で起動）")
+    parser.add_argument("--encoder", choices=list(ENCODER_FACTORIES), default=ENCODER_BACKEND,
+                        help="エンコーダー（hashing はモデル不要）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="同時接続数")
+    parser.add_argument("--requests", type=int, default=400, help="1計測あたりのリクエスト数")
+    parser.add_argument("--top-k", type=int, default=10, help="取得件数")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        service = SearchService(get_encoder(args.encoder).extract_text_features)
+        server = create_server("127.0.0.1", 0, service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+        print(f"エンコーダー: {args.encoder}")
+        service.preload()
+
+    # /similar に使う画像IDを検索結果から集める
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    image_ids = sorted({
+        row["image_id"]
+        for query in QUERIES
+        for row in make_request(conn, "GET", f"/search?text={quote(query)}&top_k=20")["results"]
+    })
+    conn.close()
+    if not image_ids:
+        raise SystemExit("検索結果がありません。データベースを確認してください")
+
+    top_k = args.top_k
+    calls = {
+        "/search": lambda i: ("GET", f"/search?text={quote(QUERIES[i % len(QUERIES)])}&top_k={top_k}", None),
+        "/similar": lambda i: ("GET", f"/similar/{image_ids[i % len(image_ids)]}?top_k={top_k}", None),
+        "/search/batch": lambda i: ("POST", "/search/batch", {
+            "queries": [QUERIES[(i + j) % len(QUERIES)] for j in range(BATCH_SIZE)], "top_k": top_k}),
+    }
+
+    print(f"\n=== 検索APIのスループット（上位{top_k}件、バッチは{BATCH_SIZE}クエリ/リクエスト） ===")
+    for label, make_call in calls.items():
+        queries_per_request = BATCH_SIZE if label == "/search/batch" else 1
+        total_requests = args.requests // queries_per_request
+        for concurrency in args.concurrency:
+            elapsed, latencies = run_load(host, port, make_call, concurrency, max(total_requests, concurrency))
+            report(label, concurrency, elapsed, latencies, queries_per_request)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
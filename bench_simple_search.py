@@ -0,0 +1,156 @@
+"""
+simple_app の検索処理のベンチマーク
+
+以下を比較する:
+  - 行ごとのループ: 変更前の実装（毎回全行をDBから取得し、1行ずつコサイン類似度を計算）
+  - 行列検索: キャッシュした正規化済み行列との行列ベクトル積 + argpartition
+
+一時ディレクトリに lost / vec_lost を持つデータベースを作成して計測し、
+結果の一致とデータベース更新時のキャッシュの再読み込みも確認する。
+さらに行列検索のみを件数を増やして計測し、件数に対して線形に伸びることを確認する。
+
+使用方法:
+    python bench_simple_search.py [--db-sizes 1000 10000] [--scale-sizes 10000 100000 1000000]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import numpy as np
+import sqlite_vec
+import simple_app
+from simple_app import EmbeddingIndex, extract_text_features_simple, get_embedding_index, search_similar_items
+
+DIM = 512
+QUERIES = ["青い傘", "黒い財布", "白いタオル", "スマホ", "折りたたみ傘"]
+
+def create_database(path: str, n_items: int, rng: np.random.Generator):
+    """lost / vec_lost を持つベンチマーク用データベースを作成"""
+    conn = sqlite3.connect(path)
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+    conn.execute(f"CREATE VIRTUAL TABLE vec_lost USING vec0(embedding float[{DIM}])")
+    conn.execute("""
+        CREATE TABLE lost (
+            id INTEGER PRIMARY KEY, type TEXT, feature TEXT, lost_place TEXT,
+            picture_path TEXT, vector INTEGER, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    add_items(conn, 0, n_items, rng)
+    conn.close()
+
+def add_items(conn: sqlite3.Connection, start: int, n_items: int, rng: np.random.Generator):
+    """ランダムな埋め込みを持つアイテムを追加"""
+    categories = ["カサ", "サイフ", "スマホ", "タオル", "ペットボトル"]
+    vectors = rng.standard_normal((n_items, DIM)).astype(np.float32)
+    with conn:
+        conn.executemany(
+            "INSERT INTO vec_lost(rowid, embedding) VALUES (?, ?)",
+            ((start + i + 1, vectors[i].tobytes()) for i in range(n_items))
+        )
+        conn.executemany(
+            "INSERT INTO lost(id, type, feature, lost_place, picture_path, vector) VALUES (?, ?, ?, ?, ?, ?)",
+            ((start + i + 1, categories[i % len(categories)], f"特徴{start + i}", "1号館", "", start + i + 1)
+             for i in range(n_items))
+        )
+
+def search_row_loop(query_text: str, top_k: int = 5) -> list:
+    """変更前の実装: 毎回全行を取得し、1行ずつ類似度を計算してソート"""
+    query_vector = extract_text_features_simple(query_text)
+    conn = simple_app.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT l.id, l.type, l.feature, l.lost_place, l.picture_path,
+           v.embedding
+    FROM lost l
+    JOIN vec_lost v ON l.vector = v.rowid
+    """)
+    results = cursor.fetchall()
+    conn.close()
+
+    similarities = []
+    for item_id, item_type, feature, lost_place, picture_path, embedding_blob in results:
+        item_vector = np.frombuffer(embedding_blob, dtype=np.float32)
+        similarity = np.dot(query_vector, item_vector) / (
+            np.linalg.norm(query_vector) * np.linalg.norm(item_vector)
+        )
+        similarities.append({'id': item_id, 'similarity': float(similarity)})
+    similarities.sort(key=lambda x: x['similarity'], reverse=True)
+    return similarities[:top_k]
+
+def median_ms(func, repeat: int) -> float:
+    """func を repeat 回実行したときの中央値（ミリ秒）"""
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def bench_database(n_items: int, repeat: int, rng: np.random.Generator):
+    """データベース経由で変更前後の検索時間を比較"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        simple_app.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        simple_app._embedding_index = None
+        create_database(simple_app.DB_PATH, n_items, rng)
+
+        # 結果の一致を確認
+        for query in QUERIES:
+            expected = [r['id'] for r in search_row_loop(query, 10)]
+            actual = [r['id'] for r in search_similar_items(query, 10)]
+            assert expected == actual, f"結果が一致しません: {query}"
+
+        simple_app._embedding_index = None
+        start = time.perf_counter()
+        get_embedding_index()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        loop_ms = median_ms(lambda i: search_row_loop(QUERIES[i % len(QUERIES)], 10), max(3, repeat // 20))
+        matrix_ms = median_ms(lambda i: search_similar_items(QUERIES[i % len(QUERIES)], 10), repeat)
+        print(f"  {n_items:>8,}件: 行ごとのループ {loop_ms:8.2f} ms / 行列検索 {matrix_ms:6.3f} ms "
+              f"(初回の行列読み込み {load_ms:.1f} ms)")
+
+        # データベースを更新するとキャッシュが読み込み直される
+        conn = sqlite3.connect(simple_app.DB_PATH)
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        add_items(conn, n_items, 1, rng)
+        conn.close()
+        assert len(get_embedding_index()) == n_items + 1, "データベースの更新が反映されていません"
+
+def bench_scaling(sizes, repeat: int, rng: np.random.Generator):
+    """行列検索のみを件数を変えて計測"""
+    query = extract_text_features_simple(QUERIES[0])
+    for n_items in sizes:
+        embeddings = np.empty((n_items, DIM), dtype=np.float32)
+        for start in range(0, n_items, 100000):
+            end = min(start + 100000, n_items)
+            embeddings[start:end] = rng.standard_normal((end - start, DIM), dtype=np.float32)
+        index = EmbeddingIndex([None] * n_items, embeddings)
+        search_ms = median_ms(lambda i: index.search(query, 10), repeat)
+        print(f"  {n_items:>9,}件: {search_ms:8.3f} ms ({search_ms * 1e6 / n_items:.2f} ns/件)")
+        del index, embeddings
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="simple_app の検索処理のベンチマーク")
+    parser.add_argument("--db-sizes", type=int, nargs="+", default=[1000, 10000], help="データベースの件数")
+    parser.add_argument("--scale-sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="行列検索のみを計測する件数")
+    parser.add_argument("--repeat", type=int, default=200, help="計測回数")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print("=== 検索1回あたりの時間（中央値、上位10件） ===")
+    for n_items in args.db_sizes:
+        bench_database(n_items, args.repeat, rng)
+
+    print("\n=== 行列検索のスケーリング ===")
+    bench_scaling(args.scale_sizes, max(5, args.repeat // 10), rng)
+
+if __name__ == "__main__":
+    main()
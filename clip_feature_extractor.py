@@ -7,13 +7,23 @@ CLIP日本語ベースモデルによる特徴量抽出関数
 """
 
 import os
+import time
+import threading
 import numpy as np
-from PIL import Image
-import torch
-from transformers import AutoImageProcessor, AutoModel, AutoTokenizer
 from typing import Union, List
+from image_utils import load_image
+from tracing import span, traced
+from metrics import MODEL_INFERENCE_SECONDS, MODEL_LOAD_SECONDS
+from encoders import Encoder
+
+# torch / transformers は読み込みに数秒かかるため、モデルの初期化時に読み込む
+
+# 前処理の入力解像度が取得できない場合のデコードサイズ
+DEFAULT_DECODE_SIZE = 224
+
+class CLIPFeatureExtractor(Encoder):
+    name = "clip"
 
-class CLIPFeatureExtractor:
     def __init__(self, model_path='line-corporation/clip-japanese-base', device=None):
         """
         CLIP特徴量抽出器の初期化
@@ -22,6 +32,9 @@ class CLIPFeatureExtractor:
             model_path (str): モデルのパス
             device (str): 実行デバイス ('cpu', 'cuda', または None で自動選択)
         """
+        import torch
+        from transformers import AutoImageProcessor, AutoModel, AutoTokenizer
+        
         self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
         self.model_path = model_path
         
@@ -31,9 +44,23 @@ class CLIPFeatureExtractor:
         self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
         self.processor = AutoImageProcessor.from_pretrained(model_path, trust_remote_code=True)
         self.model = AutoModel.from_pretrained(model_path, trust_remote_code=True).to(self.device)
+        self.decode_size = self._get_decode_size()
+        # トークナイザーは複数スレッドから同時に呼び出せないため、推論は1件ずつ行う
+        self._lock = threading.Lock()
         
         print("CLIPモデルの読み込み完了!")
 
+    def _get_decode_size(self) -> int:
+        """前処理で必要な入力解像度（JPEGの縮小デコードの下限）を取得"""
+        size = getattr(self.processor, 'size', None)
+        if isinstance(size, dict):
+            values = [v for k, v in size.items() if k in ('shortest_edge', 'height', 'width')]
+            if values:
+                return max(values)
+        elif isinstance(size, int):
+            return size
+        return DEFAULT_DECODE_SIZE
+
     def extract_image_features(self, image_path: str, normalize: bool = True) -> np.ndarray:
         """
         画像パスから特徴量を抽出
@@ -53,16 +80,19 @@ class CLIPFeatureExtractor:
             raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
         
         try:
-            # 画像読み込み
-            image = Image.open(image_path).convert('RGB')
+            # 画像読み込み（JPEGは入力解像度まで縮小デコード、EXIFの向きを補正）
+            image = load_image(image_path, max_size=self.decode_size)
             
-            # 前処理
-            processed_image = self.processor([image], return_tensors="pt").to(self.device)
+            import torch
+            with self._lock:
+                # 前処理
+                processed_image = self.processor([image], return_tensors="pt").to(self.device)
+                
+                # 特徴量抽出
+                with MODEL_INFERENCE_SECONDS.time(kind="image"), torch.no_grad():
+                    image_features = self.model.get_image_features(**processed_image)
             
-            # 特徴量抽出
             with torch.no_grad():
-                image_features = self.model.get_image_features(**processed_image)
-                
                 # 正規化
                 if normalize:
                     image_features = image_features / image_features.norm(dim=-1, keepdim=True)
@@ -93,13 +123,17 @@ class CLIPFeatureExtractor:
                 text_list = text
                 single_text = False
             
-            # トークナイズ
-            text_inputs = self.tokenizer(text_list).to(self.device)
+            import torch
+            with self._lock:
+                # トークナイズ
+                with span("tokenize"):
+                    text_inputs = self.tokenizer(text_list).to(self.device)
+                
+                # 特徴量抽出
+                with span("text_forward"), MODEL_INFERENCE_SECONDS.time(kind="text"), torch.no_grad():
+                    text_features = self.model.get_text_features(**text_inputs)
             
-            # 特徴量抽出
             with torch.no_grad():
-                text_features = self.model.get_text_features(**text_inputs)
-                
                 # 正規化
                 if normalize:
                     text_features = text_features / text_features.norm(dim=-1, keepdim=True)
@@ -132,12 +166,18 @@ class CLIPFeatureExtractor:
 
 # グローバル関数として提供
 _extractor = None
+_extractor_lock = threading.Lock()
 
 def get_extractor():
-    """グローバルなextractorインスタンスを取得"""
+    """グローバルなextractorインスタンスを取得（同時に呼ばれても読み込みは1回）"""
     global _extractor
     if _extractor is None:
-        _extractor = CLIPFeatureExtractor()
+        with _extractor_lock:
+            if _extractor is None:
+                with span("load_model"):
+                    start = time.perf_counter()
+                    _extractor = CLIPFeatureExtractor()
+                    MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
     return _extractor
 
 def extract_image_features(image_path: str, normalize: bool = True) -> np.ndarray:
@@ -153,6 +193,7 @@ def extract_image_features(image_path: str, normalize: bool = True) -> np.ndarra
     """
     return get_extractor().extract_image_features(image_path, normalize)
 
+@traced()
 def extract_text_features(text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
     """
     テキストから特徴量を抽出（グローバル関数）
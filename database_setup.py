@@ -6,19 +6,36 @@
 import sqlite3
 import sqlite_vec
 import os
+import glob
+from datetime import datetime
+from typing import List, Optional
 
 DB_PATH = "image_vectors.db"
 
-def setup_database():
-    """データベースとテーブルを作成"""
+# 作り直しでは DB_VERSIONS_DIR に新しいファイルを作成し、検証後にポインターファイルを置き換えて公開する
+# （ポインターファイルがない場合は DB_PATH を使用。DB_POINTER_PATH を空にするとポインターを使わない）
+DB_VERSIONS_DIR = os.environ.get("DB_VERSIONS_DIR", "db_versions")
+DB_POINTER_PATH = os.environ.get("DB_POINTER_PATH", "image_vectors.current")
+# 公開中のものを含めて残す版の数（切り替え前の接続が読み終えるまで、また切り戻し用に残す）
+DB_KEEP_VERSIONS = int(os.environ.get("DB_KEEP_VERSIONS", 3))
+
+EMBEDDING_DIM = 512
+
+def setup_database(db_path: str = DB_PATH):
+    """
+    データベースとテーブルを作成
+    
+    Args:
+        db_path: 作成するデータベースファイル（既存のファイルは削除）
+    """
     
     # 既存のデータベースファイルがあれば削除
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-        print(f"既存のデータベース {DB_PATH} を削除しました")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+        print(f"既存のデータベース {db_path} を削除しました")
     
     # データベース接続
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
@@ -38,22 +55,189 @@ def setup_database():
     ''')
     
     # ベクトルテーブル（sqlite-vec使用）
-    cursor.execute('''
+    cursor.execute(f'''
     CREATE VIRTUAL TABLE image_vectors USING vec0(
         id INTEGER PRIMARY KEY,
-        embedding FLOAT[512]
+        embedding FLOAT[{EMBEDDING_DIM}]
+    )
+    ''')
+    
+    # 作成時の情報（エンコーダー名など）
+    cursor.execute('''
+    CREATE TABLE index_info (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
     )
     ''')
     
     # インデックス作成
     cursor.execute('CREATE INDEX idx_category ON images(category)')
     cursor.execute('CREATE INDEX idx_filename ON images(filename)')
+    # ギャラリーのページング用（カテゴリ内をファイル名順に走査）
+    cursor.execute('CREATE INDEX idx_category_filename ON images(category, filename)')
     
     conn.commit()
     conn.close()
     
-    print(f"データベース {DB_PATH} を作成しました")
-    print("テーブル: images, image_vectors")
+    print(f"データベース {db_path} を作成しました")
+    print("テーブル: images, image_vectors, index_info")
+
+def connect_database(db_path: str) -> sqlite3.Connection:
+    """sqlite-vec を読み込んだ接続を作成"""
+    conn = sqlite3.connect(db_path)
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+    return conn
+
+def connect_writer(db_path: str) -> sqlite3.Connection:
+    """
+    取り込み（書き込み）用の接続を作成
+    
+    WAL モードにするため、書き込み中も同じファイルを読む接続はロック待ちにならない。
+    """
+    conn = connect_database(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # WAL ではコミットごとの fsync を省いてもデータベースは壊れない（電源断時に直近のコミットが失われるのみ）
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def finalize_database(db_path: str):
+    """
+    取り込みを終えたデータベースを1ファイルにまとめる
+    
+    WAL の内容を書き戻してジャーナルモードを DELETE に戻すため、
+    -wal / -shm なしで読み取り専用のファイルシステムや immutable=1 の接続から読める。
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+def write_index_info(db_path: str, **info):
+    """作成時の情報を index_info に保存"""
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO index_info (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in info.items()]
+        )
+    conn.close()
+
+def read_index_info(db_path: str) -> dict:
+    """作成時の情報を取得（index_info がない以前のデータベースは空の辞書）"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT key, value FROM index_info").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+def new_version_path() -> str:
+    """作り直し用の新しいデータベースファイルのパス（DB_VERSIONS_DIR/image_vectors-<日時>.db）"""
+    os.makedirs(DB_VERSIONS_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(DB_PATH))[0]
+    return os.path.join(DB_VERSIONS_DIR, f"{stem}-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.db")
+
+def read_db_pointer(pointer_path: str = DB_POINTER_PATH) -> Optional[str]:
+    """
+    ポインターファイルが指すデータベースファイルを取得
+    
+    Returns:
+        str: データベースファイルのパス（ポインターファイルがない、または指す先がない場合は None）
+    """
+    try:
+        with open(pointer_path, "r", encoding="utf-8") as f:
+            db_path = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return db_path if db_path and os.path.exists(db_path) else None
+
+def get_published_db_path() -> str:
+    """公開中のデータベースファイル（ポインターファイルがなければ DB_PATH）"""
+    return (read_db_pointer() if DB_POINTER_PATH else None) or DB_PATH
+
+def validate_database(db_path: str, expected_count: Optional[int] = None) -> List[str]:
+    """
+    公開前にデータベースを検証
+    
+    全件の距離計算を伴う検索を1回実行するため、ファイルがページキャッシュに載り、
+    切り替え直後の検索が遅くならない。
+    
+    Args:
+        db_path: 検証するデータベースファイル
+        expected_count: 期待する画像の件数（None の場合は確認しない）
+        
+    Returns:
+        List[str]: 問題の一覧（空なら公開可能）
+    """
+    problems = []
+    conn = connect_database(db_path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            problems.append(f"整合性チェックに失敗: {result}")
+        total_images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        total_vectors = conn.execute("SELECT COUNT(*) FROM image_vectors").fetchone()[0]
+        if total_images == 0:
+            problems.append("画像が1件もありません")
+        if total_images != total_vectors:
+            problems.append(f"画像 {total_images}件 と特徴量 {total_vectors}件 の件数が一致しません")
+        if expected_count is not None and total_images != expected_count:
+            problems.append(f"画像の件数 {total_images}件 が期待した {expected_count}件 と一致しません")
+        if total_vectors:
+            row = conn.execute("SELECT id, embedding FROM image_vectors LIMIT 1").fetchone()
+            results = conn.execute('''
+            SELECT i.id
+            FROM image_vectors iv
+            JOIN images i ON iv.id = i.id
+            ORDER BY vec_distance_cosine(iv.embedding, ?) ASC
+            LIMIT 1
+            ''', (row[1],)).fetchall()
+            if not results:
+                problems.append("検索結果が返りません")
+    except sqlite3.Error as e:
+        problems.append(f"データベースエラー: {e}")
+    finally:
+        conn.close()
+    return problems
+
+def publish_database(db_path: str, pointer_path: str = DB_POINTER_PATH):
+    """
+    ポインターファイルを置き換えてデータベースを公開
+    
+    一時ファイルに書いてから os.replace で置き換えるため、読み手には切り替え前か後のどちらかだけが見える。
+    """
+    tmp_path = f"{pointer_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(db_path + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer_path)
+    print(f"データベース {db_path} を公開しました（{pointer_path}）")
+
+def prune_versions(keep: int = DB_KEEP_VERSIONS) -> List[str]:
+    """
+    古い版のデータベースファイルを削除（公開中のものと新しい順に keep 件を残す）
+    
+    Returns:
+        List[str]: 削除したファイル
+    """
+    stem = os.path.splitext(os.path.basename(DB_PATH))[0]
+    versions = sorted(glob.glob(os.path.join(DB_VERSIONS_DIR, f"{stem}-*.db")), reverse=True)
+    published = get_published_db_path()
+    removed = []
+    for path in versions[max(keep, 1):]:
+        if os.path.abspath(path) == os.path.abspath(published):
+            continue
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            # 使用中で削除できない場合（Windows）は次回に削除する
+            pass
+    return removed
 
 def verify_database():
     """データベースの構造を確認"""
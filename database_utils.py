@@ -2,27 +2,138 @@
 データベース操作のユーティリティ関数
 """
 
+import os
+import re
 import sqlite3
+import pathlib
 import sqlite_vec
 import numpy as np
 from typing import List, Tuple, Optional
-from database_setup import DB_PATH
+from database_setup import DB_PATH, DB_POINTER_PATH, DB_VERSIONS_DIR, read_db_pointer
+from tracing import traced
+from metrics import DB_QUERY_SECONDS
+from structured_log import get_logger
+
+log = get_logger("database_utils")
+
+# 検索側の接続は読み取り専用で開く（0 で従来の読み書き可能な接続）
+DB_READ_ONLY = os.environ.get("DB_READ_ONLY", "1") != "0"
+# メモリマップで読む最大サイズ（バイト、0 で無効）。特徴量のページをページキャッシュから直接読み、
+# 既定のページキャッシュ（約8MB）に収まらない全件の距離計算での read() とコピーを省く
+# （上限は SQLite のコンパイル時の SQLITE_MAX_MMAP_SIZE、通常は約2GB）
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 1024 * 1024 * 1024))
+
+# ポインターファイルの (更新時刻, サイズ, inode)（ない場合は None）と、そのとき読んだ公開中のデータベースファイル
+_UNSET = object()
+_active_db = (_UNSET, DB_PATH)
+
+def get_active_db_path() -> str:
+    """
+    公開中のデータベースファイルを取得
+    
+    ポインターファイル（DB_POINTER_PATH）があればその指す先、なければ DB_PATH。
+    接続のたびにポインターファイルを stat して置き換えを検出するため、作り直し後の切り替えに再起動は不要。
+    接続はクエリごとに開閉するので、切り替え前に始まったクエリは古いファイルで最後まで実行される。
+    """
+    global _active_db
+    if not DB_POINTER_PATH:
+        return DB_PATH
+    try:
+        stat = os.stat(DB_POINTER_PATH)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except FileNotFoundError:
+        signature = None
+    cached_signature, db_path = _active_db
+    if signature != cached_signature:
+        new_db_path = (read_db_pointer(DB_POINTER_PATH) if signature else None) or DB_PATH
+        if cached_signature is not _UNSET and new_db_path != db_path:
+            log.info("db.switched", previous=db_path, current=new_db_path)
+        _active_db = (signature, new_db_path)
+        db_path = new_db_path
+    return db_path
+
+def is_snapshot(db_path: str) -> bool:
+    """公開後に書き換えない版のファイル（DB_VERSIONS_DIR 内）かどうか"""
+    return os.path.dirname(os.path.abspath(db_path)) == os.path.abspath(DB_VERSIONS_DIR)
 
 def get_db_connection():
-    """データベース接続を取得"""
-    conn = sqlite3.connect(DB_PATH)
+    """
+    データベース接続を取得（公開中のデータベースファイル）
+    
+    検索側は書き込まないため読み取り専用（mode=ro）で開き、
+    書き換えない版のファイルは immutable=1 でロックと変更の確認も省く。
+    """
+    db_path = get_active_db_path()
+    if DB_READ_ONLY:
+        mode = "immutable=1" if is_snapshot(db_path) else "mode=ro"
+        conn = sqlite3.connect(f"{pathlib.Path(os.path.abspath(db_path)).as_uri()}?{mode}", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
+    if DB_MMAP_SIZE:
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
     return conn
 
-def search_similar_images(query_vector: np.ndarray, top_k: int = 10) -> List[Tuple]:
+# 落とし物の画像ファイル名: 受付番号-カテゴリ-通し番号[-撮影番号]
+# （例: 25G355-傘-0001-1.jpg と 25G355-傘-0001-2.jpg は同じ落とし物の別撮影。
+#   区切りの抜けた 25G355-バッグ-00011.jpg や B23014-タオル0006-01.jpg も同じ規則で解釈する）
+ITEM_FILENAME_PATTERN = re.compile(r"^([A-Za-z0-9]+)[\s_-]*(\D+?)[\s_-]*(\d{3,4})(?:[\s_-]*(\d+))?$")
+
+def get_item_key(filename: str) -> str:
+    """
+    ファイル名から落とし物の識別子（撮影番号を除いた部分）を取得
+    
+    Args:
+        filename: 画像のファイル名
+        
+    Returns:
+        str: 落とし物の識別子（規則に合わないファイル名はファイル名自体）
+    """
+    stem = os.path.splitext(os.path.basename(filename.replace('\\', '/')))[0].strip()
+    match = ITEM_FILENAME_PATTERN.match(stem)
+    if not match:
+        return stem.lower()
+    receipt, category, number, _ = match.groups()
+    return f"{receipt.lower()}-{category.strip(' _-')}-{int(number)}"
+
+def get_sibling_image_ids(cursor: sqlite3.Cursor, image_id: int) -> List[int]:
+    """
+    指定した画像と同じ落とし物の画像ID（指定した画像自身を含む）を取得
+    
+    Args:
+        cursor: データベースのカーソル
+        image_id: 画像ID
+        
+    Returns:
+        List[int]: 画像IDのリスト
+    """
+    cursor.execute("SELECT filename FROM images WHERE id = ?", (image_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return [image_id]
+    item_key = get_item_key(row[0])
+    
+    # 受付番号が同じ画像に絞ってからファイル名を解釈する
+    receipt = re.match(r"[A-Za-z0-9]*", os.path.basename(row[0].replace('\\', '/'))).group(0)
+    pattern = re.sub(r"([\\%_])", r"\\\1", receipt) + "%"
+    cursor.execute("SELECT id, filename FROM images WHERE filename LIKE ? ESCAPE '\\'", (pattern,))
+    sibling_ids = [sibling_id for sibling_id, filename in cursor.fetchall() if get_item_key(filename) == item_key]
+    return sibling_ids if image_id in sibling_ids else sibling_ids + [image_id]
+
+@traced()
+def search_similar_images(query_vector: np.ndarray, top_k: int = 10,
+                          exclude_image_id: Optional[int] = None,
+                          category: Optional[str] = None) -> List[Tuple]:
     """
     クエリベクトルに類似する画像を検索
     
     Args:
         query_vector: 検索クエリの特徴量ベクトル
         top_k: 取得する上位k件
+        exclude_image_id: 指定した画像と、同じ落とし物の別撮影の画像を結果から除外
+        category: 指定したカテゴリの画像に絞り込む
         
     Returns:
         List of tuples: (similarity, image_id, filename, category, description, file_path)
@@ -33,7 +144,19 @@ def search_similar_images(query_vector: np.ndarray, top_k: int = 10) -> List[Tup
     # sqlite-vecを使用したベクトル類似度検索
     query_blob = query_vector.astype(np.float32).tobytes()
     
-    query = '''
+    conditions = []
+    params = [query_blob]
+    if exclude_image_id is not None:
+        exclude_ids = get_sibling_image_ids(cursor, exclude_image_id)
+        conditions.append(f"i.id NOT IN ({','.join('?' * len(exclude_ids))})")
+        params.extend(exclude_ids)
+    if category is not None:
+        conditions.append("i.category = ?")
+        params.append(category)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    params.append(top_k)
+    
+    query = f'''
     SELECT 
         vec_distance_cosine(iv.embedding, ?) as similarity,
         i.id,
@@ -43,12 +166,14 @@ def search_similar_images(query_vector: np.ndarray, top_k: int = 10) -> List[Tup
         i.file_path
     FROM image_vectors iv
     JOIN images i ON iv.id = i.id
+    {where_clause}
     ORDER BY similarity ASC
     LIMIT ?
     '''
     
-    cursor.execute(query, (query_blob, top_k))
-    results = cursor.fetchall()
+    with DB_QUERY_SECONDS.time(operation="vector_search"):
+        cursor.execute(query, params)
+        results = cursor.fetchall()
     conn.close()
     
     # コサイン距離を類似度に変換（1 - distance）
@@ -93,6 +218,72 @@ def get_all_images_by_category() -> dict:
     
     return category_dict
 
+def get_images_page(category: Optional[str] = None, limit: int = 40, offset: int = 0) -> List[Tuple]:
+    """
+    画像を1ページ分だけ取得（カテゴリ・ファイル名順）
+    
+    Args:
+        category: 絞り込むカテゴリ（None の場合は全カテゴリ）
+        limit: 1ページあたりの件数
+        offset: 先頭からの読み飛ばし件数
+        
+    Returns:
+        List of tuples: (image_id, filename, category, description, file_path)
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    if category is None:
+        query = '''
+        SELECT id, filename, category, description, file_path
+        FROM images
+        ORDER BY category, filename
+        LIMIT ? OFFSET ?
+        '''
+        params = (limit, offset)
+    else:
+        query = '''
+        SELECT id, filename, category, description, file_path
+        FROM images
+        WHERE category = ?
+        ORDER BY filename
+        LIMIT ? OFFSET ?
+        '''
+        params = (category, limit, offset)
+    
+    with DB_QUERY_SECONDS.time(operation="images_page"):
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+    conn.close()
+    
+    # パス区切り文字を正規化（Windows → Unix）
+    return [
+        (image_id, filename, category, description, file_path.replace('\\', '/'))
+        for image_id, filename, category, description, file_path in results
+    ]
+
+def get_image_count(category: Optional[str] = None) -> int:
+    """
+    画像の件数を取得
+    
+    Args:
+        category: 絞り込むカテゴリ（None の場合は全カテゴリ）
+        
+    Returns:
+        int: 件数
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    if category is None:
+        cursor.execute("SELECT COUNT(*) FROM images")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM images WHERE category = ?", (category,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    
+    return count
+
 def get_database_stats() -> dict:
     """
     データベースの統計情報を取得
@@ -120,8 +311,7 @@ def get_database_stats() -> dict:
 
 def check_database_exists() -> bool:
     """データベースファイルの存在確認"""
-    import os
-    return os.path.exists(DB_PATH)
+    return os.path.exists(get_active_db_path())
 
 def get_image_by_id(image_id: int) -> Optional[Tuple]:
     """
@@ -146,4 +336,46 @@ def get_image_by_id(image_id: int) -> Optional[Tuple]:
     result = cursor.fetchone()
     conn.close()
     
-    return result 
\ No newline at end of file
+    return result
+
+@traced()
+def get_image_vector(image_id: int) -> Optional[np.ndarray]:
+    """
+    画像IDから保存済みの特徴量ベクトルを取得（モデルの推論は行わない）
+    
+    Args:
+        image_id: 画像ID
+        
+    Returns:
+        np.ndarray: 特徴量ベクトル (shape: [512]) or None
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    with DB_QUERY_SECONDS.time(operation="get_vector"):
+        cursor.execute("SELECT embedding FROM image_vectors WHERE id = ?", (image_id,))
+        result = cursor.fetchone()
+    conn.close()
+    
+    if result is None:
+        return None
+    return np.frombuffer(result[0], dtype=np.float32)
+
+def search_similar_to_image(image_id: int, top_k: int = 10,
+                            category: Optional[str] = None) -> Optional[List[Tuple]]:
+    """
+    保存済みの画像ベクトルで類似画像を検索（その画像自身と同じ落とし物の別撮影は除外）
+    
+    Args:
+        image_id: 基準にする画像ID
+        top_k: 取得する上位k件
+        category: 指定したカテゴリの画像に絞り込む
+        
+    Returns:
+        List of tuples: (similarity, image_id, filename, category, description, file_path)
+        画像のベクトルが見つからない場合は None
+    """
+    query_vector = get_image_vector(image_id)
+    if query_vector is None:
+        return None
+    return search_similar_images(query_vector, top_k, exclude_image_id=image_id, category=category)
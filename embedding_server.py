@@ -0,0 +1,446 @@
+"""
+共有モデルサーバー（Unixドメインソケット経由の特徴量抽出）
+
+CLIPモデルを1プロセスだけで読み込み、同じホストの複数のアプリのワーカーから
+Unixドメインソケット経由でテキスト・画像の特徴量抽出を受け付ける。
+ワーカーごとにモデルを読み込まないため、ワーカー数を増やしてもメモリがモデル1つ分で済む。
+同時に届いたテキストのリクエストはまとめて1回の推論で処理する。
+
+クライアント側は EMBEDDING_SERVER_SOCKET を設定すると get_text_encoder() がこのサーバーの
+クライアントを返す（未設定の場合はプロセス内でモデルを読み込む）。
+
+プロトコル（リトルエンディアン）:
+    リクエスト: ヘッダー <BBBH>（バージョン, 種類 1=テキスト 2=画像パス, 正規化 0/1, 件数）
+               + 件数分の <I>（バイト長）+ UTF-8 文字列
+    レスポンス: ヘッダー <BBHH>（バージョン, 状態 0=成功 1=失敗, 件数, 次元数）
+               成功時は 件数 × 次元数 の float32、失敗時は <I>（バイト長）+ UTF-8 のエラーメッセージ
+    1つの接続で複数のリクエストを順に送信できる。
+
+使用方法:
+    python embedding_server.py                               # 既定のソケットで起動
+    python embedding_server.py --socket /run/clip/embed.sock --preload
+    EMBEDDING_SERVER_SOCKET=/run/clip/embed.sock streamlit run app.py
+"""
+
+import os
+import time
+import queue
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+import socketserver
+from typing import Callable, List, Optional, Union
+import numpy as np
+from metrics import histogram
+from structured_log import get_logger
+
+# クライアントが接続するソケット（空の場合はプロセス内でモデルを読み込む）
+EMBEDDING_SERVER_SOCKET = os.environ.get("EMBEDDING_SERVER_SOCKET", "")
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "clip_embedding.sock")
+
+# 1回の推論にまとめる最大件数と、最初のリクエストから後続を待つ時間（秒）
+MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", 32))
+MAX_BATCH_WAIT = float(os.environ.get("EMBEDDING_MAX_BATCH_WAIT_MS", 5)) / 1000
+# クライアントの応答待ちの上限（秒、初回はモデルの読み込みを含む）
+CLIENT_TIMEOUT = float(os.environ.get("EMBEDDING_CLIENT_TIMEOUT", 120))
+
+PROTOCOL_VERSION = 1
+KIND_TEXT = 1
+KIND_IMAGE = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+# 1リクエストあたりの上限
+MAX_ITEMS = 1024
+MAX_ITEM_BYTES = 64 * 1024
+
+REQUEST_HEADER = struct.Struct("<BBBH")
+RESPONSE_HEADER = struct.Struct("<BBHH")
+LENGTH = struct.Struct("<I")
+
+log = get_logger("embedding_server")
+
+EMBEDDING_BATCH_SIZE = histogram(
+    "clip_embedding_batch_size", "Texts encoded per forward pass by the embedding server",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+class ProtocolError(Exception):
+    """不正なリクエスト・レスポンス"""
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """size バイトを受信（接続が閉じられた場合は空のバイト列）"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            if buffer:
+                raise ProtocolError("受信途中で接続が閉じられました")
+            return b""
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+def encode_request(kind: int, items: List[str], normalize: bool = True) -> bytes:
+    """リクエストをバイト列に変換"""
+    parts = [REQUEST_HEADER.pack(PROTOCOL_VERSION, kind, int(normalize), len(items))]
+    for item in items:
+        data = item.encode("utf-8")
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def read_request(sock: socket.socket) -> Optional[tuple]:
+    """
+    リクエストを1件受信
+
+    Returns:
+        tuple: (種類, 正規化するかどうか, 文字列のリスト)。接続が閉じられた場合は None
+    """
+    header = _recv_exact(sock, REQUEST_HEADER.size)
+    if not header:
+        return None
+    version, kind, normalize, count = REQUEST_HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"未対応のプロトコルバージョンです: {version}")
+    if kind not in (KIND_TEXT, KIND_IMAGE):
+        raise ProtocolError(f"不明なリクエストの種類です: {kind}")
+    if not 1 <= count <= MAX_ITEMS:
+        raise ProtocolError(f"件数は 1〜{MAX_ITEMS} の範囲で指定してください: {count}")
+    items = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+        if length > MAX_ITEM_BYTES:
+            raise ProtocolError(f"文字列が長すぎます: {length} バイト")
+        items.append(_recv_exact(sock, length).decode("utf-8"))
+    return kind, bool(normalize), items
+
+def encode_response(vectors: np.ndarray) -> bytes:
+    """成功レスポンスをバイト列に変換（vectors: [件数, 次元数]）"""
+    vectors = np.ascontiguousarray(vectors, dtype="<f4")
+    return RESPONSE_HEADER.pack(PROTOCOL_VERSION, STATUS_OK, vectors.shape[0], vectors.shape[1]) + vectors.tobytes()
+
+def encode_error(message: str) -> bytes:
+    """失敗レスポンスをバイト列に変換"""
+    data = message.encode("utf-8")
+    return RESPONSE_HEADER.pack(PROTOCOL_VERSION, STATUS_ERROR, 0, 0) + LENGTH.pack(len(data)) + data
+
+def read_response(sock: socket.socket) -> np.ndarray:
+    """
+    レスポンスを1件受信
+
+    Returns:
+        np.ndarray: 特徴量 [件数, 次元数]
+
+    Raises:
+        RuntimeError: サーバー側で特徴量抽出に失敗した場合
+    """
+    header = _recv_exact(sock, RESPONSE_HEADER.size)
+    if not header:
+        raise ConnectionError("サーバーが接続を閉じました")
+    version, status, count, dim = RESPONSE_HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"未対応のプロトコルバージョンです: {version}")
+    if status != STATUS_OK:
+        (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+        raise RuntimeError(_recv_exact(sock, length).decode("utf-8"))
+    data = _recv_exact(sock, count * dim * 4)
+    return np.frombuffer(data, dtype="<f4").reshape(count, dim)
+
+# ---- サーバー ----
+
+class _PendingRequest:
+    """バッチ処理待ちのリクエスト"""
+
+    __slots__ = ("kind", "normalize", "items", "done", "result", "error")
+
+    def __init__(self, kind: int, normalize: bool, items: List[str]):
+        self.kind = kind
+        self.normalize = normalize
+        self.items = items
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class EmbeddingBatcher:
+    """
+    同時に届いたリクエストをまとめて推論するワーカー
+
+    最初のリクエストから max_wait 秒の間に届いたテキストを max_batch_size 件まで
+    1回の extract_text_features にまとめる。画像は1件ずつ処理する。
+    """
+
+    def __init__(self, extractor, max_batch_size: int = MAX_BATCH_SIZE, max_wait: float = MAX_BATCH_WAIT):
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, kind: int, items: List[str], normalize: bool = True) -> np.ndarray:
+        """特徴量を抽出（バッチ処理が終わるまで待つ）"""
+        request = _PendingRequest(kind, normalize, items)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].items)
+            # 後続のリクエストを少しだけ待ってまとめる（待ち時間を過ぎても届いている分は含める）
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.items)
+            self._process(batch)
+
+    def _process(self, batch: List[_PendingRequest]):
+        # テキストは正規化の指定ごとにまとめて1回で推論
+        for normalize in (True, False):
+            texts = [r for r in batch if r.kind == KIND_TEXT and r.normalize == normalize]
+            if texts:
+                self._encode_texts(texts, normalize)
+        for request in batch:
+            if request.kind == KIND_IMAGE:
+                try:
+                    request.result = np.stack([
+                        self.extractor.extract_image_features(path, request.normalize) for path in request.items
+                    ])
+                except Exception as e:
+                    request.error = e
+                request.done.set()
+
+    def _encode_texts(self, requests: List[_PendingRequest], normalize: bool):
+        texts = [text for request in requests for text in request.items]
+        try:
+            vectors = np.atleast_2d(self.extractor.extract_text_features(texts, normalize))
+            EMBEDDING_BATCH_SIZE.observe(len(texts))
+        except Exception as e:
+            for request in requests:
+                request.error = e
+                request.done.set()
+            return
+        offset = 0
+        for request in requests:
+            request.result = vectors[offset:offset + len(request.items)]
+            offset += len(request.items)
+            request.done.set()
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """1接続分のリクエストを順に処理"""
+
+    def handle(self):
+        while True:
+            try:
+                request = read_request(self.request)
+            except (ProtocolError, UnicodeDecodeError, struct.error) as e:
+                # 以降の区切りが分からないため、エラーを返して接続を閉じる
+                self.request.sendall(encode_error(f"不正なリクエスト: {e}"))
+                return
+            except OSError:
+                return
+            if request is None:
+                return
+            kind, normalize, items = request
+            try:
+                response = encode_response(self.server.batcher.encode(kind, items, normalize))
+            except Exception as e:
+                log.warning("embedding.failed", kind=kind, items=len(items), error=str(e))
+                response = encode_error(str(e))
+            try:
+                self.request.sendall(response)
+            except OSError:
+                return
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    """共有モデルサーバー（接続ごとにスレッドで処理し、推論は EmbeddingBatcher にまとめる）"""
+
+    daemon_threads = True
+    # 多数のワーカーが同時に接続しても取りこぼさないよう、待ち受けキューを既定の5件から広げる
+    request_queue_size = 128
+
+    def __init__(self, socket_path: str, extractor, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_BATCH_WAIT):
+        # 前回の起動で残ったソケットファイルを削除
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        # 同じグループのワーカーから接続できるようにする
+        os.chmod(socket_path, 0o660)
+        self.socket_path = socket_path
+        self.batcher = EmbeddingBatcher(extractor, max_batch_size, max_wait)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+# ---- クライアント ----
+
+class EmbeddingClient:
+    """
+    共有モデルサーバーのクライアント（接続を使い回す、スレッドセーフ）
+
+    Args:
+        socket_path: サーバーのソケットのパス
+        timeout: 応答待ちの上限（秒）
+    """
+
+    # 使い回すために保持しておく接続数の上限
+    MAX_IDLE_CONNECTIONS = 8
+
+    def __init__(self, socket_path: str, timeout: float = CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> socket.socket:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # タイムアウト付きのソケットは待ち受けキューが埋まっていると接続が即座に失敗するため、接続後に設定する
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(self.timeout)
+        return sock
+
+    def _release(self, sock: socket.socket):
+        with self._lock:
+            if len(self._idle) < self.MAX_IDLE_CONNECTIONS:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        """保持している接続を閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+    def request(self, kind: int, items: List[str], normalize: bool = True) -> np.ndarray:
+        """リクエストを送信して特徴量 [件数, 次元数] を受け取る"""
+        data = encode_request(kind, items, normalize)
+        # サーバーの再起動などで切れた接続は1回だけ張り直す
+        for attempt in range(2):
+            sock = self._acquire()
+            try:
+                sock.sendall(data)
+                features = read_response(sock)
+            except RuntimeError:
+                # サーバー側の特徴量抽出エラー（レスポンスは最後まで受信済みなので接続は使える）
+                self._release(sock)
+                raise
+            except (ConnectionError, ProtocolError):
+                # 保持している他の接続も切れている可能性が高いので捨てる
+                sock.close()
+                self.close()
+                if attempt == 1:
+                    raise
+                continue
+            except OSError:
+                sock.close()
+                raise
+            self._release(sock)
+            return features
+
+    def extract_text_features(self, text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
+        """clip_feature_extractor.extract_text_features と同じ形の結果を返す"""
+        single_text = isinstance(text, str)
+        try:
+            features = self.request(KIND_TEXT, [text] if single_text else list(text), normalize)
+        except Exception as e:
+            raise Exception(f"テキスト特徴量抽出エラー: {e}")
+        return features[0] if single_text else features
+
+    def extract_image_features(self, image_path: str, normalize: bool = True) -> np.ndarray:
+        """clip_feature_extractor.extract_image_features と同じ形の結果を返す（パスはサーバーから読める必要あり）"""
+        try:
+            return self.request(KIND_IMAGE, [os.path.abspath(image_path)], normalize)[0]
+        except Exception as e:
+            raise Exception(f"画像特徴量抽出エラー ({image_path}): {e}")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client(socket_path: Optional[str] = None) -> EmbeddingClient:
+    """グローバルなクライアントを取得"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EmbeddingClient(socket_path or EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET_PATH)
+    return _client
+
+def extract_text_features(text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
+    """
+    共有モデルサーバーでテキストから特徴量を抽出（clip_feature_extractor.extract_text_features の代替）
+
+    Args:
+        text (str or List[str]): 入力テキスト
+        normalize (bool): 特徴量を正規化するかどうか
+
+    Returns:
+        np.ndarray: テキスト特徴量
+    """
+    return get_client().extract_text_features(text, normalize)
+
+def get_text_encoder() -> Callable:
+    """
+    テキストの特徴量抽出関数を取得
+
+    EMBEDDING_SERVER_SOCKET が設定されていれば共有モデルサーバーのクライアント、
+    未設定ならプロセス内の ENCODER_BACKEND のエンコーダー（encoders.extract_text_features）
+    """
+    if EMBEDDING_SERVER_SOCKET:
+        return extract_text_features
+    from encoders import extract_text_features as extract_text_features_local
+    return extract_text_features_local
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="共有モデルサーバー（Unixドメインソケット）")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET_PATH, help="ソケットのパス")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE, help="1回の推論にまとめる最大件数")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_BATCH_WAIT * 1000, help="後続のリクエストを待つ時間")
+    parser.add_argument("--encoder", default=None, help="エンコーダー（clip / hashing、既定は ENCODER_BACKEND）")
+    parser.add_argument("--preload", action="store_true", help="起動時にモデルを読み込む")
+    parser.add_argument("--metrics-port", type=int, default=0, help="メトリクスの公開ポート（0 で無効）")
+    args = parser.parse_args()
+
+    from encoders import get_encoder
+
+    class LazyExtractor:
+        """初回のリクエストでモデルを読み込む"""
+
+        def __getattr__(self, name):
+            return getattr(get_encoder(args.encoder), name)
+
+    extractor = get_encoder(args.encoder) if args.preload else LazyExtractor()
+    server = EmbeddingServer(args.socket, extractor, args.max_batch_size, args.max_wait_ms / 1000)
+    if args.metrics_port:
+        from metrics import start_metrics_server
+        start_metrics_server(args.metrics_port)
+    print(f"共有モデルサーバーを起動しました: {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
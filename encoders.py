@@ -0,0 +1,168 @@
+"""
+特徴量抽出器（エンコーダー）の切り替え
+
+エンコーダーは共通のインターフェース（Encoder）を持ち、環境変数 ENCODER_BACKEND で切り替える。
+    clip    : CLIPモデル（clip_feature_extractor.CLIPFeatureExtractor、既定）
+    hashing : モデル不要の軽量な代替（テキストは文字n-gramのハッシュ、画像は色ヒストグラム）
+
+hashing はモデルのダウンロードなしで決定的に 512 次元の正規化済みベクトルを返すため、
+オフライン環境やCIでの取り込み・インデックス作成・検索の性能計測に使う。
+テキストと画像は別の空間に写るため、テキストから画像を探す検索の精度は意味を持たない。
+検索とデータベース作成（batch_vectorize.py）では同じエンコーダーを使うこと。
+
+使用方法:
+    from encoders import get_encoder
+
+    encoder = get_encoder()            # ENCODER_BACKEND のエンコーダー
+    encoder = get_encoder("hashing")
+    vector = encoder.extract_text_features("赤い傘")
+"""
+
+import os
+import zlib
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Optional, Union
+import numpy as np
+from metrics import MODEL_INFERENCE_SECONDS
+from tracing import traced
+
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "clip")
+
+EMBEDDING_DIM = 512
+
+class Encoder:
+    """エンコーダーの共通インターフェース"""
+
+    name = "base"
+    dim = EMBEDDING_DIM
+
+    def extract_image_features(self, image_path: str, normalize: bool = True) -> np.ndarray:
+        """
+        画像パスから特徴量を抽出
+
+        Returns:
+            np.ndarray: 画像特徴量 (shape: [dim])
+        """
+        raise NotImplementedError
+
+    def extract_text_features(self, text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
+        """
+        テキストから特徴量を抽出
+
+        Returns:
+            np.ndarray: テキスト特徴量 (shape: [dim] or [num_texts, dim])
+        """
+        raise NotImplementedError
+
+    def compute_similarity(self, image_features: np.ndarray, text_features: np.ndarray) -> float:
+        """正規化済みの特徴量同士のコサイン類似度"""
+        return float(np.dot(image_features, text_features))
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+class HashingEncoder(Encoder):
+    """
+    モデル不要の決定的なエンコーダー
+
+    テキスト: NFKC正規化した文字の 1〜3-gram を crc32 で dim 次元に符号付きで振り分け、
+              出現回数の平方根で重み付けする（表記の近いテキストほど類似度が高い）
+    画像: 縮小した画像の RGB を各8段階に量子化した 8×8×8=512 色のヒストグラム（平方根を取る）
+    """
+
+    name = "hashing"
+
+    # 画像は色の分布だけを見るので小さく縮小してから数える
+    IMAGE_SIZE = 64
+    NGRAM_RANGE = (1, 3)
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        if dim != 512:
+            # 色ヒストグラムの次元（8×8×8）と揃える
+            raise ValueError("HashingEncoder の次元は 512 のみ対応しています")
+        self.dim = dim
+
+    def _text_vector(self, text: str) -> np.ndarray:
+        text = unicodedata.normalize("NFKC", text).lower()
+        padded = f" {text} "
+        counts: Dict[tuple, int] = {}
+        for n in range(self.NGRAM_RANGE[0], self.NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                h = zlib.crc32(padded[i:i + n].encode("utf-8"))
+                # 下位ビットで次元、最上位ビットで符号を決める（衝突したn-gramが偏らないようにする）
+                key = (h % self.dim, 1.0 if h >> 31 else -1.0)
+                counts[key] = counts.get(key, 0) + 1
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for (index, sign), count in counts.items():
+            vector[index] += sign * np.sqrt(count)
+        return vector
+
+    def extract_text_features(self, text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
+        single_text = isinstance(text, str)
+        texts = [text] if single_text else list(text)
+        with MODEL_INFERENCE_SECONDS.time(kind="text"):
+            vectors = np.stack([self._text_vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        if normalize:
+            vectors = _normalize_rows(vectors)
+        return vectors[0] if single_text else vectors
+
+    def extract_image_features(self, image_path: str, normalize: bool = True) -> np.ndarray:
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
+        from image_utils import load_image
+        try:
+            with MODEL_INFERENCE_SECONDS.time(kind="image"):
+                image = load_image(image_path, max_size=self.IMAGE_SIZE)
+                pixels = np.asarray(image.convert("RGB"), dtype=np.uint8).reshape(-1, 3) >> 5
+                bins = (pixels[:, 0].astype(np.int32) << 6) | (pixels[:, 1] << 3) | pixels[:, 2]
+                vector = np.sqrt(np.bincount(bins, minlength=self.dim).astype(np.float32))
+        except Exception as e:
+            raise Exception(f"画像特徴量抽出エラー ({image_path}): {e}")
+        return _normalize_rows(vector) if normalize else vector
+
+def _load_clip() -> Encoder:
+    from clip_feature_extractor import get_extractor
+    return get_extractor()
+
+# エンコーダー名 → インスタンスを作成する関数
+ENCODER_FACTORIES: Dict[str, Callable[[], Encoder]] = {
+    "clip": _load_clip,
+    "hashing": HashingEncoder,
+}
+
+_encoders: Dict[str, Encoder] = {}
+_encoders_lock = threading.Lock()
+
+def get_encoder(name: Optional[str] = None) -> Encoder:
+    """
+    エンコーダーを取得（名前ごとに1つだけ作成）
+
+    Args:
+        name: エンコーダー名（None の場合は ENCODER_BACKEND）
+    """
+    name = name or ENCODER_BACKEND
+    encoder = _encoders.get(name)
+    if encoder is None:
+        if name not in ENCODER_FACTORIES:
+            raise ValueError(f"不明なエンコーダーです: {name}（{', '.join(ENCODER_FACTORIES)}）")
+        with _encoders_lock:
+            encoder = _encoders.get(name)
+            if encoder is None:
+                encoder = _encoders[name] = ENCODER_FACTORIES[name]()
+    return encoder
+
+@traced()
+def extract_text_features(text: Union[str, List[str]], normalize: bool = True) -> np.ndarray:
+    """
+    ENCODER_BACKEND のエンコーダーでテキストから特徴量を抽出
+
+    Args:
+        text (str or List[str]): 入力テキスト
+        normalize (bool): 特徴量を正規化するかどうか
+
+    Returns:
+        np.ndarray: テキスト特徴量
+    """
+    return get_encoder().extract_text_features(text, normalize)
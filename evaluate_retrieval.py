@@ -0,0 +1,290 @@
+"""
+検索精度とレイテンシのオフライン評価
+
+正解の分かっているクエリをまとめて検索し直し、recall@k・MRR・nDCG@k と
+クエリごとのレイテンシを計測する。近似インデックスや量子化モデルへの切り替え前後の比較に使う。
+
+評価用のクエリ（--source）:
+    labels  : ラベルCSVの説明文をクエリ、その画像を正解とする
+    sqlite / jsonl / sheets : フィードバックログ（correct_rank が付いた検索）を使い、
+              ユーザーが正解とした順位の画像を正解とする（「正解なし」の記録は対象外）
+    csv     : Google Sheets から書き出したCSV（--path、1行目は見出し）
+
+正解の判定は落とし物単位で行う（同じ落とし物の別撮影の画像はどれが返っても正解、
+検索結果も落とし物単位に重複を除いてから順位を数える）。
+
+検索方法（--backend）:
+    db     : database_utils.search_similar_images（sqlite-vec）
+    matrix : 全ベクトルをメモリに読み込んだ厳密な内積検索（比較用）
+    api    : 起動済みの検索API（--url）の /search
+
+使用方法:
+    python evaluate_retrieval.py --source labels
+    python evaluate_retrieval.py --source sqlite --backend matrix --k 1 5 10
+    python evaluate_retrieval.py --source csv --path feedback_export.csv --backend api --url http://127.0.0.1:8504
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import argparse
+import http.client
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+import numpy as np
+from database_utils import get_db_connection, get_item_key, search_similar_images
+from loadtest import git_revision, summarize_latencies
+
+OUTPUT_DIR = os.path.join("logs", "eval")
+
+DEFAULT_K = (1, 5, 10)
+# 落とし物単位に重複を除くため、最大の k より多めに検索する
+DEFAULT_DEPTH = 50
+NO_CORRECT_ANSWER = "no_correct_answer"
+
+# ---- 評価用のクエリ ----
+
+def load_label_cases() -> List[dict]:
+    """ラベルCSVの説明文をクエリ、その画像の落とし物を正解とする"""
+    from batch_vectorize import load_label_data
+    cases = {}
+    for filename, data in load_label_data().items():
+        # 同じ落とし物の別撮影は説明文も同じことが多いので1件にまとめる
+        key = (data['description'], get_item_key(filename))
+        cases.setdefault(key, {"query": data['description'], "relevant": {get_item_key(filename)}, "source": filename})
+    return list(cases.values())
+
+def cases_from_feedback_rows(rows: Iterable[List]) -> Tuple[List[dict], int]:
+    """
+    フィードバックログの行から評価用のクエリを作成
+
+    Returns:
+        Tuple: (クエリ, 「正解なし」などで対象外にした件数)
+    """
+    cases = {}
+    skipped = 0
+    for row in rows:
+        query, correct_rank = row[2], str(row[3]).strip()
+        try:
+            rank = int(correct_rank)
+            # 結果の列は順位ごとに (ファイル名, 類似度, カテゴリ) の3列
+            filename = row[4 + (rank - 1) * 3]
+        except (ValueError, IndexError):
+            skipped += 1
+            continue
+        # 「似た画像」検索の記録は画像からの検索なので対象外
+        if not query or not filename or query.startswith("🔎"):
+            skipped += 1
+            continue
+        key = (query, get_item_key(filename))
+        cases.setdefault(key, {"query": query, "relevant": {get_item_key(filename)}, "source": row[1]})
+    return list(cases.values()), skipped
+
+def load_cases(source: str, path: Optional[str] = None) -> Tuple[List[dict], int]:
+    """評価用のクエリを読み込み"""
+    if source == "labels":
+        return load_label_cases(), 0
+    if source == "csv":
+        if not path:
+            raise SystemExit("--source csv には --path を指定してください")
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        return cases_from_feedback_rows(rows[1:])
+    from log_sinks import create_sink
+    return cases_from_feedback_rows(create_sink(source).read_rows())
+
+# ---- 検索方法 ----
+
+class MatrixIndex:
+    """全ベクトルをメモリに読み込んだ厳密な内積検索（正規化済みベクトル前提）"""
+
+    def __init__(self):
+        conn = get_db_connection()
+        rows = conn.execute("""
+        SELECT i.filename, iv.embedding
+        FROM image_vectors iv
+        JOIN images i ON iv.id = i.id
+        """).fetchall()
+        conn.close()
+        self.filenames = [filename for filename, _ in rows]
+        self.embeddings = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+
+    def search(self, query_vector: np.ndarray, depth: int) -> List[str]:
+        scores = self.embeddings @ (query_vector / np.linalg.norm(query_vector))
+        depth = min(depth, len(scores))
+        top = np.argpartition(-scores, depth - 1)[:depth]
+        return [self.filenames[i] for i in top[np.argsort(-scores[top])]]
+
+def make_vector_backend(backend: str) -> Callable[[np.ndarray, int], List[str]]:
+    """特徴量ベクトルで検索する関数（ファイル名の順位リストを返す）"""
+    if backend == "matrix":
+        return MatrixIndex().search
+    return lambda query_vector, depth: [row[2] for row in search_similar_images(query_vector, depth)]
+
+def make_api_backend(url: str) -> Callable[[str, int], List[str]]:
+    """検索APIでテキスト検索する関数（ファイル名の順位リストを返す）"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+
+    def search(text: str, depth: int) -> List[str]:
+        conn.request("GET", f"/search?text={quote(text)}&top_k={depth}")
+        response = conn.getresponse()
+        body = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {body.get('error')}")
+        return [row["filename"] for row in body["results"]]
+    return search
+
+# ---- 指標 ----
+
+def ranked_items(filenames: List[str]) -> List[str]:
+    """検索結果のファイル名を落とし物単位に重複を除いた順位リストに変換"""
+    return list(dict.fromkeys(get_item_key(filename) for filename in filenames))
+
+def score_case(items: List[str], relevant: set, ks: Iterable[int]) -> dict:
+    """
+    1クエリ分の指標を計算
+
+    Returns:
+        dict: {rank（見つからない場合は None）, reciprocal_rank, recall@k, ndcg@k}
+    """
+    hits = [i for i, item in enumerate(items, 1) if item in relevant]
+    scores = {"rank": hits[0] if hits else None, "reciprocal_rank": 1 / hits[0] if hits else 0.0}
+    for k in ks:
+        hits_at_k = [rank for rank in hits if rank <= k]
+        scores[f"recall@{k}"] = len(hits_at_k) / len(relevant)
+        dcg = sum(1 / math.log2(rank + 1) for rank in hits_at_k)
+        ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+        scores[f"ndcg@{k}"] = dcg / ideal
+    return scores
+
+def aggregate(scored: List[dict], ks: Iterable[int]) -> Dict[str, float]:
+    """クエリごとの指標を平均"""
+    names = ["reciprocal_rank"] + [f"{metric}@{k}" for k in ks for metric in ("recall", "ndcg")]
+    summary = {name: round(sum(case[name] for case in scored) / len(scored), 4) for name in names}
+    summary["mrr"] = summary.pop("reciprocal_rank")
+    return summary
+
+# ---- 実行 ----
+
+def run_evaluation(cases: List[dict], backend: str, encode_text: Optional[Callable], ks: List[int],
+                   depth: int, batch_size: int, url: Optional[str] = None) -> List[dict]:
+    """
+    全クエリを検索して指標とレイテンシを記録
+
+    テキストの特徴量抽出は batch_size 件ずつまとめて行い、1件あたりの時間を各クエリに按分する
+    """
+    results = []
+    if backend == "api":
+        search_text = make_api_backend(url)
+        for case in cases:
+            start = time.perf_counter()
+            filenames = search_text(case["query"], depth)
+            latency = time.perf_counter() - start
+            results.append({**case, "items": ranked_items(filenames), "encode_s": 0.0, "search_s": latency})
+    else:
+        search_vector = make_vector_backend(backend)
+        for offset in range(0, len(cases), batch_size):
+            batch = cases[offset:offset + batch_size]
+            start = time.perf_counter()
+            vectors = np.atleast_2d(encode_text([case["query"] for case in batch]))
+            encode_s = (time.perf_counter() - start) / len(batch)
+            for case, vector in zip(batch, vectors):
+                start = time.perf_counter()
+                filenames = search_vector(vector, depth)
+                search_s = time.perf_counter() - start
+                results.append({**case, "items": ranked_items(filenames), "encode_s": encode_s, "search_s": search_s})
+
+    for result in results:
+        result.update(score_case(result["items"], result["relevant"], ks))
+    return results
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="検索精度とレイテンシのオフライン評価")
+    parser.add_argument("--source", choices=["labels", "sqlite", "jsonl", "sheets", "csv"], default="labels",
+                        help="評価用のクエリ")
+    parser.add_argument("--path", help="--source csv のファイル")
+    parser.add_argument("--backend", choices=["db", "matrix", "api"], default="db", help="検索方法")
+    parser.add_argument("--url", default="http://127.0.0.1:8504", help="検索APIのURL（api）")
+    parser.add_argument("--encoder", choices=["clip", "hashing"], default=None,
+                        help="エンコーダー（既定は ENCODER_BACKEND、データベース作成時と同じものを指定）")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_K), help="recall@k / nDCG@k の k")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="1クエリで取得する件数")
+    parser.add_argument("--batch-size", type=int, default=32, help="特徴量抽出をまとめる件数")
+    parser.add_argument("--limit", type=int, help="評価するクエリ数の上限")
+    parser.add_argument("--output", help="結果の保存先（既定は logs/eval/<日時>_<コミット>.json）")
+    args = parser.parse_args()
+
+    ks = sorted(set(args.k))
+    cases, skipped = load_cases(args.source, args.path)
+    if args.limit:
+        cases = cases[:args.limit]
+    if not cases:
+        raise SystemExit("評価できるクエリがありません（correct_rank が付いた記録が必要です）")
+
+    encode_text = None
+    if args.backend != "api":
+        if args.encoder:
+            from encoders import get_encoder
+            encode_text = get_encoder(args.encoder).extract_text_features
+        else:
+            from embedding_server import get_text_encoder
+            encode_text = get_text_encoder()
+        # モデルの読み込みをレイテンシに含めない
+        encode_text(["ウォームアップ"])
+
+    results = run_evaluation(cases, args.backend, encode_text, ks, max(args.depth, max(ks)),
+                             args.batch_size, args.url)
+    metrics = aggregate(results, ks)
+    latency = {
+        "total": summarize_latencies([r["encode_s"] + r["search_s"] for r in results]),
+        "encode": summarize_latencies([r["encode_s"] for r in results]),
+        "search": summarize_latencies([r["search_s"] for r in results]),
+    }
+    revision = git_revision()
+
+    print(f"=== 評価結果（{args.source} {len(results)}件 / 対象外 {skipped}件、backend={args.backend}） ===")
+    print(f"  MRR: {metrics['mrr']:.4f}")
+    for k in ks:
+        print(f"  recall@{k:<3}: {metrics[f'recall@{k}']:.4f}   nDCG@{k:<3}: {metrics[f'ndcg@{k}']:.4f}")
+    for name, summary in latency.items():
+        print(f"  レイテンシ {name:<6}: p50 {summary['p50_ms']:7.2f} ms  p95 {summary['p95_ms']:7.2f} ms  "
+              f"p99 {summary['p99_ms']:7.2f} ms")
+    misses = [r for r in results if r["rank"] is None]
+    if misses:
+        print(f"\n  上位{max(args.depth, max(ks))}件に正解がないクエリ: {len(misses)}件（例: {misses[0]['query']}）")
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_revision": revision,
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "queries": len(results),
+        "skipped": skipped,
+        "metrics": metrics,
+        "latency": latency,
+        "per_query": [
+            {
+                "query": r["query"],
+                "source": r["source"],
+                "relevant": sorted(r["relevant"]),
+                "rank": r["rank"],
+                "top_items": r["items"][:max(ks)],
+                "latency_ms": round((r["encode_s"] + r["search_s"]) * 1000, 3),
+            }
+            for r in results
+        ],
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+if __name__ == "__main__":
+    main()
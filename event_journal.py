@@ -0,0 +1,224 @@
+"""
+Durable local journal (write-ahead log) for search and feedback events
+
+Every event is appended to a local JSONL file before it is sent anywhere else,
+so nothing is lost when the process restarts during a remote outage.
+Events that were delivered are recorded in a separate ack file; on startup the
+unacknowledged events can be replayed. The event id is derived from the event
+type and session_id, so replaying the same event twice is detected and skipped.
+
+Undelivered replayable events are also kept in memory, so replay never rescans
+the file, and the journal is rotated as soon as it passes ROTATE_BYTES.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+JOURNAL_PATH = os.environ.get("EVENT_JOURNAL_PATH", "logs/events.jsonl")
+
+# fsync はこの件数ごと、または最後の書き込みからこの秒数以内にまとめて行う
+FSYNC_BATCH_SIZE = 20
+FSYNC_INTERVAL = 1.0
+
+# ジャーナルがこのサイズを超えたら（起動時・実行中とも）、未送信イベントだけを新しいファイルに移してローテーションする
+ROTATE_BYTES = 50 * 1024 * 1024
+
+# 送信先へ再送されるイベント種別。検索イベントは記録のみで送信されない（ack されない）ため、
+# ローテーション時に新しいファイルへ持ち越さずアーカイブに残す
+REPLAYED_EVENT_TYPES = ('feedback',)
+
+# 重複送信の判定用にメモリへ保持する送信済みイベントIDの件数（全件はackファイルに記録）
+RECENT_ACKS_MAX_SIZE = 10000
+
+def make_event_id(event_type: str, session_id: str) -> str:
+    """Deduplication key of an event"""
+    return f"{event_type}:{session_id}"
+
+class EventJournal:
+    def __init__(self, path: str = JOURNAL_PATH, fsync_batch_size: int = FSYNC_BATCH_SIZE,
+                 fsync_interval: float = FSYNC_INTERVAL):
+        self.path = path
+        self.ack_path = path + ".acks"
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._closed = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # 未送信の再送対象イベント（event_id → 最新のイベント）。再送のたびにファイルを読み直さないようメモリに保持する
+        self._pending = OrderedDict()
+        self._load_pending()
+        self._recent_acks = OrderedDict()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._ack_file = open(self.ack_path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        if self._size >= ROTATE_BYTES:
+            self._rotate_locked()
+
+        # 書き込みが途切れても fsync_interval 以内にディスクへ反映する
+        self._sync_event = threading.Event()
+        self._sync_thread = threading.Thread(target=self._sync_loop, name="event-journal-sync", daemon=True)
+        self._sync_thread.start()
+
+    def _load_acks(self) -> set:
+        if not os.path.exists(self.ack_path):
+            return set()
+        with open(self.ack_path, "r", encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _read_events(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        events = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 書き込み途中で停止した最終行は読み飛ばす
+                    continue
+        return events
+
+    def _load_pending(self):
+        """Read the journal once at startup and keep the undelivered replayable events"""
+        acked = self._load_acks()
+        for event in self._read_events():
+            if event['type'] not in REPLAYED_EVENT_TYPES or event['event_id'] in acked:
+                continue
+            self._pending.pop(event['event_id'], None)
+            self._pending[event['event_id']] = event
+
+    def _rotate_locked(self):
+        """Archive the journal, carrying only undelivered replayable events into the new file"""
+        self._sync_locked()
+        self._file.close()
+        self._ack_file.close()
+        archive_path = f"{self.path}.{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        os.replace(self.path, archive_path)
+        with open(self.path, "w", encoding="utf-8") as f:
+            for event in self._pending.values():
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # 未送信イベントしか残らないので ack は不要
+        with open(self.ack_path, "w", encoding="utf-8"):
+            pass
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._ack_file = open(self.ack_path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._unsynced = 0
+
+    def append(self, event_type: str, session_id: str, payload: dict) -> dict:
+        """
+        Append an event to the journal
+
+        Args:
+            event_type: 'search' or 'feedback'
+            session_id: search session id (dedup key)
+            payload: event data (must be JSON serialisable)
+
+        Returns:
+            dict: the journaled event
+        """
+        event = {
+            'event_id': make_event_id(event_type, session_id),
+            'type': event_type,
+            'session_id': session_id,
+            'logged_at': datetime.now().isoformat(),
+            'payload': payload,
+        }
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line.encode("utf-8"))
+            if event_type in REPLAYED_EVENT_TYPES:
+                self._pending.pop(event['event_id'], None)
+                self._pending[event['event_id']] = event
+            self._unsynced += 1
+            if self._size >= ROTATE_BYTES:
+                # ローテーションで新しいファイルは fsync 済みになる
+                self._rotate_locked()
+            elif self._unsynced >= self.fsync_batch_size:
+                self._sync_locked()
+            else:
+                self._sync_event.set()
+        return event
+
+    def mark_sent(self, event_ids: Iterable[str]):
+        """Record that events were delivered to the remote sink"""
+        with self._lock:
+            new_ids = [event_id for event_id in event_ids if event_id not in self._recent_acks]
+            if not new_ids:
+                return
+            self._ack_file.writelines(f"{event_id}\n" for event_id in new_ids)
+            self._ack_file.flush()
+            os.fsync(self._ack_file.fileno())
+            for event_id in new_ids:
+                self._recent_acks[event_id] = True
+                self._pending.pop(event_id, None)
+            while len(self._recent_acks) > RECENT_ACKS_MAX_SIZE:
+                self._recent_acks.popitem(last=False)
+
+    def is_sent(self, event_id: str) -> bool:
+        """Whether the event was delivered recently (used to drop duplicate writes)"""
+        return event_id in self._recent_acks
+
+    def pending_events(self, event_type: Optional[str] = None) -> List[dict]:
+        """
+        Replayable events that have not been delivered yet (one per event id, latest wins)
+
+        Only REPLAYED_EVENT_TYPES are tracked; they are served from memory
+        without reading the journal file.
+
+        Args:
+            event_type: restrict to this event type
+
+        Returns:
+            List[dict]: pending events in journal order
+        """
+        with self._lock:
+            return [
+                event for event in self._pending.values()
+                if event_type is None or event['type'] == event_type
+            ]
+
+    def sync(self):
+        """Force pending writes to disk"""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._sync_event.wait()
+            time.sleep(self.fsync_interval)
+            self._sync_event.clear()
+            with self._lock:
+                if not self._closed:
+                    self._sync_locked()
+
+    def close(self):
+        """Sync and close the journal files"""
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._closed = True
+            self._file.close()
+            self._ack_file.close()
+        self._sync_event.set()
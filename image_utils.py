@@ -0,0 +1,56 @@
+"""
+画像読み込みのユーティリティ関数
+
+JPEGはPILのドラフトモードで縮小デコードし、EXIFの回転情報を反映して読み込む。
+JPEG以外の形式は通常の読み込み処理にフォールバックする。
+"""
+
+from typing import Optional
+from PIL import Image, ImageOps
+
+# ドラフトモード（DCTスケーリング）に対応している形式
+DRAFT_FORMATS = ("JPEG", "MPO")
+
+def load_image(image_path: str, max_size: Optional[int] = None, mode: str = "RGB") -> Image.Image:
+    """
+    画像を読み込み、EXIFの向きを補正して返す
+
+    max_size を指定した場合、JPEGはデコード時に 1/2, 1/4, 1/8 のいずれかに縮小される。
+    縮小後も縦横ともに max_size 以上が保証されるため、後段のリサイズ品質は変わらない。
+
+    Args:
+        image_path (str): 画像ファイルのパス
+        max_size (int): 必要な最小の辺の長さ（None の場合はフル解像度でデコード）
+        mode (str): 変換後のカラーモード
+
+    Returns:
+        PIL.Image.Image: 読み込んだ画像
+    """
+    image = Image.open(image_path)
+
+    if max_size and image.format in DRAFT_FORMATS:
+        # デコード前に縮小率を設定（実際のデコードは load 時に行われる）
+        image.draft(mode, (max_size, max_size))
+
+    # EXIFのOrientationを反映（回転情報がなければそのまま）
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+def load_thumbnail(image_path: str, size: int, mode: str = "RGB") -> Image.Image:
+    """
+    縦横が size 以内に収まる縮小画像を読み込む
+
+    Args:
+        image_path (str): 画像ファイルのパス
+        size (int): 縮小後の最大辺の長さ
+        mode (str): 変換後のカラーモード
+
+    Returns:
+        PIL.Image.Image: 縮小済みの画像
+    """
+    image = load_image(image_path, max_size=size, mode=mode)
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return image
@@ -0,0 +1,139 @@
+"""
+起動時のimport時間を計測し、予算を超えていないか確認するスクリプト
+
+各エントリーポイントを `python -X importtime -c "import <module>"` で読み込み、
+モジュール全体の累積import時間（ミリ秒、複数回の中央値）を予算と比較する。
+起動時に読み込むべきでない重いモジュール（torch / transformers / gspread など）が
+読み込まれていた場合も失敗とする。
+
+-X importtime の出力は logs/importtime/<module>.txt に保存する。
+
+使用方法:
+    python import_budget.py                       # 全エントリーポイントを確認
+    python import_budget.py --budget app=400      # 予算を上書き
+    python import_budget.py --repeat 5 --top 20   # 計測回数と表示件数を変更
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(ROOT_DIR, "logs", "importtime")
+
+# エントリーポイントごとのimport時間の予算（ミリ秒）
+# （大半は streamlit / numpy 自体の読み込み。重いモジュールの混入は DEFERRED_MODULES で検出する）
+IMPORT_BUDGET_MS = {
+    "app": 800,
+    "simple_app": 800,
+    "batch_vectorize": 300,
+}
+
+# 起動時には読み込まず、初回利用時に読み込むモジュール
+DEFERRED_MODULES = ("torch", "transformers", "gspread", "google.auth")
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """
+    -X importtime の出力を解析
+
+    Returns:
+        List[Tuple]: (モジュール名, 自身の時間[us], 累積時間[us], ネストの深さ)
+    """
+    entries = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            entries.append((match.group(4), int(match.group(1)), int(match.group(2)), depth))
+    return entries
+
+def measure(module: str) -> Tuple[float, List[Tuple[str, int, int, int]], str]:
+    """
+    新しいプロセスでモジュールを1回importして計測
+
+    Returns:
+        Tuple: (累積import時間[ms], 解析結果, -X importtime の生出力)
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+        raise RuntimeError(f"{module} のimportに失敗しました: {last_line}")
+    entries = parse_importtime(result.stderr)
+    # バックグラウンドスレッドのimportが混ざるとネストの深さがずれるため、名前で最後の行を探す
+    total_us = [cumulative for name, _, cumulative, _ in entries if name == module][-1]
+    return total_us / 1000, entries, result.stderr
+
+def parse_budget_overrides(values: List[str]) -> Dict[str, float]:
+    """--budget module=ms の指定を解析"""
+    budgets = dict(IMPORT_BUDGET_MS)
+    for value in values:
+        module, _, ms = value.partition("=")
+        budgets[module] = float(ms)
+    return budgets
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="起動時のimport時間の予算チェック")
+    parser.add_argument("modules", nargs="*", default=list(IMPORT_BUDGET_MS), help="計測するモジュール")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS", help="予算の上書き")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（中央値を使用）")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いimportの件数")
+    args = parser.parse_args()
+
+    budgets = parse_budget_overrides(args.budget)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    failures = []
+
+    for module in args.modules:
+        try:
+            runs = [measure(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            failures.append(f"{module}: import failed")
+            continue
+        total_ms = statistics.median(run[0] for run in runs)
+        _, entries, raw_output = runs[-1]
+        with open(os.path.join(OUTPUT_DIR, f"{module}.txt"), "w", encoding="utf-8") as f:
+            f.write(raw_output)
+
+        budget = budgets.get(module)
+        within_budget = budget is None or total_ms <= budget
+        mark = "✅" if within_budget else "❌"
+        budget_text = f" / 予算 {budget:.0f} ms" if budget is not None else ""
+        print(f"{mark} {module}: {total_ms:.1f} ms{budget_text}")
+        if not within_budget:
+            failures.append(f"{module}: {total_ms:.1f} ms > {budget:.0f} ms")
+
+        # エントリーポイント直下の重いimport（ネストの深さ2まで）
+        heavy = sorted(
+            (entry for entry in entries if 1 <= entry[3] <= 2),
+            key=lambda entry: entry[2], reverse=True
+        )[:args.top]
+        for name, _, cumulative, depth in heavy:
+            print(f"    {'  ' * (depth - 1)}{name}: {cumulative / 1000:.1f} ms")
+
+        imported = {name for name, _, _, _ in entries}
+        deferred = [name for name in DEFERRED_MODULES if name in imported]
+        if deferred:
+            print(f"    ❌ 起動時に読み込まれた重いモジュール: {', '.join(deferred)}")
+            failures.append(f"{module}: imports {', '.join(deferred)} at startup")
+
+    print(f"\n-X importtime の出力: {OUTPUT_DIR}")
+    if failures:
+        print("\n失敗:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
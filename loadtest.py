@@ -0,0 +1,338 @@
+"""
+検索処理の負荷試験
+
+ラベルCSVの説明文とその言い換えから作ったクエリを、同時実行数を段階的に変えて検索処理に送り続け、
+スループット・レイテンシのパーセンタイル・CPU使用率・常駐メモリを一定間隔で記録する。
+結果はJSONで保存し、--compare で以前の結果（別のコミット）と比較できる。
+
+負荷をかける対象:
+    direct : プロセス内で検索処理（search_api.SearchService）を直接呼び出す
+    http   : 起動済みの検索API（--url）の /search を呼び出す（--server-pid でサーバー側のCPU・メモリも記録）
+
+使用方法:
+    python loadtest.py --encoder hashing                             # モデルなしで direct を計測
+    python loadtest.py --concurrency 1 4 16 --duration 20
+    python loadtest.py --target http --url http://127.0.0.1:8504 --server-pid 12345
+    python loadtest.py --encoder hashing --compare logs/loadtest/20250101_120000_abc1234.json
+"""
+
+import os
+import csv
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote, urlsplit
+from batch_vectorize import CATEGORIES, DATA_LABEL_DIR
+
+OUTPUT_DIR = os.path.join("logs", "loadtest")
+
+# 言い換えに使う語（説明文の先頭・末尾に付ける、または色を入れ替える）
+QUERY_PREFIXES = ["", "", "落とし物の", "忘れ物の", "昨日なくした"]
+QUERY_SUFFIXES = ["", "", "を探しています", "を落としました", "はありますか"]
+COLOR_WORDS = ["黒い", "白い", "赤い", "青い", "黄色い", "茶色の", "緑の", "ピンクの", "グレーの", "透明の"]
+
+# 比較時に悪化とみなす割合の既定値
+DEFAULT_MAX_REGRESSION = 0.10
+
+def load_label_descriptions(label_dir: str = DATA_LABEL_DIR) -> List[str]:
+    """ラベルCSVの説明文を重複を除いて読み込み"""
+    descriptions = []
+    for category in CATEGORIES:
+        label_file = os.path.join(label_dir, f"{category}.csv")
+        if not os.path.exists(label_file):
+            continue
+        with open(label_file, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                description = (row.get("説明文") or "").strip()
+                if description:
+                    descriptions.append(description)
+    return list(dict.fromkeys(descriptions))
+
+def vary_query(description: str, rng: random.Random) -> str:
+    """説明文を言い換えたクエリを作成"""
+    query = description
+    choice = rng.random()
+    if choice < 0.2:
+        # 色を入れ替える
+        for color in COLOR_WORDS:
+            if color in query:
+                query = query.replace(color, rng.choice(COLOR_WORDS), 1)
+                break
+    elif choice < 0.35 and "の" in query:
+        # 修飾を1つ落とす（「〜の」の前を削る）
+        query = query.split("の", 1)[1] or query
+    elif choice < 0.45 and len(query) > 4:
+        # 入力途中のような短いクエリ
+        query = query[:rng.randint(2, len(query) - 1)]
+    return f"{rng.choice(QUERY_PREFIXES)}{query}{rng.choice(QUERY_SUFFIXES)}"
+
+def build_query_mix(size: int, seed: int = 0, original_ratio: float = 0.5) -> List[str]:
+    """
+    負荷試験用のクエリ列を作成（同じ seed なら同じ列）
+
+    Args:
+        size: クエリ数
+        seed: 乱数のシード
+        original_ratio: 説明文をそのまま使う割合（残りは言い換え）
+    """
+    descriptions = load_label_descriptions()
+    if not descriptions:
+        raise SystemExit(f"ラベルCSVが見つかりません: {DATA_LABEL_DIR}")
+    rng = random.Random(seed)
+    return [
+        description if rng.random() < original_ratio else vary_query(description, rng)
+        for description in (rng.choice(descriptions) for _ in range(size))
+    ]
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """ソート済みの値の q パーセンタイル（最近傍順位法）"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+def summarize_latencies(latencies: List[float]) -> dict:
+    """レイテンシ（秒）をミリ秒の集計に変換"""
+    values = sorted(latencies)
+    if not values:
+        return {"p50_ms": 0.0, "p90_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0, "max_ms": 0.0}
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+class ProcessSampler:
+    """プロセスのCPU時間（秒）と常駐メモリ（バイト）を /proc から取得"""
+
+    def __init__(self, pid: Optional[int] = None):
+        self.pid = pid or os.getpid()
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat", "r") as f:
+            # コマンド名に空白が含まれる場合があるため、閉じ括弧の後ろから数える
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._clock_ticks
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * self._page_size
+
+def make_direct_target(encoder: str, top_k: int) -> Callable[[str], None]:
+    """プロセス内の検索処理を呼び出す関数を作成"""
+    from encoders import get_encoder
+    from search_api import SearchService
+    service = SearchService(get_encoder(encoder).extract_text_features)
+    service.preload()
+    return lambda query: service.search(query, top_k)
+
+def make_http_target(url: str, top_k: int) -> Callable[[str], None]:
+    """検索APIを呼び出す関数を作成（スレッドごとにkeep-aliveの接続を保持）"""
+    parts = urlsplit(url)
+    local = threading.local()
+
+    def call(query: str):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        try:
+            conn.request("GET", f"/search?text={quote(query)}&top_k={top_k}")
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            conn.close()
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {body[:200]!r}")
+    return call
+
+def run_stage(call: Callable[[str], None], queries: List[str], concurrency: int, duration: float,
+              interval: float, sampler: ProcessSampler) -> dict:
+    """
+    concurrency 個のワーカーで duration 秒間リクエストを送り続ける（クローズドループ）
+
+    Returns:
+        dict: 集計と、interval 秒ごとの推移
+    """
+    lock = threading.Lock()
+    latencies: List[float] = []
+    window: List[float] = []
+    errors: Dict[str, int] = {}
+    stop = threading.Event()
+    counter = iter(range(sys.maxsize))
+
+    def worker():
+        while not stop.is_set():
+            with lock:
+                query = queries[next(counter) % len(queries)]
+            start = time.perf_counter()
+            try:
+                call(query)
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                window.append(elapsed)
+
+    timeline = []
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    stage_start = time.perf_counter()
+    cpu_start = last_cpu = sampler.cpu_seconds()
+    last_time = stage_start
+    for thread in threads:
+        thread.start()
+
+    while True:
+        remaining = stage_start + duration - time.perf_counter()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval, remaining))
+        now, cpu = time.perf_counter(), sampler.cpu_seconds()
+        with lock:
+            window_latencies, window[:] = list(window), []
+        summary = summarize_latencies(window_latencies)
+        timeline.append({
+            "t": round(now - stage_start, 3),
+            "requests": len(window_latencies),
+            "throughput": round(len(window_latencies) / (now - last_time), 2),
+            "p50_ms": summary["p50_ms"],
+            "p95_ms": summary["p95_ms"],
+            "cpu_percent": round((cpu - last_cpu) / (now - last_time) * 100, 1),
+            "rss_mb": round(sampler.rss_bytes() / 1024 / 1024, 1),
+        })
+        last_time, last_cpu = now, cpu
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - stage_start
+    cpu_total = sampler.cpu_seconds() - cpu_start
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+        **summarize_latencies(latencies),
+        "cpu_percent": round(cpu_total / elapsed * 100, 1),
+        "rss_max_mb": max((sample["rss_mb"] for sample in timeline), default=0.0),
+        "timeline": timeline,
+    }
+
+def git_revision() -> Optional[str]:
+    """現在のコミット（取得できない場合は None）"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare_reports(baseline: dict, current: dict, max_regression: float) -> List[str]:
+    """
+    以前の結果と比較して表示し、悪化した段階を返す
+
+    スループットが max_regression 以上下がった、または p95 が max_regression 以上伸びた段階を悪化とみなす
+    """
+    regressions = []
+    baseline_stages = {(stage["target"], stage["concurrency"]): stage for stage in baseline["stages"]}
+    print(f"\n=== 比較: {baseline.get('git_revision')} → {current.get('git_revision')} ===")
+    for stage in current["stages"]:
+        key = (stage["target"], stage["concurrency"])
+        before = baseline_stages.get(key)
+        if before is None:
+            continue
+        throughput_change = stage["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        p95_change = stage["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        regressed = throughput_change < -max_regression or p95_change > max_regression
+        mark = "❌" if regressed else "✅"
+        print(f"  {mark} {key[0]} 同時{key[1]:>3}: {before['throughput']:8.1f} → {stage['throughput']:8.1f} 件/秒 "
+              f"({throughput_change:+.1%})  p95 {before['p95_ms']:.2f} → {stage['p95_ms']:.2f} ms ({p95_change:+.1%})")
+        if regressed:
+            regressions.append(f"{key[0]} concurrency={key[1]}")
+    return regressions
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="検索処理の負荷試験")
+    parser.add_argument("--target", choices=["direct", "http", "both"], default="direct", help="負荷をかける対象")
+    parser.add_argument("--url", default="http://127.0.0.1:8504", help="検索APIのURL（http）")
+    parser.add_argument("--server-pid", type=int, help="検索APIのプロセスID（http のCPU・メモリの記録用）")
+    parser.add_argument("--encoder", choices=["clip", "hashing"], default=None,
+                        help="エンコーダー（direct、既定は ENCODER_BACKEND、hashing はモデル不要）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="同時実行数（段階）")
+    parser.add_argument("--duration", type=float, default=10, help="1段階あたりの計測時間（秒）")
+    parser.add_argument("--interval", type=float, default=1, help="推移を記録する間隔（秒）")
+    parser.add_argument("--top-k", type=int, default=10, help="取得件数")
+    parser.add_argument("--queries", type=int, default=2000, help="クエリ列の長さ")
+    parser.add_argument("--seed", type=int, default=0, help="クエリ列の乱数シード")
+    parser.add_argument("--output", help="結果の保存先（既定は logs/loadtest/<日時>_<コミット>.json）")
+    parser.add_argument("--compare", help="比較する以前の結果（JSON）")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="比較時に悪化とみなす割合")
+    args = parser.parse_args()
+
+    queries = build_query_mix(args.queries, args.seed)
+    targets = ["direct", "http"] if args.target == "both" else [args.target]
+    revision = git_revision()
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_revision": revision,
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "query_sample": queries[:10],
+        "stages": [],
+    }
+
+    for target in targets:
+        if target == "direct":
+            call = make_direct_target(args.encoder, args.top_k)
+            sampler = ProcessSampler()
+        else:
+            call = make_http_target(args.url, args.top_k)
+            # サーバーのプロセスIDが分からない場合は負荷をかける側を記録
+            sampler = ProcessSampler(args.server_pid)
+        print(f"=== {target}（上位{args.top_k}件、1段階 {args.duration:.0f} 秒） ===")
+        for concurrency in args.concurrency:
+            stage = run_stage(call, queries, concurrency, args.duration, args.interval, sampler)
+            stage["target"] = target
+            report["stages"].append(stage)
+            error_text = f"  エラー {sum(stage['errors'].values())}件" if stage["errors"] else ""
+            print(f"  同時{concurrency:>3}: {stage['throughput']:8.1f} 件/秒  p50 {stage['p50_ms']:7.2f} ms  "
+                  f"p95 {stage['p95_ms']:7.2f} ms  p99 {stage['p99_ms']:7.2f} ms  "
+                  f"CPU {stage['cpu_percent']:5.1f}%  RSS {stage['rss_max_mb']:.0f} MB{error_text}")
+
+    output = args.output or os.path.join(
+        OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.max_regression)
+        if regressions:
+            print(f"\n悪化: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,594 @@
+"""
+Log sink backends for search feedback rows
+
+A sink receives feedback rows (timestamp, session_id, query_text, correct_rank,
+then filename/similarity/category for up to 10 results) in batches from the
+background writer of SheetsLogger.
+
+Backends (environment variable FEEDBACK_LOG_BACKEND):
+    sheets : Google Sheets (default)
+    sqlite : local SQLite database (FEEDBACK_LOG_DB_PATH, default logs/feedback.db)
+    jsonl  : local JSON lines file (FEEDBACK_LOG_JSONL_PATH, default logs/feedback.jsonl)
+
+Local rows can be forwarded to Google Sheets later as a downstream export:
+    python log_sinks.py export [--source sqlite] [--batch-size 500]
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import importlib.util
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Set
+import streamlit as st
+from structured_log import get_logger, DEBUG, WARNING
+
+log = get_logger("log_sinks")
+
+# Streamlit Cloud での Google Sheets API 使用
+# gspread / google.auth は読み込みに時間がかかるため、起動時は有無だけを確認し、接続時に読み込む
+SHEETS_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None for name in ("gspread", "google.oauth2", "google.auth")
+)
+gspread = None
+Credentials = None
+Request = None
+_sheets_import_lock = threading.Lock()
+
+def _load_sheets_libraries() -> bool:
+    """Import the Google Sheets client libraries on first use"""
+    global gspread, Credentials, Request, SHEETS_AVAILABLE
+    with _sheets_import_lock:
+        if gspread is not None:
+            return True
+        if not SHEETS_AVAILABLE:
+            return False
+        try:
+            import gspread as gspread_module
+            from google.oauth2.service_account import Credentials as credentials_class
+            from google.auth.transport.requests import Request as request_class
+        except Exception as e:
+            SHEETS_AVAILABLE = False
+            log.warning("sheets.libraries_unavailable", error=str(e))
+            return False
+        gspread, Credentials, Request = gspread_module, credentials_class, request_class
+        log.info("sheets.libraries_loaded")
+        return True
+
+FEEDBACK_LOG_BACKEND = os.environ.get("FEEDBACK_LOG_BACKEND", "sheets")
+FEEDBACK_LOG_DB_PATH = os.environ.get("FEEDBACK_LOG_DB_PATH", "logs/feedback.db")
+FEEDBACK_LOG_JSONL_PATH = os.environ.get("FEEDBACK_LOG_JSONL_PATH", "logs/feedback.jsonl")
+
+SPREADSHEET_NAME = "CLIP Search Logs"
+WORKSHEET_NAME = "Search Logs"
+SCOPES = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/drive'
+]
+HEADERS = ["timestamp", "session_id", "query_text", "correct_rank"] + [
+    f"result_{i}_{field}" for i in range(1, 11) for field in ("filename", "similarity", "category")
+]
+
+# 接続の健全性チェック間隔（秒）。これより長く使っていない接続は書き込み前に確認する
+HEALTH_CHECK_INTERVAL = 300
+# 再接続の試行回数と初回待機時間（秒、指数バックオフ）
+RECONNECT_ATTEMPTS = 3
+RECONNECT_BASE_DELAY = 0.5
+
+# SQLite の IN 句に渡す session_id の最大数
+SQLITE_IN_CHUNK_SIZE = 500
+
+def _log_debug(message: str, level: int = DEBUG):
+    log.log(level, "sink.debug", message=message)
+
+class LogSink:
+    """Destination of feedback rows"""
+
+    name = "base"
+    label = "Log sink"
+
+    def __init__(self, debug: Optional[Callable] = None):
+        # 診断メッセージの出力先（SheetsLogger のデバッグ情報に集約する）
+        self._debug = debug or _log_debug
+
+    def connect(self) -> bool:
+        """Open the destination; returns whether it is usable"""
+        return True
+
+    def is_connected(self) -> bool:
+        """Whether rows can currently be written"""
+        return True
+
+    def write_rows(self, rows: List[List]) -> bool:
+        """
+        Write a batch of rows
+
+        Args:
+            rows: feedback rows in HEADERS order
+
+        Returns:
+            bool: True if every row was stored
+        """
+        raise NotImplementedError
+
+    def delivered_session_ids(self, session_ids: Iterable[str]) -> Set[str]:
+        """Subset of session_ids already stored (used to make replay idempotent)"""
+        raise NotImplementedError
+
+    def read_rows(self) -> Iterator[List]:
+        """Iterate over every stored row in HEADERS order"""
+        raise NotImplementedError
+
+    def test_connection(self) -> dict:
+        """Check the sink and return a status dict"""
+        connected = self.connect()
+        return {
+            'backend': self.name,
+            'can_write': connected,
+            'error_message': None if connected else f"{self.label} is not available",
+        }
+
+    def close(self):
+        """Release resources"""
+        pass
+
+class GoogleSheetsSink(LogSink):
+    """Appends rows to a worksheet through a long-lived gspread handle"""
+
+    name = "sheets"
+    label = "Google Sheets"
+
+    def __init__(self, debug: Optional[Callable] = None):
+        super().__init__(debug)
+        self.credentials = None
+        self.gc = None
+        self.worksheet = None
+        self._last_healthy = 0.0
+        # gspread のクライアントはスレッドセーフではないため、接続の利用と再接続を直列化する
+        self._connection_lock = threading.RLock()
+
+    def _load_credentials(self):
+        """Load service account credentials from Streamlit secrets or a local key file"""
+        # Streamlit Cloudでの認証
+        if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
+            self._debug("🔑 Found Streamlit secrets")
+            credentials_info = dict(st.secrets["gcp_service_account"])
+            self._debug(f"📋 Project ID: {credentials_info.get('project_id', 'Not found')}")
+            return Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+
+        # ローカル環境での認証
+        self._debug("🔑 No Streamlit secrets found, trying local file...")
+        if os.path.exists("service-account-key.json"):
+            self._debug("📁 Found local service account file")
+            return Credentials.from_service_account_file("service-account-key.json", scopes=SCOPES)
+
+        self._debug("❌ No service account file found")
+        return None
+
+    def _connect(self) -> bool:
+        """Authorize a client and open (or create) the log spreadsheet and worksheet"""
+        credentials = self._load_credentials()
+        if credentials is None:
+            return False
+        self._debug("✅ Credentials created successfully")
+
+        gc = gspread.authorize(credentials)
+        self._debug("✅ Google Sheets client authorized")
+
+        # スプレッドシートの開始/作成
+        self._debug(f"📊 Looking for spreadsheet: {SPREADSHEET_NAME}")
+        try:
+            spreadsheet = gc.open(SPREADSHEET_NAME)
+            self._debug(f"✅ Found existing spreadsheet: {SPREADSHEET_NAME}")
+        except gspread.SpreadsheetNotFound:
+            self._debug(f"📝 Creating new spreadsheet: {SPREADSHEET_NAME}")
+            spreadsheet = gc.create(SPREADSHEET_NAME)
+            self._debug(f"✅ Created new spreadsheet: {SPREADSHEET_NAME}")
+
+        # ワークシートの取得/作成
+        self._debug(f"📄 Looking for worksheet: {WORKSHEET_NAME}")
+        try:
+            worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
+            self._debug(f"✅ Found existing worksheet: {WORKSHEET_NAME}")
+        except gspread.WorksheetNotFound:
+            self._debug(f"📝 Creating new worksheet: {WORKSHEET_NAME}")
+            worksheet = spreadsheet.add_worksheet(title=WORKSHEET_NAME, rows="1000", cols="20")
+            self._debug(f"✅ Created new worksheet: {WORKSHEET_NAME}")
+
+            # ヘッダーを設定
+            worksheet.append_row(HEADERS)
+            self._debug("✅ Headers added to worksheet")
+
+        with self._connection_lock:
+            self.credentials = credentials
+            self.gc = gc
+            self.worksheet = worksheet
+            self._last_healthy = time.monotonic()
+        return True
+
+    def connect(self) -> bool:
+        """Initialize Google Sheets connection"""
+        if not _load_sheets_libraries():
+            self._debug("❌ Google Sheets libraries not available", level=WARNING)
+            return False
+        self._debug("✅ Google Sheets libraries available")
+        try:
+            self._debug("🔧 Starting Google Sheets initialization...")
+            return self._connect()
+        except Exception as e:
+            # バックグラウンドで初期化するため画面には出さず、接続状態はサイドバーに表示する
+            self._debug(f"❌ Google Sheets setup error: {e}", level=WARNING)
+            return False
+
+    def is_connected(self) -> bool:
+        return self.worksheet is not None
+
+    def _refresh_token_if_needed(self):
+        """Refresh the access token before it expires instead of re-authorizing"""
+        if self.credentials is not None and not self.credentials.valid:
+            self.credentials.refresh(Request())
+            self._debug("🔄 Access token refreshed")
+
+    def health_check(self) -> bool:
+        """Check that the cached worksheet handle is still usable"""
+        with self._connection_lock:
+            if self.worksheet is None:
+                return False
+            try:
+                self._refresh_token_if_needed()
+                self.worksheet.spreadsheet.fetch_sheet_metadata()
+                self._last_healthy = time.monotonic()
+                return True
+            except Exception as e:
+                self._debug(f"❌ Health check failed: {e}", level=WARNING)
+                return False
+
+    def _reconnect(self) -> bool:
+        """Re-create the connection with exponential backoff (error recovery only)"""
+        with self._connection_lock:
+            for attempt in range(RECONNECT_ATTEMPTS):
+                try:
+                    self._debug(f"📤 Reconnecting to Google Sheets (attempt {attempt + 1})...")
+                    if self._connect():
+                        return True
+                    # 認証情報がない場合は再試行しても無駄
+                    return False
+                except Exception as e:
+                    self._debug(f"❌ Reconnect failed: {e}", level=WARNING)
+                    if attempt + 1 < RECONNECT_ATTEMPTS:
+                        time.sleep(RECONNECT_BASE_DELAY * (2 ** attempt))
+            self.worksheet = None
+            return False
+
+    def write_rows(self, rows: List[List]) -> bool:
+        """Append rows using the long-lived worksheet handle, reconnecting only on error"""
+        if not _load_sheets_libraries():
+            return False
+        with self._connection_lock:
+            if self.worksheet is None and not self._reconnect():
+                return False
+
+            if time.monotonic() - self._last_healthy > HEALTH_CHECK_INTERVAL and not self.health_check():
+                if not self._reconnect():
+                    return False
+
+            for attempt in range(2):
+                try:
+                    self._refresh_token_if_needed()
+                    self.worksheet.append_rows(rows)
+                    self._last_healthy = time.monotonic()
+                    return True
+                except Exception as e:
+                    self._debug(f"❌ Write failed: {e}", level=WARNING)
+                    if attempt == 0 and self._reconnect():
+                        continue
+                    return False
+            return False
+
+    def delivered_session_ids(self, session_ids: Iterable[str]) -> Set[str]:
+        with self._connection_lock:
+            if self.worksheet is None:
+                raise ConnectionError("Google Sheets is not connected")
+            # 2列目が session_id
+            remote_session_ids = set(self.worksheet.col_values(2))
+        return remote_session_ids.intersection(session_ids)
+
+    def read_rows(self) -> Iterator[List]:
+        """Iterate over every row in the worksheet (skipping the header row)"""
+        if not self.connect():
+            return
+        with self._connection_lock:
+            values = self.worksheet.get_all_values()
+        for row in values:
+            if row and row[0] != HEADERS[0]:
+                yield row
+
+    def test_connection(self) -> dict:
+        """Test Google Sheets connection and return detailed status"""
+        status = {
+            'backend': self.name,
+            'libraries_available': _load_sheets_libraries(),
+            'secrets_found': False,
+            'credentials_valid': False,
+            'client_authorized': False,
+            'spreadsheet_accessible': False,
+            'worksheet_accessible': False,
+            'can_write': False,
+            'error_message': None
+        }
+
+        try:
+            # Check if secrets are available
+            if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
+                status['secrets_found'] = True
+                self._debug("✅ Secrets found for connection test")
+
+                # Test credentials
+                credentials_info = dict(st.secrets["gcp_service_account"])
+                credentials = Credentials.from_service_account_info(credentials_info, scopes=SCOPES)
+                status['credentials_valid'] = True
+                self._debug("✅ Credentials valid")
+
+                # Test client authorization
+                gc = gspread.authorize(credentials)
+                status['client_authorized'] = True
+                self._debug("✅ Client authorized")
+
+                # Test spreadsheet access
+                spreadsheet_name = SPREADSHEET_NAME
+                try:
+                    spreadsheet = gc.open(spreadsheet_name)
+                    status['spreadsheet_accessible'] = True
+                    self._debug(f"✅ Spreadsheet accessible: {spreadsheet_name}")
+
+                    # Test worksheet access
+                    worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
+                    status['worksheet_accessible'] = True
+                    self._debug("✅ Worksheet accessible")
+
+                    # Test write capability
+                    test_data = ["TEST", datetime.now().isoformat(), "connection_test", "test_rank"]
+                    # Add empty values for remaining columns (up to 34 columns total)
+                    test_data.extend([""] * 30)
+                    worksheet.append_row(test_data)
+                    status['can_write'] = True
+                    self._debug("✅ Write test successful")
+
+                except gspread.SpreadsheetNotFound:
+                    self._debug(f"❌ Spreadsheet not found: {spreadsheet_name}")
+                    status['error_message'] = f"Spreadsheet '{spreadsheet_name}' not found"
+                except gspread.WorksheetNotFound:
+                    self._debug("❌ Worksheet 'Search Logs' not found")
+                    status['error_message'] = "Worksheet 'Search Logs' not found"
+                except Exception as e:
+                    self._debug(f"❌ Write test failed: {e}")
+                    status['error_message'] = f"Write test failed: {e}"
+
+            else:
+                self._debug("❌ No secrets found for connection test")
+                status['error_message'] = "Streamlit secrets not found"
+
+        except Exception as e:
+            status['error_message'] = str(e)
+            self._debug(f"❌ Connection test failed: {e}")
+
+        return status
+
+class SQLiteSink(LogSink):
+    """Stores rows in a local SQLite table, one transaction per batch"""
+
+    name = "sqlite"
+    label = "SQLite"
+
+    def __init__(self, path: str = FEEDBACK_LOG_DB_PATH, debug: Optional[Callable] = None):
+        super().__init__(debug)
+        self.path = path
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> bool:
+        if self.conn is not None:
+            return True
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 書き込みはバックグラウンドの書き込みスレッドから行うため、スレッド間で共有する
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS feedback_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    session_id TEXT NOT NULL UNIQUE,
+                    query_text TEXT NOT NULL,
+                    correct_rank TEXT NOT NULL,
+                    results TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback_logs(timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_query ON feedback_logs(query_text)")
+            conn.commit()
+        except sqlite3.Error as e:
+            self._debug(f"❌ SQLite sink unavailable: {e}", level=WARNING)
+            return False
+        self.conn = conn
+        self._debug(f"✅ SQLite sink opened: {self.path}")
+        return True
+
+    def is_connected(self) -> bool:
+        return self.conn is not None
+
+    def write_rows(self, rows: List[List]) -> bool:
+        if not self.connect():
+            return False
+        # 結果列（ファイル名・類似度・カテゴリ × 10）は JSON の1列にまとめる
+        records = [
+            (row[0], row[1], row[2], str(row[3]), json.dumps(row[4:], ensure_ascii=False))
+            for row in rows
+        ]
+        try:
+            with self._lock, self.conn:
+                # session_id が既にある行（再送分）は無視する
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO feedback_logs (timestamp, session_id, query_text, correct_rank, results) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    records
+                )
+            return True
+        except sqlite3.Error as e:
+            self._debug(f"❌ SQLite write failed: {e}", level=WARNING)
+            return False
+
+    def delivered_session_ids(self, session_ids: Iterable[str]) -> Set[str]:
+        if not self.connect():
+            raise ConnectionError("SQLite sink is not available")
+        session_ids = list(session_ids)
+        delivered = set()
+        with self._lock:
+            for start in range(0, len(session_ids), SQLITE_IN_CHUNK_SIZE):
+                chunk = session_ids[start:start + SQLITE_IN_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self.conn.execute(
+                    f"SELECT session_id FROM feedback_logs WHERE session_id IN ({placeholders})", chunk
+                )
+                delivered.update(row[0] for row in cursor)
+        return delivered
+
+    def read_rows(self) -> Iterator[List]:
+        if not self.connect():
+            return
+        with self._lock:
+            records = self.conn.execute(
+                "SELECT timestamp, session_id, query_text, correct_rank, results FROM feedback_logs ORDER BY id"
+            ).fetchall()
+        for timestamp, session_id, query_text, correct_rank, results in records:
+            yield [timestamp, session_id, query_text, correct_rank] + json.loads(results)
+
+    def close(self):
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class JSONLSink(LogSink):
+    """Appends rows to a local JSON lines file (one object per row, keyed by HEADERS)"""
+
+    name = "jsonl"
+    label = "JSONL"
+
+    def __init__(self, path: str = FEEDBACK_LOG_JSONL_PATH, debug: Optional[Callable] = None):
+        super().__init__(debug)
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> bool:
+        if self._file is not None:
+            return True
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        except OSError as e:
+            self._debug(f"❌ JSONL sink unavailable: {e}", level=WARNING)
+            return False
+        self._debug(f"✅ JSONL sink opened: {self.path}")
+        return True
+
+    def is_connected(self) -> bool:
+        return self._file is not None
+
+    def write_rows(self, rows: List[List]) -> bool:
+        if not self.connect():
+            return False
+        lines = "".join(json.dumps(dict(zip(HEADERS, row)), ensure_ascii=False) + "\n" for row in rows)
+        try:
+            with self._lock:
+                self._file.write(lines)
+                self._file.flush()
+            return True
+        except OSError as e:
+            self._debug(f"❌ JSONL write failed: {e}", level=WARNING)
+            return False
+
+    def delivered_session_ids(self, session_ids: Iterable[str]) -> Set[str]:
+        wanted = set(session_ids)
+        return {row[1] for row in self.read_rows() if row[1] in wanted}
+
+    def read_rows(self) -> Iterator[List]:
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で停止した最終行は読み飛ばす
+                    continue
+                yield [record.get(header, "") for header in HEADERS]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+SINK_CLASSES = {sink_class.name: sink_class for sink_class in (GoogleSheetsSink, SQLiteSink, JSONLSink)}
+
+def create_sink(backend: str = FEEDBACK_LOG_BACKEND, debug: Optional[Callable] = None) -> LogSink:
+    """
+    Create the sink for a backend name
+
+    Args:
+        backend: 'sheets', 'sqlite' or 'jsonl'
+        debug: callback receiving diagnostic messages
+
+    Returns:
+        LogSink: the (not yet connected) sink
+    """
+    try:
+        sink_class = SINK_CLASSES[backend]
+    except KeyError:
+        raise ValueError(f"Unknown FEEDBACK_LOG_BACKEND: {backend!r} (expected one of {', '.join(SINK_CLASSES)})")
+    return sink_class(debug=debug)
+
+def export_rows(source: LogSink, destination: LogSink, batch_size: int = 500) -> int:
+    """
+    Copy rows from a local sink to another sink, skipping sessions already there
+
+    Returns:
+        int: number of rows written
+    """
+    if not destination.connect():
+        raise ConnectionError(f"{destination.label} is not available")
+    rows = list(source.read_rows())
+    delivered = destination.delivered_session_ids(row[1] for row in rows)
+    rows = [row for row in rows if row[1] not in delivered]
+    for start in range(0, len(rows), batch_size):
+        if not destination.write_rows(rows[start:start + batch_size]):
+            raise IOError(f"Export to {destination.label} failed after {start} rows")
+    return len(rows)
+
+def main():
+    """ローカルに記録したフィードバックを Google Sheets へ転送"""
+    parser = argparse.ArgumentParser(description="フィードバックログの転送")
+    parser.add_argument("command", choices=["export"], help="実行する処理")
+    parser.add_argument("--source", choices=["sqlite", "jsonl"], default="sqlite", help="転送元")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回の書き込み行数")
+    args = parser.parse_args()
+
+    source = create_sink(args.source)
+    exported = export_rows(source, GoogleSheetsSink(), args.batch_size)
+    print(f"✅ {exported}件を {WORKSHEET_NAME} に転送しました")
+
+if __name__ == "__main__":
+    main()
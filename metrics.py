@@ -0,0 +1,318 @@
+"""
+プロセス内メトリクス（Prometheus テキスト形式で公開）
+
+カウンター・ゲージ・ヒストグラムをプロセス内に保持し、ローカルのHTTPポートの /metrics で
+Prometheus のテキスト形式（version 0.0.4）として返す。
+記録は辞書の更新のみで、集計と整形はスクレイプ時に行う。
+
+公開設定（環境変数）:
+    METRICS_PORT : 待ち受けポート（既定 8503、0 で無効）
+    METRICS_HOST : 待ち受けアドレス（既定 127.0.0.1）
+
+確認方法:
+    curl http://127.0.0.1:8503/metrics
+"""
+
+import os
+import time
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8503))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# 処理時間（秒）のヒストグラムの既定の区切り
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """メトリクスの基底クラス（ラベルの値の組ごとに値を保持）"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ラベル {self.labelnames} を指定してください")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """増加のみのカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(Metric):
+    """任意の値を取るゲージ（値を設定するか、スクレイプ時に関数で取得）"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """スクレイプ時に値を取得する関数を設定（ラベルなしのゲージのみ）"""
+        self._function = function
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                # 取得できない値は出力しない
+                return []
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class _Timer:
+    """ヒストグラムに処理時間を記録するコンテキストマネージャー"""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+class Histogram(Metric):
+    """区切りごとの件数・合計・件数を保持するヒストグラム"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルの値の組 → [区切りごとの件数（累積ではない）..., 上限超過の件数], 合計
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def time(self, **labels) -> _Timer:
+        """with 文の処理時間（秒）を記録"""
+        return _Timer(self, labels)
+
+    def get_count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """メトリクスの登録先"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"メトリクス {metric.name} は登録済みです")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """全メトリクスを Prometheus のテキスト形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = (),
+          function: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (),
+              buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+def _process_rss_bytes() -> float:
+    """プロセスの常駐メモリ（バイト）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # /proc がない環境では最大常駐メモリで代用（macOS はバイト、Linux は KB）
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+_START_TIME = time.time()
+
+# ---- メトリクス定義 ----
+
+# 検索
+SEARCH_REQUESTS = counter(
+    "clip_search_requests_total", "Search requests by kind (text / similar / batch)", ["kind", "source"])
+
+# モデル
+MODEL_INFERENCE_SECONDS = histogram(
+    "clip_model_inference_seconds", "CLIP forward pass time per call", ["kind"])
+MODEL_LOAD_SECONDS = gauge(
+    "clip_model_load_seconds", "Time taken to load the CLIP model (0 until loaded)")
+
+# データベース
+DB_QUERY_SECONDS = histogram(
+    "clip_db_query_seconds", "SQLite query time by operation", ["operation"])
+
+# キャッシュ
+CACHE_REQUESTS = counter(
+    "clip_cache_requests_total", "Cache lookups by cache and result (hit / miss)", ["cache", "result"])
+
+# 検索・フィードバックのログ
+LOG_EVENTS = counter(
+    "clip_log_events_total", "Search and feedback events logged", ["type"])
+LOG_SINK_ROWS = counter(
+    "clip_log_sink_rows_total", "Feedback rows per write attempt by result (success / failure / gave_up after retries)",
+    ["backend", "result"])
+LOG_SINK_WRITE_SECONDS = histogram(
+    "clip_log_sink_write_seconds", "Time to write one batch of feedback rows to the log sink", ["backend"])
+LOG_WRITER_QUEUE_DEPTH = gauge(
+    "clip_log_writer_queue_depth", "Feedback rows waiting in the background writer queue")
+
+# プロセス
+PROCESS_RSS_BYTES = gauge(
+    "process_resident_memory_bytes", "Resident memory size in bytes", function=_process_rss_bytes)
+PROCESS_START_TIME = gauge(
+    "process_start_time_seconds", "Start time of the process since unix epoch in seconds",
+    function=lambda: _START_TIME)
+
+# ---- HTTP公開 ----
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """
+    /metrics を返すHTTPサーバーをバックグラウンドで起動
+
+    Args:
+        port: 待ち受けポート
+        host: 待ち受けアドレス
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # アクセスログは出力しない
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,303 @@
+"""
+検索API（Streamlitの画面を介さずに検索を呼び出すためのHTTP/JSONサービス）
+
+受付端末やバッチ照合など、他のシステムから検索を呼び出すために使用する。
+CLIPモデルはプロセス内で1つだけ読み込み、全リクエストで共有する（リクエストはスレッドごとに並行処理）。
+
+エンドポイント:
+    GET/POST /search               text, top_k, category
+    POST     /search/batch         queries, top_k, category（テキストの特徴量抽出は1回の推論でまとめて行う）
+    GET      /similar/{image_id}   top_k, category（保存済みの画像ベクトルで検索、推論なし）
+    GET      /health
+    GET      /metrics              Prometheus 形式のメトリクス
+
+使用方法:
+    python search_api.py                      # 127.0.0.1:8504 で起動
+    python search_api.py --port 9000 --preload
+
+    curl -s 'http://127.0.0.1:8504/search?text=赤い傘&top_k=5'
+    curl -s -X POST http://127.0.0.1:8504/search/batch -d '{"queries": ["赤い傘", "黒い財布"]}'
+    curl -s http://127.0.0.1:8504/similar/12
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import numpy as np
+from database_utils import search_similar_images, search_similar_to_image
+from metrics import REGISTRY, CONTENT_TYPE, SEARCH_REQUESTS
+from structured_log import get_logger
+
+SEARCH_API_HOST = os.environ.get("SEARCH_API_HOST", "127.0.0.1")
+SEARCH_API_PORT = int(os.environ.get("SEARCH_API_PORT", 8504))
+
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 100
+# 1回のバッチ検索で受け付けるクエリ数の上限
+MAX_BATCH_SIZE = 64
+# リクエスト本文の上限（バイト）
+MAX_BODY_SIZE = 1024 * 1024
+
+log = get_logger("search_api")
+
+class ApiError(Exception):
+    """クライアントに返すエラー（HTTPステータス付き）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def _parse_top_k(value) -> int:
+    if value is None:
+        return DEFAULT_TOP_K
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, "top_k は整数で指定してください")
+    if not 1 <= top_k <= MAX_TOP_K:
+        raise ApiError(400, f"top_k は 1〜{MAX_TOP_K} の範囲で指定してください")
+    return top_k
+
+def _parse_category(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ApiError(400, "category は文字列で指定してください")
+    return value
+
+def format_results(results: List[Tuple]) -> List[dict]:
+    """検索結果のタプルをJSON用の辞書に変換"""
+    return [
+        {
+            "rank": rank,
+            "similarity": round(float(similarity), 6),
+            "image_id": image_id,
+            "filename": filename,
+            "category": category,
+            "description": description,
+            "file_path": file_path,
+        }
+        for rank, (similarity, image_id, filename, category, description, file_path) in enumerate(results, 1)
+    ]
+
+def _load_text_encoder() -> Callable:
+    # EMBEDDING_SERVER_SOCKET 指定時は共有モデルサーバー、未指定ならプロセス内でモデルを読み込む
+    from embedding_server import get_text_encoder
+    return get_text_encoder()
+
+class SearchService:
+    """
+    検索処理（HTTPから独立）
+
+    Args:
+        encode_text: テキスト（またはテキストのリスト）を特徴量に変換する関数。
+            None の場合は初回利用時に embedding_server.get_text_encoder() で取得する
+    """
+
+    def __init__(self, encode_text: Optional[Callable] = None):
+        self._encode_text = encode_text
+        self._lock = threading.Lock()
+
+    @property
+    def encode_text(self) -> Callable:
+        if self._encode_text is None:
+            with self._lock:
+                if self._encode_text is None:
+                    self._encode_text = _load_text_encoder()
+        return self._encode_text
+
+    def preload(self):
+        """モデルを読み込んでおく（初回リクエストの待ち時間をなくす）"""
+        self.encode_text("ウォームアップ")
+
+    def search(self, text: str, top_k: int = DEFAULT_TOP_K, category: Optional[str] = None) -> List[Tuple]:
+        """テキストで検索"""
+        query_vector = self.encode_text(text)
+        return search_similar_images(query_vector, top_k, category=category)
+
+    def search_batch(self, queries: List[str], top_k: int = DEFAULT_TOP_K,
+                     category: Optional[str] = None) -> List[List[Tuple]]:
+        """複数のテキストで検索（特徴量抽出はまとめて1回）"""
+        query_vectors = np.atleast_2d(self.encode_text(list(queries)))
+        return [search_similar_images(vector, top_k, category=category) for vector in query_vectors]
+
+    def similar(self, image_id: int, top_k: int = DEFAULT_TOP_K,
+                category: Optional[str] = None) -> Optional[List[Tuple]]:
+        """保存済みの画像ベクトルで検索（画像が見つからない場合は None）"""
+        return search_similar_to_image(image_id, top_k, category=category)
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """検索APIのリクエストハンドラー"""
+
+    # keep-alive で同じ接続を使い回せるようにする
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に送るため、Nagle アルゴリズムと遅延ACKで応答が約40ms遅れるのを防ぐ
+    disable_nagle_algorithm = True
+    server_version = "SearchAPI/1.0"
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        path = unquote(url.path).rstrip("/") or "/"
+        try:
+            if path == "/metrics" and method == "GET":
+                self._send(200, REGISTRY.render().encode("utf-8"), CONTENT_TYPE)
+                return
+            params = self._read_params(method, url.query)
+            if path == "/health":
+                body = {"status": "ok"}
+            elif path == "/search":
+                body = self._search(params)
+            elif path == "/search/batch":
+                if method != "POST":
+                    raise ApiError(405, "/search/batch は POST で呼び出してください")
+                body = self._search_batch(params)
+            elif path.startswith("/similar/"):
+                body = self._similar(path[len("/similar/"):], params)
+            else:
+                raise ApiError(404, f"不明なパスです: {path}")
+            body["took_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self._send_json(200, body)
+        except ApiError as e:
+            self._send_json(e.status, {"error": e.message})
+        except Exception as e:
+            log.error("api.request_failed", path=path, error=str(e))
+            self._send_json(500, {"error": f"検索エラー: {e}"})
+
+    def _read_params(self, method: str, query: str) -> dict:
+        """GET はクエリ文字列、POST はJSONの本文からパラメータを取得"""
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        if method == "POST":
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            # 本文を読まずに応答する場合、残りのバイトが次のリクエストとして解釈されないよう接続を閉じる
+            if length < 0:
+                self.close_connection = True
+                raise ApiError(400, "Content-Length が不正です")
+            if length > MAX_BODY_SIZE:
+                self.close_connection = True
+                raise ApiError(413, "リクエスト本文が大きすぎます")
+            if length:
+                try:
+                    body = json.loads(self.rfile.read(length))
+                except ValueError:
+                    raise ApiError(400, "本文はJSONで指定してください")
+                if not isinstance(body, dict):
+                    raise ApiError(400, "本文はJSONオブジェクトで指定してください")
+                params.update(body)
+        return params
+
+    def _search(self, params: dict) -> dict:
+        text = params.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ApiError(400, "text を指定してください")
+        top_k = _parse_top_k(params.get("top_k"))
+        category = _parse_category(params.get("category"))
+        SEARCH_REQUESTS.inc(kind="text", source="api")
+        results = self.server.service.search(text, top_k, category)
+        return {"query": text, "results": format_results(results)}
+
+    def _search_batch(self, params: dict) -> dict:
+        queries = params.get("queries")
+        if (not isinstance(queries, list) or not queries
+                or not all(isinstance(query, str) and query.strip() for query in queries)):
+            raise ApiError(400, "queries に空でない文字列のリストを指定してください")
+        if len(queries) > MAX_BATCH_SIZE:
+            raise ApiError(400, f"queries は {MAX_BATCH_SIZE} 件以下で指定してください")
+        top_k = _parse_top_k(params.get("top_k"))
+        category = _parse_category(params.get("category"))
+        SEARCH_REQUESTS.inc(len(queries), kind="batch", source="api")
+        results = self.server.service.search_batch(queries, top_k, category)
+        return {"results": [{"query": query, "results": format_results(rows)}
+                            for query, rows in zip(queries, results)]}
+
+    def _similar(self, image_id: str, params: dict) -> dict:
+        try:
+            image_id = int(image_id)
+        except ValueError:
+            raise ApiError(400, "image_id は整数で指定してください")
+        top_k = _parse_top_k(params.get("top_k"))
+        category = _parse_category(params.get("category"))
+        SEARCH_REQUESTS.inc(kind="similar", source="api")
+        results = self.server.service.similar(image_id, top_k, category)
+        if results is None:
+            raise ApiError(404, f"画像が見つかりません: {image_id}")
+        return {"image_id": image_id, "results": format_results(results)}
+
+    def _send_json(self, status: int, body: dict):
+        self._send(status, json.dumps(body, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8")
+
+    def _send(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない（件数と処理時間はメトリクスで確認）
+        pass
+
+class SearchAPIServer(ThreadingHTTPServer):
+    """検索APIサーバー（リクエストごとにスレッドで処理）"""
+
+    daemon_threads = True
+    # 同時接続が多いときに接続を取りこぼさないよう、待ち受けキューを既定の5件から広げる
+    request_queue_size = 128
+
+def create_server(host: str = SEARCH_API_HOST, port: int = SEARCH_API_PORT,
+                  service: Optional[SearchService] = None) -> SearchAPIServer:
+    """
+    検索APIサーバーを作成（serve_forever は呼び出し側で実行）
+
+    Args:
+        host: 待ち受けアドレス
+        port: 待ち受けポート（0 の場合は空いているポート）
+        service: 検索処理（None の場合は CLIP モデルを使用）
+
+    Returns:
+        SearchAPIServer: 作成したサーバー（server.service で検索処理を参照可能）
+    """
+    server = SearchAPIServer((host, port), SearchRequestHandler)
+    server.service = service or SearchService()
+    return server
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="検索API（HTTP/JSON）")
+    parser.add_argument("--host", default=SEARCH_API_HOST, help="待ち受けアドレス")
+    parser.add_argument("--port", type=int, default=SEARCH_API_PORT, help="待ち受けポート")
+    parser.add_argument("--preload", action="store_true", help="起動時にモデルを読み込む")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port)
+    if args.preload:
+        print("モデルを読み込み中...")
+        server.service.preload()
+    print(f"検索APIを起動しました: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,197 +1,320 @@
 """
 Google Sheets Logger for CLIP Image Search Demo
-Simple logging to Google Sheets with debug information
+Simple logging to Google Sheets (or a local sink, see log_sinks) with debug information
 """
 
-import os
-import json
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
 from typing import List, Tuple, Optional
 import streamlit as st
+from event_journal import EventJournal, make_event_id
+from log_sinks import create_sink, FEEDBACK_LOG_BACKEND
+from structured_log import get_logger, DEBUG, WARNING, HOT_PATH_SAMPLE_RATE
+from tracing import traced
+from metrics import CACHE_REQUESTS, LOG_EVENTS, LOG_SINK_ROWS, LOG_SINK_WRITE_SECONDS, LOG_WRITER_QUEUE_DEPTH
 
-# Streamlit Cloud での Google Sheets API 使用
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    SHEETS_AVAILABLE = True
-    print(f"SHEETS_LOGGER: Successfully imported gspread and google.oauth2")
-except ImportError as e:
-    SHEETS_AVAILABLE = False
-    print(f"SHEETS_LOGGER: Failed to import Google Sheets libraries: {e}")
-    print(f"SHEETS_LOGGER: Import error details: {str(e)}")
-except Exception as e:
-    SHEETS_AVAILABLE = False
-    print(f"SHEETS_LOGGER: Unexpected error during import: {e}")
+log = get_logger("sheets_logger")
+
+# ログの書き込み先の接続状態
+SINK_CONNECTING = "connecting"
+SINK_READY = "ready"
+SINK_UNAVAILABLE = "unavailable"
+# 書き込みスレッドが初期化の完了を待つ最大時間（秒）
+SINK_INIT_WAIT_TIMEOUT = 30.0
+
+# バックグラウンド書き込みの設定
+# Sheets API の書き込み上限（1ユーザーあたり毎分60リクエスト）を大きく下回るよう、行をまとめて書き込む
+# （ローカルのシンクでも1バッチ1トランザクションになる）
+WRITER_BATCH_SIZE = 50          # この件数たまったら即書き込み
+WRITER_FLUSH_INTERVAL = 2.0     # 最初の行が入ってからこの秒数で書き込み
+WRITER_MAX_RETRIES = 5          # 1バッチあたりの再試行回数
+WRITER_RETRY_BASE_DELAY = 1.0   # 再試行の初回待機時間（秒、指数バックオフ）
+WRITER_QUEUE_SIZE = 10000       # キューの上限（超えた行は呼び出し側でフォールバック）
+WRITER_SHUTDOWN_TIMEOUT = 10.0  # 終了時のフラッシュ待ち時間（秒）
+
+# セッションキャッシュの上限件数と有効期限（秒）。フィードバックは検索直後に行われるため数時間で十分
+SESSION_CACHE_MAX_SIZE = 1000
+SESSION_CACHE_TTL = 6 * 60 * 60
+# デバッグ情報として保持する最新のメッセージ数
+DEBUG_INFO_MAX_LENGTH = 200
+# 書き込みに失敗した行としてメモリに保持する最新の件数（永続的な記録はジャーナル側）
+FALLBACK_LOGS_MAX_LENGTH = 1000
+
+class SessionCache:
+    """
+    Bounded LRU cache with a per-entry TTL
+
+    Expired entries are dropped on access and the least recently used entry
+    is evicted once max_size is exceeded, so memory stays flat regardless of traffic.
+    """
+    
+    def __init__(self, max_size: int = SESSION_CACHE_MAX_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            self._evict_locked()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+    
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+    
+    def _evict_locked(self):
+        now = time.monotonic()
+        # 参照順（LRU）に並んでおり有効期限順ではないため、期限切れは全件を走査して取り除く
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        # 上限を超えた分は最も長く参照されていないものから取り除く
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+class BackgroundLogWriter:
+    """
+    Queue rows and append them in batches from a background thread
+
+    submit() returns immediately. Rows are flushed when WRITER_BATCH_SIZE rows
+    are pending or WRITER_FLUSH_INTERVAL seconds after the first pending row,
+    retried with exponential backoff, and flushed on interpreter shutdown.
+    Batches that still fail are handed to on_failure.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, write_rows, on_failure=None, batch_size: int = WRITER_BATCH_SIZE,
+                 flush_interval: float = WRITER_FLUSH_INTERVAL, max_retries: int = WRITER_MAX_RETRIES):
+        self._write_rows = write_rows
+        self._on_failure = on_failure
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sheets-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def submit(self, row: List) -> bool:
+        """Enqueue a row; returns False if the writer is closed or the queue is full"""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return False
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every row submitted so far has been written (or given up on)"""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = WRITER_SHUTDOWN_TIMEOUT):
+        """Flush pending rows and stop the writer thread, waiting at most timeout seconds"""
+        if self._closed:
+            return
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # 障害中でキューが詰まっていても終了を待たせない（未送信の行はジャーナルに残っている）
+            log.warning("writer.shutdown_queue_full", pending=self._queue.qsize())
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+    
+    @property
+    def pending_count(self) -> int:
+        """Rows waiting in the queue"""
+        return self._queue.qsize()
+    
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            if item is self._STOP:
+                self._write_batch(pending)
+                return
+            if isinstance(item, threading.Event):
+                self._write_batch(pending)
+                pending, deadline = [], None
+                item.set()
+                continue
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._write_batch(pending)
+                pending, deadline = [], None
+    
+    def _write_batch(self, rows: List[List]):
+        if not rows:
+            return
+        for attempt in range(self.max_retries):
+            try:
+                if self._write_rows(rows):
+                    return
+            except Exception:
+                pass
+            # 終了処理中は待たずに諦める
+            if self._closed or attempt + 1 == self.max_retries:
+                break
+            time.sleep(WRITER_RETRY_BASE_DELAY * (2 ** attempt))
+        if self._on_failure is not None:
+            self._on_failure(rows)
 
 class SheetsLogger:
-    def __init__(self):
-        print(f"SHEETS_LOGGER: Initializing SheetsLogger...")
-        self.fallback_logs = []
-        self.gc = None
-        self.worksheet = None
-        self.session_cache = {}
-        self.debug_info = []
+    def __init__(self, backend: str = FEEDBACK_LOG_BACKEND):
+        self.fallback_logs = deque(maxlen=FALLBACK_LOGS_MAX_LENGTH)
+        self.session_cache = SessionCache()
+        self.debug_info = deque(maxlen=DEBUG_INFO_MAX_LENGTH)
+        # 件数はキャッシュを走査せずに逐次集計する
+        self.search_count = 0
+        self.feedback_count = 0
         
-        print(f"SHEETS_LOGGER: Initial setup complete")
         self._add_debug("📊 SheetsLogger initialized")
         
-        if SHEETS_AVAILABLE:
-            print(f"SHEETS_LOGGER: Google Sheets libraries are available")
-            self._add_debug("✅ Google Sheets libraries available")
-            try:
-                self._init_sheets()
-            except Exception as e:
-                print(f"SHEETS_LOGGER: Initialization failed with error: {str(e)}")
-                self._add_debug(f"❌ Sheets initialization failed: {e}")
-                st.warning(f"Sheets initialization failed: {e}")
-        else:
-            print(f"SHEETS_LOGGER: Google Sheets libraries NOT available")
-            self._add_debug("❌ Google Sheets libraries not available")
-    
-    def _add_debug(self, message: str):
-        """Add debug message"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        debug_msg = f"[{timestamp}] {message}"
-        self.debug_info.append(debug_msg)
-        
-        # 標準出力に出力（Streamlit Cloudのログで確認可能）
-        print(f"SHEETS_LOGGER: {debug_msg}")
+        # フィードバック行の書き込み先（FEEDBACK_LOG_BACKEND: sheets / sqlite / jsonl）
+        self.sink = create_sink(backend, debug=self._add_debug)
+        self._add_debug(f"🗄️ Log sink: {self.sink.label}")
+        # 接続状態: connecting → ready / unavailable
+        self.status = SINK_CONNECTING
+        self._ready = threading.Event()
         
-        # コンソール出力もする
+        # 全イベントを先にローカルのジャーナルへ記録（再起動しても未送信分を再送できる）
         try:
-            import sys
-            sys.stdout.flush()
-        except:
-            pass
+            self.journal = EventJournal()
+        except OSError as e:
+            self.journal = None
+            self._add_debug(f"❌ Event journal unavailable: {e}", level=WARNING)
+        # 再送のため書き込みキューに入れたイベントID。初期化スレッドと書き込みスレッドの両方から更新するためロックで保護する
+        self._replay_inflight = set()
+        self._replay_lock = threading.Lock()
+        self._needs_replay = True
+        
+        # フィードバック行はバックグラウンドでまとめて書き込む
+        self.writer = BackgroundLogWriter(self._write_feedback_rows, on_failure=self._on_write_failure)
+        LOG_WRITER_QUEUE_DEPTH.set_function(lambda: self.writer.pending_count)
+        
+        # 認証やスプレッドシートの取得はネットワーク待ちになるため、起動（import）を止めないよう別スレッドで行う。
+        # 接続完了までのイベントはジャーナルと書き込みキューに溜めておき、接続後にまとめて書き込む
+        self._init_thread = None
+        self._start_lock = threading.Lock()
     
-    def get_debug_info(self) -> List[str]:
-        """Get all debug information"""
-        return self.debug_info
+    def start(self):
+        """
+        Start connecting the sink in the background (idempotent)
+        
+        The app calls this after the first page render so that importing the
+        Sheets client libraries does not compete with startup; logging an event
+        starts it as well.
+        """
+        if self._init_thread is not None:
+            return
+        with self._start_lock:
+            if self._init_thread is None:
+                self._init_thread = threading.Thread(target=self._connect_sink, name="log-sink-init", daemon=True)
+                self._init_thread.start()
     
-    def _init_sheets(self):
-        """Initialize Google Sheets connection"""
+    def _connect_sink(self):
+        """Connect the sink in the background, then replay undelivered events"""
+        started = time.monotonic()
         try:
-            self._add_debug("🔧 Starting Google Sheets initialization...")
-            
-            # Streamlit Cloudでの認証
-            if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
-                self._add_debug("🔑 Found Streamlit secrets")
-                # Streamlit Cloud環境
-                credentials_info = dict(st.secrets["gcp_service_account"])
-                self._add_debug(f"📋 Project ID: {credentials_info.get('project_id', 'Not found')}")
-                
-                scope = [
-                    'https://spreadsheets.google.com/feeds',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                
-                credentials = Credentials.from_service_account_info(credentials_info, scopes=scope)
-                self._add_debug("✅ Credentials created successfully")
-                
-                self.gc = gspread.authorize(credentials)
-                self._add_debug("✅ Google Sheets client authorized")
-                
-                # スプレッドシートの開始/作成
-                spreadsheet_name = "CLIP Search Logs"
-                self._add_debug(f"📊 Looking for spreadsheet: {spreadsheet_name}")
-                
-                try:
-                    spreadsheet = self.gc.open(spreadsheet_name)
-                    self._add_debug(f"✅ Found existing spreadsheet: {spreadsheet_name}")
-                except gspread.SpreadsheetNotFound:
-                    self._add_debug(f"📝 Creating new spreadsheet: {spreadsheet_name}")
-                    spreadsheet = self.gc.create(spreadsheet_name)
-                    self._add_debug(f"✅ Created new spreadsheet: {spreadsheet_name}")
-                
-                # ワークシートの取得/作成
-                worksheet_name = "Search Logs"
-                self._add_debug(f"📄 Looking for worksheet: {worksheet_name}")
-                
-                try:
-                    self.worksheet = spreadsheet.worksheet(worksheet_name)
-                    self._add_debug(f"✅ Found existing worksheet: {worksheet_name}")
-                except gspread.WorksheetNotFound:
-                    self._add_debug(f"📝 Creating new worksheet: {worksheet_name}")
-                    self.worksheet = spreadsheet.add_worksheet(title=worksheet_name, rows="1000", cols="20")
-                    self._add_debug(f"✅ Created new worksheet: {worksheet_name}")
-                    
-                    # ヘッダーを設定
-                    headers = [
-                        "timestamp", "session_id", "query_text", "correct_rank", 
-                        "result_1_filename", "result_1_similarity", "result_1_category",
-                        "result_2_filename", "result_2_similarity", "result_2_category",
-                        "result_3_filename", "result_3_similarity", "result_3_category",
-                        "result_4_filename", "result_4_similarity", "result_4_category",
-                        "result_5_filename", "result_5_similarity", "result_5_category",
-                        "result_6_filename", "result_6_similarity", "result_6_category",
-                        "result_7_filename", "result_7_similarity", "result_7_category",
-                        "result_8_filename", "result_8_similarity", "result_8_category",
-                        "result_9_filename", "result_9_similarity", "result_9_category",
-                        "result_10_filename", "result_10_similarity", "result_10_category"
-                    ]
-                    self.worksheet.append_row(headers)
-                    self._add_debug("✅ Headers added to worksheet")
-                    
-            else:
-                self._add_debug("🔑 No Streamlit secrets found, trying local file...")
-                # ローカル環境での認証
-                if os.path.exists("service-account-key.json"):
-                    self._add_debug("📁 Found local service account file")
-                    scope = [
-                        'https://spreadsheets.google.com/feeds',
-                        'https://www.googleapis.com/auth/drive'
-                    ]
-                    credentials = Credentials.from_service_account_file("service-account-key.json", scopes=scope)
-                    self.gc = gspread.authorize(credentials)
-                    self._add_debug("✅ Local credentials authorized")
-                    
-                    # 同様の処理...
-                    spreadsheet_name = "CLIP Search Logs"
-                    try:
-                        spreadsheet = self.gc.open(spreadsheet_name)
-                        self._add_debug(f"✅ Found existing spreadsheet (local): {spreadsheet_name}")
-                    except gspread.SpreadsheetNotFound:
-                        spreadsheet = self.gc.create(spreadsheet_name)
-                        self._add_debug(f"✅ Created new spreadsheet (local): {spreadsheet_name}")
-                    
-                    try:
-                        self.worksheet = spreadsheet.worksheet("Search Logs")
-                        self._add_debug("✅ Found existing worksheet (local)")
-                    except gspread.WorksheetNotFound:
-                        self.worksheet = spreadsheet.add_worksheet(title="Search Logs", rows="1000", cols="20")
-                        headers = [
-                            "timestamp", "session_id", "query_text", "correct_rank", 
-                            "result_1_filename", "result_1_similarity", "result_1_category",
-                            "result_2_filename", "result_2_similarity", "result_2_category",
-                            "result_3_filename", "result_3_similarity", "result_3_category",
-                            "result_4_filename", "result_4_similarity", "result_4_category",
-                            "result_5_filename", "result_5_similarity", "result_5_category",
-                            "result_6_filename", "result_6_similarity", "result_6_category",
-                            "result_7_filename", "result_7_similarity", "result_7_category",
-                            "result_8_filename", "result_8_similarity", "result_8_category",
-                            "result_9_filename", "result_9_similarity", "result_9_category",
-                            "result_10_filename", "result_10_similarity", "result_10_category"
-                        ]
-                        self.worksheet.append_row(headers)
-                        self._add_debug("✅ Headers added to worksheet (local)")
-                else:
-                    self._add_debug("❌ No service account file found")
-                
+            connected = self.sink.connect()
         except Exception as e:
-            self._add_debug(f"❌ Google Sheets setup error: {e}")
-            st.error(f"Google Sheets setup error: {e}")
+            connected = False
+            self._add_debug(f"❌ {self.sink.label} initialization failed: {e}", level=WARNING)
+        self.status = SINK_READY if connected else SINK_UNAVAILABLE
+        self._ready.set()
+        log.info("sink.initialized", backend=self.sink.name, status=self.status,
+                 elapsed_ms=round((time.monotonic() - started) * 1000, 1))
+        if connected:
+            self.replay_pending()
+    
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the background sink initialization to finish
+        
+        Args:
+            timeout: seconds to wait (None waits indefinitely)
+        
+        Returns:
+            bool: True if initialization finished (connected or not)
+        """
+        self.start()
+        return self._ready.wait(timeout)
     
+    @property
+    def worksheet(self):
+        """Worksheet handle when logging to Google Sheets (None otherwise or when disconnected)"""
+        return getattr(self.sink, 'worksheet', None)
+    
+    def is_connected(self) -> bool:
+        """Whether the log sink can currently accept rows (False while still connecting)"""
+        return self.status != SINK_CONNECTING and self.sink.is_connected()
+    
+    def _add_debug(self, message: str, level: int = DEBUG):
+        """Add a diagnostic message (kept in a ring buffer and sent to the structured log)"""
+        # 時刻の整形は参照時まで遅らせる
+        self.debug_info.append((time.time(), message))
+        log.log(level, "sheets.debug", message=message)
+    
+    def get_debug_info(self) -> List[str]:
+        """Get recent debug information"""
+        return [
+            f"[{datetime.fromtimestamp(ts).strftime('%H:%M:%S')}] {message}"
+            for ts, message in self.debug_info
+        ]
+    
+    @traced()
     def log_search_query(self, query: str, results: List[Tuple]) -> str:
         """Log search query with results"""
+        self.start()
         session_id = f"search_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
         timestamp = datetime.now().isoformat()
         
-        print(f"SHEETS_LOGGER: === Creating new search session ===")
-        print(f"SHEETS_LOGGER: Generated session ID: {session_id}")
-        print(f"SHEETS_LOGGER: Query: {query}")
-        print(f"SHEETS_LOGGER: Results count: {len(results)}")
-        
-        self._add_debug(f"🔍 Logging search query: '{query}' (Session: {session_id})")
+        if self.journal:
+            self.journal.append('search', session_id, {
+                'timestamp': timestamp,
+                'query': query,
+                'results': [[float(r[0])] + list(r[1:]) for r in results]
+            })
         
         # Session cache for feedback
         self.session_cache[session_id] = {
@@ -200,39 +323,28 @@ class SheetsLogger:
             'results': results,
             'correct_rank': None
         }
+        self.search_count += 1
+        LOG_EVENTS.inc(type="search")
         
-        print(f"SHEETS_LOGGER: Session cached successfully")
-        print(f"SHEETS_LOGGER: Total sessions in cache: {len(self.session_cache)}")
-        print(f"SHEETS_LOGGER: Session cache keys: {list(self.session_cache.keys())}")
-        
-        self._add_debug(f"📝 Session cached. Total sessions: {len(self.session_cache)}")
-        
+        log.debug("search.logged", sample=HOT_PATH_SAMPLE_RATE,
+                  session_id=session_id, query=query, results=len(results))
         return session_id
     
     def log_user_feedback(self, session_id: str, correct_rank: Optional[int]) -> bool:
         """Log user feedback (correct rank or None for no correct answer)"""
-        print(f"SHEETS_LOGGER: === Starting log_user_feedback ===")
-        print(f"SHEETS_LOGGER: Session ID: {session_id}")
-        print(f"SHEETS_LOGGER: Correct rank: {correct_rank}")
-        
-        self._add_debug(f"👤 Logging feedback for session: {session_id}, rank: {correct_rank}")
-        
-        if session_id not in self.session_cache:
-            self._add_debug(f"❌ Session not found in cache: {session_id}")
-            print(f"SHEETS_LOGGER: Available sessions: {list(self.session_cache.keys())}")
-            print(f"SHEETS_LOGGER: ERROR: Session not found, returning False")
+        session_data = self.session_cache.get(session_id)
+        if session_data is None:
+            CACHE_REQUESTS.inc(cache="session", result="miss")
+            log.warning("feedback.session_not_found", session_id=session_id)
             st.error("Session not found")
             return False
+        CACHE_REQUESTS.inc(cache="session", result="hit")
+        LOG_EVENTS.inc(type="feedback")
         
-        session_data = self.session_cache[session_id]
+        if (session_data['correct_rank'] is None) != (correct_rank is None):
+            self.feedback_count += 1 if correct_rank is not None else -1
         session_data['correct_rank'] = correct_rank
         
-        print(f"SHEETS_LOGGER: Session data retrieved successfully")
-        print(f"SHEETS_LOGGER: Query: {session_data['query']}")
-        print(f"SHEETS_LOGGER: Results count: {len(session_data['results'])}")
-        
-        self._add_debug(f"📊 Preparing data for Google Sheets...")
-        
         # Prepare row data
         row_data = [
             session_data['timestamp'],
@@ -243,110 +355,36 @@ class SheetsLogger:
         
         # Add results data (up to 10 results)
         results = session_data['results']
-        self._add_debug(f"📋 Processing {len(results)} search results...")
         
         for i in range(10):
             if i < len(results):
                 similarity, image_id, filename, category, description, file_path = results[i]
                 row_data.extend([filename, f"{similarity:.3f}", category])
-                self._add_debug(f"   Result {i+1}: {filename} ({similarity:.3f}, {category})")
             else:
                 row_data.extend(["", "", ""])
         
-        print(f"SHEETS_LOGGER: Row data prepared with {len(row_data)} columns")
-        print(f"SHEETS_LOGGER: Row data sample: {row_data[:6]}...")  # Show first 6 elements
+        # Journal first so the row survives a restart, then hand it to the background writer
+        if self.journal:
+            self.journal.append('feedback', session_id, {'row': row_data})
         
-        # Try to write to Google Sheets with fresh connection
-        try:
-            self._add_debug("📤 Creating fresh connection for reliable write...")
-            print(f"SHEETS_LOGGER: Attempting fresh connection...")
-            
-            # Create fresh connection (same as test_connection)
-            if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
-                print(f"SHEETS_LOGGER: Secrets found, creating credentials...")
-                credentials_info = dict(st.secrets["gcp_service_account"])
-                scope = [
-                    'https://spreadsheets.google.com/feeds',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                credentials = Credentials.from_service_account_info(credentials_info, scopes=scope)
-                print(f"SHEETS_LOGGER: Credentials created successfully")
-                
-                gc = gspread.authorize(credentials)
-                print(f"SHEETS_LOGGER: Client authorized successfully")
-                
-                # Access spreadsheet and worksheet
-                spreadsheet_name = "CLIP Search Logs"
-                print(f"SHEETS_LOGGER: Accessing spreadsheet: {spreadsheet_name}")
-                spreadsheet = gc.open(spreadsheet_name)
-                print(f"SHEETS_LOGGER: Spreadsheet opened successfully")
-                
-                worksheet = spreadsheet.worksheet("Search Logs")
-                print(f"SHEETS_LOGGER: Worksheet accessed successfully")
-                
-                self._add_debug("✅ Fresh connection established")
-                
-                # Write data
-                self._add_debug(f"📤 Writing row with {len(row_data)} columns...")
-                print(f"SHEETS_LOGGER: About to write to worksheet...")
-                print(f"SHEETS_LOGGER: Full row data: {row_data}")
-                
-                worksheet.append_row(row_data)
-                print(f"SHEETS_LOGGER: Row written successfully!")
-                
-                self._add_debug("✅ Successfully logged to Google Sheets!")
-                print(f"SHEETS_LOGGER: SUCCESS: Returning True")
-                return True
-                
-            else:
-                self._add_debug("❌ No secrets available for fresh connection")
-                print(f"SHEETS_LOGGER: Secrets not found - hasattr: {hasattr(st, 'secrets')}")
-                if hasattr(st, 'secrets'):
-                    print(f"SHEETS_LOGGER: Available secret keys: {list(st.secrets.keys())}")
-                raise Exception("Streamlit secrets not available")
-                
-        except Exception as e:
-            print(f"SHEETS_LOGGER: Fresh connection write failed with error: {str(e)}")
-            print(f"SHEETS_LOGGER: Error type: {type(e).__name__}")
-            import traceback
-            print(f"SHEETS_LOGGER: Full traceback: {traceback.format_exc()}")
-            
-            self._add_debug(f"❌ Fresh connection write failed: {e}")
-            
-            # Fallback: try original self.worksheet
-            if self.worksheet:
-                try:
-                    self._add_debug("📤 Trying fallback to self.worksheet...")
-                    print(f"SHEETS_LOGGER: Trying fallback to self.worksheet...")
-                    self.worksheet.append_row(row_data)
-                    print(f"SHEETS_LOGGER: Fallback write successful!")
-                    self._add_debug("✅ Fallback write successful!")
-                    print(f"SHEETS_LOGGER: SUCCESS: Fallback worked, returning True")
-                    return True
-                except Exception as e2:
-                    print(f"SHEETS_LOGGER: Fallback write also failed: {str(e2)}")
-                    self._add_debug(f"❌ Fallback write also failed: {e2}")
-                    # Store in fallback logs
-                    self._store_fallback_log(session_data, correct_rank, results)
-                    print(f"SHEETS_LOGGER: ERROR: All writes failed, returning False")
-                    return False
-            else:
-                print(f"SHEETS_LOGGER: No self.worksheet available for fallback")
-                self._add_debug("❌ No worksheet available for fallback")
-                # Store in fallback logs
-                self._store_fallback_log(session_data, correct_rank, results)
-                print(f"SHEETS_LOGGER: ERROR: No fallback available, returning False")
-                return False
+        # Hand the row to the background writer and acknowledge immediately
+        if self.writer.submit(row_data):
+            log.debug("feedback.queued", sample=HOT_PATH_SAMPLE_RATE,
+                      session_id=session_id, correct_rank=correct_rank)
+            return True
         
-        print(f"SHEETS_LOGGER: === Completed log_user_feedback ===")
+        log.error("feedback.queue_unavailable", session_id=session_id)
+        # Store in fallback logs
+        self._store_fallback_log(row_data)
+        return False
     
     def get_session_count(self) -> int:
         """Get total session count"""
-        return len(self.session_cache)
+        return self.search_count
     
     def get_feedback_count(self) -> int:
         """Get feedback count"""
-        return len([s for s in self.session_cache.values() if s['correct_rank'] is not None])
+        return self.feedback_count
     
     def get_secrets_diagnostic(self) -> dict:
         """Detailed diagnostic of Streamlit secrets configuration"""
@@ -431,92 +469,114 @@ class SheetsLogger:
         return diagnostic
 
     def test_connection(self) -> dict:
-        """Test Google Sheets connection and return detailed status"""
-        status = {
-            'libraries_available': SHEETS_AVAILABLE,
-            'secrets_found': False,
-            'credentials_valid': False,
-            'client_authorized': False,
-            'spreadsheet_accessible': False,
-            'worksheet_accessible': False,
-            'can_write': False,
-            'error_message': None
-        }
+        """Test the log sink connection and return detailed status"""
+        return self.sink.test_connection()
+
+    def _write_feedback_rows(self, rows: List[List]) -> bool:
+        """Write feedback rows that have not been delivered yet and acknowledge them in the journal"""
+        # 初期化中は書き込みスレッドをここで待たせ、後続の行はキューに溜める
+        # （初期化が終わらない場合は書き込み側の再接続に任せる）
+        self.wait_until_ready(SINK_INIT_WAIT_TIMEOUT)
+        if self.journal:
+            # 再送などで既に送信済みの行は書き込まない（session_id で重複排除）
+            unique_rows = {}
+            for row in rows:
+                if not self.journal.is_sent(make_event_id('feedback', row[1])):
+                    unique_rows[row[1]] = row
+            rows = list(unique_rows.values())
+            if not rows:
+                return True
         
+        written = False
         try:
-            # Check if secrets are available
-            if hasattr(st, 'secrets') and 'gcp_service_account' in st.secrets:
-                status['secrets_found'] = True
-                self._add_debug("✅ Secrets found for connection test")
-                
-                # Test credentials
-                credentials_info = dict(st.secrets["gcp_service_account"])
-                scope = [
-                    'https://spreadsheets.google.com/feeds',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-                credentials = Credentials.from_service_account_info(credentials_info, scopes=scope)
-                status['credentials_valid'] = True
-                self._add_debug("✅ Credentials valid")
-                
-                # Test client authorization
-                gc = gspread.authorize(credentials)
-                status['client_authorized'] = True
-                self._add_debug("✅ Client authorized")
-                
-                # Test spreadsheet access
-                spreadsheet_name = "CLIP Search Logs"
-                try:
-                    spreadsheet = gc.open(spreadsheet_name)
-                    status['spreadsheet_accessible'] = True
-                    self._add_debug(f"✅ Spreadsheet accessible: {spreadsheet_name}")
-                    
-                    # Test worksheet access
-                    worksheet = spreadsheet.worksheet("Search Logs")
-                    status['worksheet_accessible'] = True
-                    self._add_debug("✅ Worksheet accessible")
-                    
-                    # Test write capability
-                    test_data = ["TEST", datetime.now().isoformat(), "connection_test", "test_rank"]
-                    # Add empty values for remaining columns (up to 34 columns total)
-                    test_data.extend([""] * 30)
-                    worksheet.append_row(test_data)
-                    status['can_write'] = True
-                    self._add_debug("✅ Write test successful")
-                    
-                except gspread.SpreadsheetNotFound:
-                    self._add_debug(f"❌ Spreadsheet not found: {spreadsheet_name}")
-                    status['error_message'] = f"Spreadsheet '{spreadsheet_name}' not found"
-                except gspread.WorksheetNotFound:
-                    self._add_debug("❌ Worksheet 'Search Logs' not found")
-                    status['error_message'] = "Worksheet 'Search Logs' not found"
-                except Exception as e:
-                    self._add_debug(f"❌ Write test failed: {e}")
-                    status['error_message'] = f"Write test failed: {e}"
-                    
-            else:
-                self._add_debug("❌ No secrets found for connection test")
-                status['error_message'] = "Streamlit secrets not found"
-                
+            with LOG_SINK_WRITE_SECONDS.time(backend=self.sink.name):
+                written = self.sink.write_rows(rows)
+        finally:
+            LOG_SINK_ROWS.inc(len(rows), backend=self.sink.name, result="success" if written else "failure")
+        if not written:
+            self._needs_replay = True
+            return False
+        
+        event_ids = [make_event_id('feedback', row[1]) for row in rows]
+        if self.journal:
+            self.journal.mark_sent(event_ids)
+        self._release_replay(event_ids)
+        
+        # 障害から復旧したら、ジャーナルに残っている未送信分を再送
+        if self._needs_replay:
+            self.replay_pending()
+        return True
+    
+    def replay_pending(self) -> int:
+        """
+        Re-send journaled feedback events that were never delivered
+        
+        Session ids already present in the sink are acknowledged without
+        writing again, so replay is idempotent even if an ack was lost.
+        
+        Returns:
+            int: number of rows queued for writing
+        """
+        if not self.journal:
+            return 0
+        journal_pending = self.journal.pending_events('feedback')
+        # 対象のイベントを先に確保し、別スレッドの再送と同じ行を二重に積まないようにする
+        with self._replay_lock:
+            pending = [event for event in journal_pending if event['event_id'] not in self._replay_inflight]
+            self._replay_inflight.update(event['event_id'] for event in pending)
+        if not pending:
+            self._needs_replay = False
+            return 0
+        
+        try:
+            remote_session_ids = self.sink.delivered_session_ids(event['session_id'] for event in pending)
         except Exception as e:
-            status['error_message'] = str(e)
-            self._add_debug(f"❌ Connection test failed: {e}")
-            
-        return status
+            self._add_debug(f"❌ Replay skipped, could not read remote sessions: {e}", level=WARNING)
+            self._release_replay(event['event_id'] for event in pending)
+            return 0
+        
+        delivered = [event['event_id'] for event in pending if event['session_id'] in remote_session_ids]
+        self.journal.mark_sent(delivered)
+        
+        queued = 0
+        released = list(delivered)
+        for event in pending:
+            if event['session_id'] in remote_session_ids:
+                continue
+            if self.writer.submit(event['payload']['row']):
+                queued += 1
+            else:
+                released.append(event['event_id'])
+        self._release_replay(released)
+        
+        self._needs_replay = False
+        self._add_debug(f"🔁 Replay: {len(delivered)} already delivered, {queued} re-queued")
+        return queued
+    
+    def _on_write_failure(self, rows: List[List]):
+        """Called by the background writer when a batch could not be written"""
+        self._add_debug(f"❌ {self.sink.label} write failed for {len(rows)} rows (kept in journal for replay)", level=WARNING)
+        LOG_SINK_ROWS.inc(len(rows), backend=self.sink.name, result="gave_up")
+        self._needs_replay = True
+        self._release_replay(make_event_id('feedback', row[1]) for row in rows)
+        for row_data in rows:
+            self._store_fallback_log(row_data)
+
+    def _release_replay(self, event_ids):
+        """Allow these events to be replayed again"""
+        with self._replay_lock:
+            self._replay_inflight.difference_update(event_ids)
 
-    def _store_fallback_log(self, session_data: dict, correct_rank: Optional[int], results: List):
+    def _store_fallback_log(self, row_data: List):
         """Store log data in fallback storage"""
-        print(f"SHEETS_LOGGER: Storing to fallback logs...")
         self.fallback_logs.append({
-            'timestamp': session_data['timestamp'],
-            'session_id': session_data.get('session_id', 'unknown'),
-            'query': session_data['query'],
-            'correct_rank': correct_rank,
-            'results': results
+            'timestamp': row_data[0],
+            'session_id': row_data[1],
+            'query': row_data[2],
+            'correct_rank': row_data[3],
+            'row': row_data
         })
         self._add_debug(f"📁 Logged to fallback storage. Total fallback logs: {len(self.fallback_logs)}")
-        st.info("📝 Logged locally (Sheets unavailable)")
-        print(f"SHEETS_LOGGER: Fallback storage complete. Total: {len(self.fallback_logs)}")
 
 # グローバルインスタンス
 search_logger = SheetsLogger() 
\ No newline at end of file
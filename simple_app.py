@@ -9,6 +9,7 @@ import sqlite_vec
 import numpy as np
 import os
 import sys
+import threading
 from pathlib import Path
 
 # パスの設定
@@ -17,6 +18,9 @@ sys.path.append(str(Path(__file__).parent.parent / "clip-pbl"))
 # データベースパス
 DB_PATH = "../clip-pbl/example.db"
 
+# ベクトル検索用に一度に読み込む行数
+INDEX_FETCH_SIZE = 10000
+
 # ページ設定
 st.set_page_config(
     page_title="CLIP画像検索デモ",
@@ -97,56 +101,143 @@ def extract_text_features_simple(text: str) -> np.ndarray:
     
     return feature_vector
 
-def search_similar_items(query_text: str, top_k: int = 5):
-    """類似アイテムを検索"""
+class EmbeddingIndex:
+    """
+    正規化済みの埋め込み行列と対応するアイテム情報
+
+    検索はクエリとの行列ベクトル積1回と argpartition による上位k件の選択で行う。
+    """
+
+    def __init__(self, items: list, embeddings: np.ndarray, signature=None):
+        """
+        Args:
+            items: (id, type, feature, lost_place, picture_path) のリスト
+            embeddings: 埋め込み行列 (shape: [len(items), dim])。行は正規化される
+            signature: 作成元データベースの状態（変更検知用）
+        """
+        self.items = items
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        # ノルムが0の行は類似度0になるようにそのまま残す
+        norms = np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.embeddings /= norms
+        self.signature = signature
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def search(self, query_vector: np.ndarray, top_k: int = 5) -> list:
+        """
+        コサイン類似度の上位 top_k 件を取得
+
+        Args:
+            query_vector: クエリベクトル
+            top_k: 取得件数
+
+        Returns:
+            list: 類似度の降順に並んだ (アイテムのインデックス, 類似度) のリスト
+        """
+        if len(self.items) == 0 or top_k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        similarities = self.embeddings @ query
+        k = min(top_k, len(similarities))
+        if k < len(similarities):
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(k)
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [(int(i), float(similarities[i])) for i in top]
+
+_embedding_index = None
+_embedding_index_lock = threading.Lock()
+
+def get_db_signature() -> tuple:
+    """データベースファイル（WALを含む）の更新時刻とサイズ。内容が変わると変化する"""
+    signature = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_embedding_index() -> EmbeddingIndex:
+    """lost / vec_lost から埋め込み行列を読み込む"""
+    signature = get_db_signature()
+    conn = get_db_connection()
     try:
-        # テキスト特徴量を生成
-        query_vector = extract_text_features_simple(query_text)
-        
-        # データベース接続
-        conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # 落とし物データを取得
+        # vec_lost との結合件数は全件走査になるため、lost の件数を上限として行列を確保する
+        cursor.execute("SELECT COUNT(*) FROM lost")
+        count = cursor.fetchone()[0]
+
         cursor.execute("""
         SELECT l.id, l.type, l.feature, l.lost_place, l.picture_path,
                v.embedding
         FROM lost l
         JOIN vec_lost v ON l.vector = v.rowid
         """)
-        
-        results = cursor.fetchall()
+
+        # 全行を一度に取得せず、確保済みの行列に順に詰める（大規模時のメモリ使用量を抑える）
+        # 件数の取得後に追加された行は次回の再読み込みで反映する
+        items = []
+        embeddings = None
+        rows = cursor.fetchmany(INDEX_FETCH_SIZE)
+        while rows and len(items) < count:
+            for row in rows[:count - len(items)]:
+                vector = np.frombuffer(row[5], dtype=np.float32)
+                if embeddings is None:
+                    embeddings = np.empty((count, len(vector)), dtype=np.float32)
+                embeddings[len(items)] = vector
+                items.append(row[:5])
+            rows = cursor.fetchmany(INDEX_FETCH_SIZE)
+    finally:
         conn.close()
+
+    if embeddings is None:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    return EmbeddingIndex(items, embeddings[:len(items)], signature)
+
+def get_embedding_index() -> EmbeddingIndex:
+    """キャッシュした埋め込み行列を取得（データベースが更新されていれば読み込み直す）"""
+    global _embedding_index
+    signature = get_db_signature()
+    index = _embedding_index
+    if index is not None and index.signature == signature:
+        return index
+    with _embedding_index_lock:
+        if _embedding_index is None or _embedding_index.signature != signature:
+            _embedding_index = load_embedding_index()
+        return _embedding_index
+
+def search_similar_items(query_text: str, top_k: int = 5):
+    """類似アイテムを検索"""
+    try:
+        # テキスト特徴量を生成
+        query_vector = extract_text_features_simple(query_text)
         
-        if not results:
-            return []
+        # 正規化済みの埋め込み行列から上位 top_k 件を取得
+        index = get_embedding_index()
         
-        # 類似度計算
-        similarities = []
-        for row in results:
-            item_id, item_type, feature, lost_place, picture_path, embedding_blob = row
-            
-            # バイナリデータからベクトルに変換
-            item_vector = np.frombuffer(embedding_blob, dtype=np.float32)
-            
-            # コサイン類似度計算
-            similarity = np.dot(query_vector, item_vector) / (
-                np.linalg.norm(query_vector) * np.linalg.norm(item_vector)
-            )
-            
-            similarities.append({
+        results = []
+        for i, similarity in index.search(query_vector, top_k):
+            item_id, item_type, feature, lost_place, picture_path = index.items[i]
+            results.append({
                 'id': item_id,
                 'type': item_type,
                 'feature': feature,
                 'lost_place': lost_place,
                 'picture_path': picture_path,
-                'similarity': float(similarity)
+                'similarity': similarity
             })
         
-        # 類似度でソート
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        return similarities[:top_k]
+        return results
         
     except Exception as e:
         st.error(f"検索エラー: {str(e)}")
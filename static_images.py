@@ -0,0 +1,278 @@
+"""
+画像の静的ファイル配信
+
+サムネイルと元画像を内容ハッシュ付きのファイル名で static/img に公開し、
+Streamlitのwebsocket経由ではなく <img> タグのURLでブラウザに取得させる。
+ファイル名が内容で決まるため、同じURLの画像は常に同じ内容でブラウザキャッシュを再利用できる。
+
+表示時に公開するのはサムネイルのみ。元画像（クリック時のリンク先）は読み込みとハッシュ計算の
+コストが大きいため、batch_vectorize.py または `python static_images.py` で事前に公開しておき、
+公開済みの一覧（ORIGINALS_MANIFEST_PATH）から表示時にURLを引く。
+
+配信モード（環境変数 IMAGE_SERVING_MODE）:
+    static : Streamlitの静的ファイル配信（server.enableStaticServing）で app/static/img から配信
+    server : ローカルの静的ファイルサーバー（IMAGE_SERVER_HOST:IMAGE_SERVER_PORT）から長期キャッシュヘッダー付きで配信
+    inline : 従来通り st.image で画像データを送信
+
+static モードのキャッシュヘッダーはStreamlit側の既定値のままで、このモジュールからは
+長期キャッシュ（CACHE_CONTROL）を付与できない。長期キャッシュが必要な場合は server モードを使う。
+
+server モードのサーバーは既定で 127.0.0.1 のみで待ち受ける。他のホストのブラウザから
+参照させる場合は IMAGE_SERVER_HOST を公開するアドレスにし、ブラウザから到達できる
+IMAGE_SERVER_URL を指定する（0.0.0.0 などで待ち受ける場合は IMAGE_SERVER_URL が必須）。
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional
+from thumbnail_cache import IMAGE_ROOT, get_thumbnail, iter_image_files
+
+IMAGE_SERVING_MODE = os.environ.get("IMAGE_SERVING_MODE", "static")
+
+# Streamlitは app.py と同じディレクトリの static/ を app/static/ として配信する
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_IMAGE_DIR = os.path.join(STATIC_DIR, "img")
+
+# 公開済みの元画像の一覧（元画像のパス → 更新時刻・サイズ・公開ファイル名）。配信対象外の場所に置く
+ORIGINALS_MANIFEST_PATH = os.environ.get(
+    "ORIGINALS_MANIFEST_PATH",
+    os.path.join(os.path.dirname(STATIC_DIR), ".published_originals.json"),
+)
+
+# ローカル静的ファイルサーバーの設定（server モード）
+IMAGE_SERVER_HOST = os.environ.get("IMAGE_SERVER_HOST", "127.0.0.1")
+IMAGE_SERVER_PORT = int(os.environ.get("IMAGE_SERVER_PORT", 8502))
+# 全インターフェースで待ち受ける場合はブラウザから見たURLを導出できないため明示が必要
+_WILDCARD_HOSTS = ("", "0.0.0.0", "::")
+IMAGE_SERVER_URL = os.environ.get("IMAGE_SERVER_URL") or (
+    None if IMAGE_SERVER_HOST in _WILDCARD_HOSTS else f"http://{IMAGE_SERVER_HOST}:{IMAGE_SERVER_PORT}"
+)
+
+# 内容ハッシュ付きURLは内容が変わらないため長期キャッシュ可能
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# (パス, 更新時刻, サイズ) → 公開ファイル名
+_published = {}
+_published_lock = threading.Lock()
+
+# 読み込んだ元画像の一覧と、読み込み時のファイルの更新時刻
+_manifest = {}
+_manifest_mtime = None
+_manifest_lock = threading.Lock()
+
+def _content_hash(file_path: str) -> str:
+    """ファイル内容のハッシュを計算"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+def publish_file(file_path: str, link: bool = False) -> str:
+    """
+    ファイルを内容ハッシュ付きの名前で static/img に配置
+
+    Args:
+        file_path: 公開するファイルのパス
+        link: ハードリンクで公開するか。元ファイルがその場で書き換えられると公開済みの
+            内容も変わってしまうため、常に一時ファイルから置き換えで書かれるファイル
+            （サムネイル）にのみ使う
+
+    Returns:
+        str: static/img 内のファイル名
+    """
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _published_lock:
+        name = _published.get(cache_key)
+    if name:
+        return name
+
+    ext = os.path.splitext(file_path)[1].lower()
+    name = _content_hash(file_path) + ext
+    dest = os.path.join(STATIC_IMAGE_DIR, name)
+    if not os.path.exists(dest):
+        os.makedirs(STATIC_IMAGE_DIR, exist_ok=True)
+        linked = False
+        if link:
+            try:
+                # 同じファイルシステムならハードリンクでディスクを消費しない（リンクの作成は不可分）
+                os.link(file_path, dest)
+                linked = True
+            except FileExistsError:
+                # 同じ内容を別のセッションが先に公開した
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            # 複数のセッションが同じ画像を同時に公開しても衝突しないよう、一時ファイルは呼び出しごとに作成
+            fd, tmp_path = tempfile.mkstemp(dir=STATIC_IMAGE_DIR, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as dst, open(file_path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp_path, dest)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    with _published_lock:
+        _published[cache_key] = name
+    return name
+
+def static_url(name: str) -> str:
+    """公開ファイル名から配信URLを生成"""
+    if IMAGE_SERVING_MODE == "server":
+        return f"{IMAGE_SERVER_URL}/img/{name}"
+    return f"app/static/img/{name}"
+
+def image_url(image_path: str, size: int) -> str:
+    """
+    サムネイルの配信URLを取得（未生成・未公開なら生成して公開）
+
+    Args:
+        image_path: 元画像のパス
+        size: サムネイルの最大辺
+
+    Returns:
+        str: 画像のURL
+    """
+    # サムネイルは一時ファイルから置き換えで生成されるためハードリンクで公開できる
+    return static_url(publish_file(get_thumbnail(image_path, size), link=True))
+
+def _load_manifest() -> dict:
+    """公開済みの元画像の一覧を読み込み（ファイルが更新されたときのみ読み直す）"""
+    global _manifest, _manifest_mtime
+    try:
+        mtime = os.stat(ORIGINALS_MANIFEST_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _manifest_lock:
+        if mtime != _manifest_mtime:
+            try:
+                with open(ORIGINALS_MANIFEST_PATH, "r", encoding="utf-8") as f:
+                    _manifest = json.load(f)
+            except (OSError, ValueError):
+                _manifest = {}
+            _manifest_mtime = mtime
+        return _manifest
+
+def original_url(image_path: str) -> Optional[str]:
+    """
+    事前に公開された元画像の配信URLを取得（表示時に公開はしない）
+
+    Args:
+        image_path: 元画像のパス
+
+    Returns:
+        Optional[str]: 画像のURL（未公開、または公開後に元画像が変更された場合は None）
+    """
+    entry = _load_manifest().get(os.path.abspath(image_path))
+    if entry is None:
+        return None
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    if entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+        return None
+    return static_url(entry['name'])
+
+def publish_originals(image_paths: Iterable[str]) -> dict:
+    """
+    元画像を static/img に公開し、公開済みの一覧を更新
+
+    Args:
+        image_paths: 元画像のパス
+
+    Returns:
+        dict: {'published': 件数, 'errors': 件数}
+    """
+    manifest = dict(_load_manifest())
+    stats = {'published': 0, 'errors': 0}
+    for image_path in image_paths:
+        try:
+            stat = os.stat(image_path)
+            # 元画像はその場で書き換えられる可能性があるため複製して公開する
+            name = publish_file(image_path)
+        except OSError as e:
+            print(f"エラー: 元画像の公開に失敗 ({image_path}): {e}")
+            stats['errors'] += 1
+            continue
+        manifest[os.path.abspath(image_path)] = {
+            'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'name': name,
+        }
+        stats['published'] += 1
+
+    directory = os.path.dirname(ORIGINALS_MANIFEST_PATH) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, ORIGINALS_MANIFEST_PATH)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return stats
+
+class CachingStaticHandler(SimpleHTTPRequestHandler):
+    """長期キャッシュヘッダーを付与する静的ファイルハンドラー"""
+
+    def end_headers(self):
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+def start_image_server(port: int = IMAGE_SERVER_PORT, host: str = IMAGE_SERVER_HOST) -> ThreadingHTTPServer:
+    """
+    static/ を配信するローカル静的ファイルサーバーをバックグラウンドで起動
+
+    Args:
+        port: 待ち受けポート
+        host: 待ち受けアドレス（既定 127.0.0.1）
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+
+    Raises:
+        ValueError: 全インターフェースで待ち受けるのに IMAGE_SERVER_URL が未指定の場合
+    """
+    if not IMAGE_SERVER_URL or (host in _WILDCARD_HOSTS and not os.environ.get("IMAGE_SERVER_URL")):
+        raise ValueError(f"{host or '全インターフェース'} で待ち受ける場合は IMAGE_SERVER_URL を指定してください")
+    os.makedirs(STATIC_IMAGE_DIR, exist_ok=True)
+    handler = partial(CachingStaticHandler, directory=STATIC_DIR)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="image-server", daemon=True)
+    thread.start()
+    return server
+
+def main(argv: Optional[List[str]] = None):
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="元画像を静的ファイルとして事前公開")
+    parser.add_argument("--root", default=IMAGE_ROOT, help="元画像のディレクトリ")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.root):
+        print(f"エラー: 画像ディレクトリが見つかりません: {args.root}")
+        sys.exit(1)
+
+    print("=== 元画像の公開 ===")
+    stats = publish_originals(iter_image_files(args.root))
+    print(f"  公開: {stats['published']}件")
+    print(f"  エラー: {stats['errors']}件")
+
+if __name__ == "__main__":
+    main()
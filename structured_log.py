@@ -0,0 +1,147 @@
+"""
+Leveled structured logging that writes JSON lines
+
+Call sites pass an event name and raw field values; nothing is formatted or
+serialised unless the level is enabled (and the event survives sampling), so
+disabled log calls cost one integer comparison.
+
+Configuration (environment variables):
+    LOG_LEVEL : DEBUG / INFO / WARNING / ERROR / OFF (default INFO)
+    LOG_SINK  : stdout / stderr / path to a JSONL file (default stdout)
+    LOG_SAMPLE_RATE : fraction of hot-path events (per search / feedback) to keep (default 1.0)
+
+使用方法:
+    from structured_log import get_logger
+    log = get_logger("sheets_logger")
+    log.info("feedback.queued", session_id=session_id, pending=3)
+    log.debug("search.logged", sample=0.01, results=10)   # 1% のみ出力
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import traceback
+from typing import Optional, TextIO
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+# 検索・フィードバックごとに出力されるイベントのサンプリング率
+HOT_PATH_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS_BY_NAME = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "OFF": OFF}
+
+class JSONLineSink:
+    """Thread-safe line writer for a stream or an append-only file"""
+
+    def __init__(self, target: str = "stdout"):
+        self._lock = threading.Lock()
+        if target == "stdout":
+            self._stream: TextIO = sys.stdout
+        elif target == "stderr":
+            self._stream = sys.stderr
+        else:
+            directory = os.path.dirname(target)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._stream = open(target, "a", encoding="utf-8", buffering=1)
+
+    def write(self, line: str):
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+class StructuredLogger:
+    def __init__(self, name: str, level: int, sink: JSONLineSink):
+        self.name = name
+        self.level = level
+        self.sink = sink
+
+    def is_enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, event: str, sample: float = 1.0, **fields):
+        """
+        Emit one JSON line
+
+        Args:
+            level: log level
+            event: event name (e.g. 'feedback.queued')
+            sample: fraction of calls to keep (for hot-path events)
+            **fields: additional structured fields
+        """
+        if level < self.level:
+            return
+        if sample < 1.0:
+            if random.random() >= sample:
+                return
+            fields["sample_rate"] = sample
+        record = {
+            "ts": round(time.time(), 6),
+            "level": LEVEL_NAMES.get(level, str(level)),
+            "logger": self.name,
+            "event": event,
+        }
+        record.update(fields)
+        self.sink.write(json.dumps(record, ensure_ascii=False, default=str))
+
+    def debug(self, event: str, sample: float = 1.0, **fields):
+        self.log(DEBUG, event, sample, **fields)
+
+    def info(self, event: str, sample: float = 1.0, **fields):
+        self.log(INFO, event, sample, **fields)
+
+    def warning(self, event: str, sample: float = 1.0, **fields):
+        self.log(WARNING, event, sample, **fields)
+
+    def error(self, event: str, sample: float = 1.0, **fields):
+        self.log(ERROR, event, sample, **fields)
+
+    def exception(self, event: str, **fields):
+        """Log at ERROR level with the current exception's traceback"""
+        if ERROR < self.level:
+            return
+        self.log(ERROR, event, traceback=traceback.format_exc(), **fields)
+
+_level = LEVELS_BY_NAME.get(os.environ.get("LOG_LEVEL", "INFO").upper(), INFO)
+_sink: Optional[JSONLineSink] = None
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+def configure(level: Optional[str] = None, sink: Optional[str] = None):
+    """
+    Change the level and/or sink of every logger
+
+    Args:
+        level: DEBUG / INFO / WARNING / ERROR / OFF
+        sink: stdout / stderr / file path
+    """
+    global _level, _sink
+    with _loggers_lock:
+        if level is not None:
+            _level = LEVELS_BY_NAME[level.upper()]
+        if sink is not None:
+            _sink = JSONLineSink(sink)
+        for logger in _loggers.values():
+            logger.level = _level
+            if _sink is not None:
+                logger.sink = _sink
+
+def get_logger(name: str) -> StructuredLogger:
+    """Get (or create) the logger for a component"""
+    global _sink
+    with _loggers_lock:
+        logger = _loggers.get(name)
+        if logger is None:
+            if _sink is None:
+                _sink = JSONLineSink(os.environ.get("LOG_SINK", "stdout"))
+            logger = StructuredLogger(name, _level, _sink)
+            _loggers[name] = logger
+        return logger
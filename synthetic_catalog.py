@@ -0,0 +1,213 @@
+"""
+大規模カタログの合成データ生成
+
+同梱のデータセット（約290枚）では件数に比例する処理の問題が見えないため、
+images / image_vectors と同じスキーマのデータベースに N 件（1万〜1000万件）の合成データを直接書き込む。
+
+    メタデータ: 実際の命名規則に沿ったファイル名（受付番号-カテゴリ-通し番号-撮影番号）、
+                ラベルCSVの説明文の色を入れ替えた説明文、カテゴリごとに実在する画像のパス（ギャラリー表示用）
+    特徴量: 正規化済みの 512 次元の乱数ベクトル（カテゴリごとの中心 + 落とし物ごとの成分 + 撮影ごとの揺らぎ。
+            同じ落とし物の別撮影どうしは類似度が高くなる）
+
+モデルの推論は行わないため、1000万件でも生成時間の大半はデータベースへの書き込みになる
+（1000万件のベクトルは約20GB）。
+
+使用方法:
+    python synthetic_catalog.py --items 100000 --output tmp/synthetic_100k.db
+    python synthetic_catalog.py --items 1000000 --output tmp/synthetic_1m.db --seed 1
+"""
+
+import os
+import csv
+import time
+import random
+import sqlite3
+import argparse
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+import sqlite_vec
+from batch_vectorize import CATEGORIES, DATA_IMG_DIR, DATA_LABEL_DIR
+from database_setup import setup_database
+from loadtest import COLOR_WORDS
+
+EMBEDDING_DIM = 512
+
+# ファイル名に入るカテゴリの表記
+FILENAME_CATEGORIES = {"カサ": "傘", "サイフ": "財布", "スマホ": "スマホ", "タオル": "タオル", "バッグ": "バッグ"}
+
+# 1つの落とし物あたりの撮影枚数の分布（1枚・2枚・3枚）
+SHOT_COUNTS = (1, 2, 3)
+SHOT_WEIGHTS = (0.5, 0.35, 0.15)
+
+# 1つの受付番号に含まれる落とし物の最大数
+ITEMS_PER_RECEIPT = 200
+
+# 特徴量の成分の大きさ（カテゴリの中心・落とし物ごと・撮影ごと）
+CATEGORY_WEIGHT = 0.6
+ITEM_WEIGHT = 1.0
+SHOT_WEIGHT = 0.3
+
+# 1回のトランザクションで書き込む件数
+DEFAULT_CHUNK_SIZE = 10000
+
+def load_category_samples() -> Dict[str, Tuple[List[str], List[str]]]:
+    """
+    カテゴリごとの説明文と実在する画像のパスを読み込み
+
+    Returns:
+        dict: {category: (説明文のリスト, 画像パスのリスト)}（ラベルCSVがない場合は仮の値）
+    """
+    samples = {}
+    for category in CATEGORIES:
+        descriptions, paths = [], []
+        label_file = os.path.join(DATA_LABEL_DIR, f"{category}.csv")
+        if os.path.exists(label_file):
+            with open(label_file, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    description = (row.get("説明文") or "").strip()
+                    if description:
+                        descriptions.append(description)
+                    path = os.path.join(DATA_IMG_DIR, category, row["ファイル名"])
+                    if os.path.exists(path):
+                        paths.append(path)
+        samples[category] = (
+            list(dict.fromkeys(descriptions)) or [f"{category}の落とし物"],
+            paths or [os.path.join(DATA_IMG_DIR, category, "synthetic.jpg")],
+        )
+    return samples
+
+def vary_description(description: str, rng: random.Random) -> str:
+    """説明文の色を入れ替えた説明文を作成（色が含まれない場合はそのまま）"""
+    for color in COLOR_WORDS:
+        if color in description:
+            return description.replace(color, rng.choice(COLOR_WORDS), 1)
+    return description
+
+def generate_rows(n_items: int, seed: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE
+                  ) -> Iterator[Tuple[List[tuple], np.ndarray]]:
+    """
+    合成データを chunk_size 件ずつ生成（同じ seed なら同じデータ）
+
+    Args:
+        n_items: 画像の件数
+        seed: 乱数のシード
+        chunk_size: 1回に返す件数
+
+    Yields:
+        (images の行 (id, filename, category, description, file_path) のリスト, 特徴量 [件数, 512])
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    samples = load_category_samples()
+    centers = np_rng.standard_normal((len(CATEGORIES), EMBEDDING_DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    # 受付番号（例: 24g000356）と通し番号はカテゴリごとに進める。
+    # 受付番号の末尾は全体の連番にして、件数が多くてもファイル名（落とし物の識別子）が重複しないようにする
+    receipts = {category: None for category in CATEGORIES}
+    item_numbers = {category: ITEMS_PER_RECEIPT for category in CATEGORIES}
+    receipt_count = 0
+
+    image_id = 0
+    while image_id < n_items:
+        rows: List[tuple] = []
+        category_indexes: List[int] = []
+        item_indexes: List[int] = []
+        n_chunk_items = 0
+        while len(rows) < chunk_size and image_id < n_items:
+            category_index = rng.randrange(len(CATEGORIES))
+            category = CATEGORIES[category_index]
+            if item_numbers[category] >= ITEMS_PER_RECEIPT:
+                receipt_count += 1
+                receipts[category] = f"{rng.randint(18, 25)}{rng.choice('abcdegkt')}{receipt_count:06d}"
+                item_numbers[category] = 0
+            item_numbers[category] += 1
+            descriptions, paths = samples[category]
+            description = vary_description(rng.choice(descriptions), rng)
+            shots = rng.choices(SHOT_COUNTS, SHOT_WEIGHTS)[0]
+            n_chunk_items += 1
+            for shot in range(1, min(shots, n_items - image_id) + 1):
+                image_id += 1
+                filename = (f"{receipts[category]}-{FILENAME_CATEGORIES.get(category, category)}-"
+                            f"{item_numbers[category]:04d}-{shot:02d}.jpg")
+                rows.append((image_id, filename, category, description, rng.choice(paths)))
+                category_indexes.append(category_index)
+                item_indexes.append(n_chunk_items - 1)
+
+        # 落とし物ごとの成分を撮影で共有し、撮影ごとの揺らぎを加える
+        item_vectors = np_rng.standard_normal((n_chunk_items, EMBEDDING_DIM)).astype(np.float32)
+        item_vectors /= np.sqrt(EMBEDDING_DIM)
+        shot_noise = np_rng.standard_normal((len(rows), EMBEDDING_DIM)).astype(np.float32) / np.sqrt(EMBEDDING_DIM)
+        vectors = (CATEGORY_WEIGHT * centers[category_indexes]
+                   + ITEM_WEIGHT * item_vectors[item_indexes]
+                   + SHOT_WEIGHT * shot_noise)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield rows, vectors.astype(np.float32)
+
+def generate_catalog(db_path: str, n_items: int, seed: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     progress: bool = True) -> dict:
+    """
+    合成データのデータベースを作成（既存のファイルは削除）
+
+    Args:
+        db_path: 作成するデータベースファイル
+        n_items: 画像の件数
+        seed: 乱数のシード
+        chunk_size: 1回のトランザクションで書き込む件数
+        progress: 進捗を表示するかどうか
+
+    Returns:
+        dict: {"items": 件数, "build_seconds": 作成時間, "db_bytes": ファイルサイズ}
+    """
+    start = time.perf_counter()
+    setup_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+    # 作り直せるデータなので書き込みの耐久性より速度を優先する
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    written = 0
+    for rows, vectors in generate_rows(n_items, seed, chunk_size):
+        with conn:
+            conn.executemany(
+                "INSERT INTO images (id, filename, category, description, file_path) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(
+                "INSERT INTO image_vectors (id, embedding) VALUES (?, ?)",
+                ((row[0], vector.tobytes()) for row, vector in zip(rows, vectors))
+            )
+        written += len(rows)
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"\r  {written:,} / {n_items:,} 件（{written / elapsed:,.0f} 件/秒）", end="", flush=True)
+    conn.execute("ANALYZE")
+    conn.close()
+    if progress:
+        print()
+
+    return {
+        "items": written,
+        "build_seconds": time.perf_counter() - start,
+        "db_bytes": os.path.getsize(db_path),
+    }
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="大規模カタログの合成データ生成")
+    parser.add_argument("--items", type=int, required=True, help="画像の件数")
+    parser.add_argument("--output", required=True, help="作成するデータベースファイル")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="1回のトランザクションで書き込む件数")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    print(f"合成データを作成中: {args.items:,} 件 → {args.output}")
+    result = generate_catalog(args.output, args.items, args.seed, args.chunk_size)
+    print(f"完了: {result['build_seconds']:.1f} 秒、{result['db_bytes'] / 1024 ** 2:,.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+サムネイルキャッシュ
+
+元画像のパス・サイズ・更新時刻をキーにして、UIで使う幅のサムネイルを
+ディスク上に保存する。元画像が更新されるとキーが変わるため、次回アクセス時に
+自動的に再生成される。
+
+使用方法:
+    python thumbnail_cache.py            # data/img 以下のサムネイルを事前生成
+    python thumbnail_cache.py --prune    # 元画像が変わって不要になったサムネイルも削除
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import tempfile
+from typing import Iterable, List, Optional
+from PIL import features
+from image_utils import load_thumbnail
+from metrics import CACHE_REQUESTS
+
+# サムネイルの保存先
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_CACHE_DIR", ".thumbnails")
+
+# 元画像のディレクトリ（アプリが表示する画像はすべてこの下にある）
+IMAGE_ROOT = "data/img"
+
+# UIで使うサムネイルの最大辺（検索結果: 幅200pxの2倍, ギャラリー: 列幅）
+THUMBNAIL_SIZES = (400, 800)
+
+# WebPが使えない環境ではJPEGで保存
+if features.check("webp"):
+    THUMBNAIL_FORMAT, THUMBNAIL_EXT = "WEBP", ".webp"
+else:
+    THUMBNAIL_FORMAT, THUMBNAIL_EXT = "JPEG", ".jpg"
+
+THUMBNAIL_QUALITY = 85
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+def pick_thumbnail_size(width: Optional[int] = None) -> int:
+    """
+    表示幅に対して十分な解像度のサムネイルサイズを選択
+
+    Args:
+        width: 表示幅（None の場合は最大サイズ）
+
+    Returns:
+        int: サムネイルの最大辺
+    """
+    if width:
+        for size in THUMBNAIL_SIZES:
+            if size >= width * 2:
+                return size
+    return THUMBNAIL_SIZES[-1]
+
+def _thumbnail_key(image_path: str, size: int) -> str:
+    """パス・サイズ・更新時刻からキャッシュキーを生成"""
+    stat = os.stat(image_path)
+    source = f"{os.path.abspath(image_path)}|{size}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+def thumbnail_path_for(image_path: str, size: int) -> str:
+    """サムネイルの保存先パスを取得（生成はしない）"""
+    key = _thumbnail_key(image_path, size)
+    return os.path.join(THUMBNAIL_DIR, key[:2], key + THUMBNAIL_EXT)
+
+def get_thumbnail(image_path: str, size: int) -> str:
+    """
+    サムネイルのパスを取得（存在しなければ生成）
+
+    Args:
+        image_path: 元画像のパス
+        size: サムネイルの最大辺
+
+    Returns:
+        str: サムネイルファイルのパス
+
+    Raises:
+        FileNotFoundError: 元画像が見つからない場合
+    """
+    thumb_path = thumbnail_path_for(image_path, size)
+    if os.path.exists(thumb_path):
+        CACHE_REQUESTS.inc(cache="thumbnail", result="hit")
+        return thumb_path
+
+    CACHE_REQUESTS.inc(cache="thumbnail", result="miss")
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    image = load_thumbnail(image_path, size)
+
+    # 書き込み途中のファイルを読まれないよう一時ファイル経由で配置
+    # （同じサムネイルを複数のセッションが同時に生成しても衝突しないよう呼び出しごとに作成）
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(thumb_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        os.replace(tmp_path, thumb_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return thumb_path
+
+def iter_image_files(root: str) -> Iterable[str]:
+    """ディレクトリ以下の画像ファイルを列挙"""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+def pregenerate_thumbnails(image_paths: Iterable[str], sizes: Iterable[int] = THUMBNAIL_SIZES) -> dict:
+    """
+    サムネイルを事前生成
+
+    Args:
+        image_paths: 元画像のパス
+        sizes: 生成するサムネイルサイズ
+
+    Returns:
+        dict: {'generated': 件数, 'cached': 件数, 'errors': 件数, 'paths': 有効なサムネイルのパス}
+    """
+    stats = {'generated': 0, 'cached': 0, 'errors': 0, 'paths': set()}
+    for image_path in image_paths:
+        for size in sizes:
+            try:
+                thumb_path = thumbnail_path_for(image_path, size)
+                if os.path.exists(thumb_path):
+                    stats['cached'] += 1
+                else:
+                    get_thumbnail(image_path, size)
+                    stats['generated'] += 1
+                stats['paths'].add(os.path.abspath(thumb_path))
+            except Exception as e:
+                print(f"エラー: サムネイル生成に失敗 ({image_path}, {size}px): {e}")
+                stats['errors'] += 1
+    return stats
+
+def current_thumbnail_paths(root: str = IMAGE_ROOT, sizes: Iterable[int] = THUMBNAIL_SIZES) -> set:
+    """root 以下の現在の元画像に対応するサムネイルのパス（存在するかは問わない）"""
+    paths = set()
+    for image_path in iter_image_files(root):
+        for size in sizes:
+            try:
+                paths.add(os.path.abspath(thumbnail_path_for(image_path, size)))
+            except OSError:
+                continue
+    return paths
+
+def prune_thumbnails(keep_paths: set) -> int:
+    """keep_paths に含まれないサムネイルを削除し、削除件数を返す"""
+    removed = 0
+    if not os.path.exists(THUMBNAIL_DIR):
+        return removed
+    for dirpath, _, filenames in os.walk(THUMBNAIL_DIR):
+        for filename in filenames:
+            path = os.path.abspath(os.path.join(dirpath, filename))
+            if path not in keep_paths:
+                os.remove(path)
+                removed += 1
+    return removed
+
+def main(argv: Optional[List[str]] = None):
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="サムネイルキャッシュの事前生成")
+    parser.add_argument("--root", default=IMAGE_ROOT, help="元画像のディレクトリ")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(THUMBNAIL_SIZES), help="生成するサイズ")
+    parser.add_argument("--prune", action="store_true", help="不要になったサムネイルを削除")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.root):
+        print(f"エラー: 画像ディレクトリが見つかりません: {args.root}")
+        sys.exit(1)
+
+    print(f"=== サムネイル事前生成 ({THUMBNAIL_FORMAT}) ===")
+    stats = pregenerate_thumbnails(iter_image_files(args.root), args.sizes)
+    print(f"  生成: {stats['generated']}件")
+    print(f"  キャッシュ済み: {stats['cached']}件")
+    print(f"  エラー: {stats['errors']}件")
+
+    if args.prune:
+        # --root / --sizes で生成対象を絞っても、アプリが使う他のサムネイルは残す
+        keep_paths = stats['paths'] | current_thumbnail_paths(IMAGE_ROOT, THUMBNAIL_SIZES)
+        removed = prune_thumbnails(keep_paths)
+        print(f"  削除: {removed}件")
+
+if __name__ == "__main__":
+    main()
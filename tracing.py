@@ -0,0 +1,230 @@
+"""
+検索処理のレイテンシ計測（軽量トレーシング）
+
+処理を入れ子のスパンで囲み、スパンごと（親スパンからのパス単位）に直近の所要時間を保持して
+p50 / p95 / p99 を集計する。直近のリクエスト単位のスパンツリーも保持し、JSONで書き出せる。
+
+計測は既定で無効（環境変数 TRACING=1 で有効化）。
+無効時のスパンは何もしないコンテキストマネージャーを返すだけなので、オーバーヘッドは無視できる。
+
+使用方法:
+    from tracing import span, traced
+
+    with span("search"):
+        with span("extract_text_features"):
+            ...
+
+    @traced("log_search_query")
+    def log_search_query(...):
+        ...
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+from functools import wraps
+from typing import Dict, List, Optional
+
+TRACING_ENABLED = os.environ.get("TRACING", "0") == "1"
+
+# スパンごとに保持する直近の計測数（パーセンタイルはこの範囲で計算）
+TRACE_WINDOW = int(os.environ.get("TRACE_WINDOW", 1000))
+# 保持する直近のリクエスト（ルートスパン）の件数
+RECENT_TRACES_MAX_LENGTH = 50
+
+# 入れ子のスパン名の区切り
+PATH_SEPARATOR = " > "
+
+class _NullSpan:
+    """計測無効時のスパン"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """計測中のスパン"""
+
+    __slots__ = ("name", "path", "start", "duration", "children", "attributes")
+
+    def __init__(self, name: str, attributes: Optional[dict] = None):
+        self.name = name
+        self.path = name
+        self.start = 0.0
+        self.duration = 0.0
+        self.children = []
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            parent = stack[-1]
+            self.path = parent.path + PATH_SEPARATOR + self.name
+            parent.children.append(self)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        _registry.record(self.path, self.duration)
+        if not stack:
+            _registry.add_trace(self)
+        return False
+
+    def to_dict(self) -> dict:
+        """スパンツリーを辞書に変換"""
+        result = {"name": self.name, "duration_ms": round(self.duration * 1000, 3)}
+        if self.attributes:
+            result["attributes"] = self.attributes
+        if self.children:
+            result["children"] = [child.to_dict() for child in self.children]
+        return result
+
+class SpanRegistry:
+    """スパンごとの直近の所要時間と、直近のリクエストのスパンツリー"""
+
+    def __init__(self, window: int = TRACE_WINDOW):
+        self.window = window
+        self._durations: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._recent_traces = deque(maxlen=RECENT_TRACES_MAX_LENGTH)
+        self._lock = threading.Lock()
+
+    def record(self, path: str, duration: float):
+        with self._lock:
+            durations = self._durations.get(path)
+            if durations is None:
+                durations = self._durations[path] = deque(maxlen=self.window)
+                self._counts[path] = 0
+            durations.append(duration)
+            self._counts[path] += 1
+
+    def add_trace(self, root: Span):
+        with self._lock:
+            self._recent_traces.append((time.time(), root))
+
+    def stats(self) -> Dict[str, dict]:
+        """スパンごとの集計（ミリ秒）"""
+        with self._lock:
+            snapshot = {path: (sorted(durations), self._counts[path]) for path, durations in self._durations.items()}
+        return {path: _summarize(durations, count) for path, (durations, count) in snapshot.items()}
+
+    def recent_traces(self) -> List[dict]:
+        """直近のリクエストのスパンツリー"""
+        with self._lock:
+            traces = list(self._recent_traces)
+        return [dict(timestamp=timestamp, **root.to_dict()) for timestamp, root in traces]
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._recent_traces.clear()
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """ソート済みの値の q パーセンタイル（最近傍順位法）"""
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def _summarize(sorted_durations: List[float], count: int) -> dict:
+    return {
+        "count": count,
+        "window": len(sorted_durations),
+        "p50_ms": round(_percentile(sorted_durations, 50) * 1000, 3),
+        "p95_ms": round(_percentile(sorted_durations, 95) * 1000, 3),
+        "p99_ms": round(_percentile(sorted_durations, 99) * 1000, 3),
+        "mean_ms": round(sum(sorted_durations) / len(sorted_durations) * 1000, 3),
+        "max_ms": round(sorted_durations[-1] * 1000, 3),
+    }
+
+_registry = SpanRegistry()
+_local = threading.local()
+
+def _stack() -> List[Span]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def is_enabled() -> bool:
+    """計測が有効かどうか"""
+    return TRACING_ENABLED
+
+def span(name: str, **attributes):
+    """
+    処理をスパンで囲む
+
+    Args:
+        name: スパン名（実行中のスパンがあればその子になる）
+        **attributes: スパンに付ける情報（直近のリクエストのツリーに表示）
+    """
+    if not TRACING_ENABLED:
+        return _NULL_SPAN
+    return Span(name, attributes or None)
+
+def traced(name: Optional[str] = None):
+    """関数全体をスパンで囲むデコレーター"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_stats() -> Dict[str, dict]:
+    """
+    スパンごとの所要時間の集計を取得
+
+    Returns:
+        dict: {スパンのパス: {count, window, p50_ms, p95_ms, p99_ms, mean_ms, max_ms}}
+    """
+    return _registry.stats()
+
+def get_recent_traces() -> List[dict]:
+    """直近のリクエストのスパンツリーを取得"""
+    return _registry.recent_traces()
+
+def export_json(path: Optional[str] = None) -> str:
+    """
+    集計と直近のスパンツリーをJSONで書き出す
+
+    Args:
+        path: 保存先（None の場合は文字列を返すのみ）
+
+    Returns:
+        str: JSON文字列
+    """
+    data = json.dumps({
+        "exported_at": time.time(),
+        "window": _registry.window,
+        "spans": get_stats(),
+        "recent_traces": get_recent_traces(),
+    }, ensure_ascii=False, indent=2)
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+    return data
+
+def reset():
+    """計測結果を消去"""
+    _registry.reset()